@@ -23,6 +23,7 @@ import logging
 import os
 import traceback
 
+from . import build
 from . import config
 from . import parse
 from .helpers import frontend
@@ -54,6 +55,9 @@ def main():
         else:
             logging.info("Run pmbootstrap -h for usage information.")
 
+        # Index repositories, where indexing has been postponed
+        build.other.index_flush(args)
+
         # Print finish timestamp
         logging.info("Done")
 
@@ -62,6 +66,12 @@ def main():
         logging.info("Run 'pmbootstrap log' for details.")
         logging.info("See also: <https://postmarketos.org/troubleshooting>")
         logging.debug(traceback.format_exc())
+
+        # Keep the packages, that have been built so far, in the index
+        try:
+            build.other.index_flush(args)
+        except Exception:
+            logging.debug(traceback.format_exc())
         return 1
 
 
@@ -55,6 +55,14 @@ def suffix(args, apkbuild, carch):
     return "buildroot_" + carch
 
 
+def crosscompile_packages(carch):
+    """
+    :returns: packages, that get installed in the native chroot for
+              crosscompiling to carch (see crosscompile())
+    """
+    return ["gcc-" + carch, "g++-" + carch, "ccache-cross-symlinks"]
+
+
 def crosscompile(args, apkbuild, carch, suffix):
     """
         :returns: None, "native" or "distcc"
@@ -0,0 +1,135 @@
+"""
+Copyright 2017 Oliver Smith
+
+This file is part of pmbootstrap.
+
+pmbootstrap is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+pmbootstrap is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with pmbootstrap.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+"""
+Built packages get stored in $WORK/cache_builds/<key>/, where the key is a
+checksum of everything that goes into the build: the aport's files, the
+architecture, the cross compile method and the versions of the installed
+makedepends and cross compilers. When the same
+build is requested again (e.g. after 'pmbootstrap zap -p'), the packages get
+copied from there instead of building them again.
+"""
+import hashlib
+import json
+import logging
+import os
+import shutil
+
+import pmb.build.autodetect
+import pmb.build.other
+import pmb.chroot.apk
+import pmb.config
+import pmb.helpers.run
+import pmb.parse.depends
+
+
+def versions(args, pkgnames, arch, suffix):
+    """
+    :returns: installed versions of the packages and their dependencies in a
+              chroot, like {"musl-dev": "1.1.18-r0", ...}
+    """
+    installed = pmb.chroot.apk.installed(args, suffix)
+    ret = {}
+    for pkgname in pmb.parse.depends.recurse(args, pkgnames, arch,
+                                             in_aports=False):
+        if pkgname in installed:
+            ret[pkgname] = installed[pkgname]["version"]
+    return ret
+
+
+def key(args, aport, arch, suffix, apkbuild, cross=None):
+    """
+    Calculate the key for a build. The makedepends and the cross compilers
+    must be installed already.
+
+    :param aport: full path to the aport folder
+    :param arch: architecture, that the package gets built for
+    :param suffix: build chroot suffix
+    :param cross: see pmb.build.autodetect.crosscompile()
+    :returns: sha256 hex digest
+    """
+    # Installed versions of the makedepends, like in the .buildinfo.json. But
+    # without the package itself: it is not in any APKINDEX before its first
+    # build, and the key must not change after that.
+    pkgnames = apkbuild["makedepends"] + ["abuild", "build-base"]
+    if cross == "distcc":
+        pkgnames.append("distcc")
+    data = {"aport": pmb.build.other.aport_hash(args, aport),
+            "arch": arch,
+            "cross": cross,
+            "versions": versions(args, pkgnames, arch, suffix)}
+
+    # The cross compilers in the native chroot
+    if cross:
+        data["versions_native"] = versions(
+            args, pmb.build.autodetect.crosscompile_packages(arch),
+            args.arch_native, "native")
+    return hashlib.sha256(json.dumps(data, sort_keys=True).encode()).hexdigest()
+
+
+def apks(apkbuild):
+    """
+    :returns: file names of all apks, that get built from an APKBUILD
+    """
+    version = apkbuild["pkgver"] + "-r" + apkbuild["pkgrel"]
+    return [pkgname + "-" + version + ".apk" for pkgname in
+            [apkbuild["pkgname"]] + apkbuild["subpackages"]]
+
+
+def save(args, cache_key, arch, apkbuild):
+    """
+    Copy the packages of a finished build to the cache.
+    """
+    target = args.work + "/cache_builds/" + cache_key
+    if os.path.exists(target):
+        return
+    os.makedirs(target + "_", exist_ok=True)
+    for apk in apks(apkbuild):
+        path = args.work + "/packages/" + arch + "/" + apk
+        if os.path.exists(path):
+            shutil.copy2(path, target + "_/" + apk)
+    os.replace(target + "_", target)
+
+
+def restore(args, cache_key, arch, apkbuild):
+    """
+    Copy the packages of an earlier build with the same key back to the
+    local repository, and mark it for indexing.
+
+    :returns: True when restored, False when the key is not in the cache
+    """
+    source = args.work + "/cache_builds/" + cache_key
+    if not os.path.exists(source):
+        return False
+    files = [source + "/" + apk for apk in sorted(os.listdir(source))]
+    if not files:
+        return False
+
+    logging.info("Restore " + arch + "/" + apks(apkbuild)[0] +
+                 " from the build cache (" + cache_key[:8] + ")")
+    target = args.work + "/packages/" + arch
+    if not os.path.exists(target):
+        pmb.helpers.run.root(args, ["mkdir", "-p", target])
+    pmb.helpers.run.root(args, ["cp", "-p"] + files + [target + "/"])
+    pmb.helpers.run.root(args, ["chown", pmb.config.chroot_uid_user + ":" +
+                                pmb.config.chroot_uid_user] +
+                         [target + "/" + os.path.basename(file) for file in
+                          files])
+    pmb.build.other.index_repo_later(args, arch)
+    return True
@@ -40,8 +40,7 @@ def generate(args, apk_path, arch, suffix, apkbuild):
     installed = pmb.chroot.apk.installed(args, suffix)
     relevant = (apkbuild["makedepends"] + [apkbuild["pkgname"], "abuild",
                                            "build-base"])
-    relevant = pmb.parse.depends.recurse(args, relevant, arch, in_aports=False,
-                                         strict=True)
+    relevant = pmb.parse.depends.recurse(args, relevant, arch, in_aports=False)
     for pkgname in relevant:
         if pkgname == apkbuild["pkgname"]:
             continue
@@ -0,0 +1,247 @@
+"""
+Copyright 2017 Oliver Smith
+
+This file is part of pmbootstrap.
+
+pmbootstrap is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+pmbootstrap is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with pmbootstrap.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+"""
+Incremental replacement for 'apk index' in the local repository. An apk is
+a concatenation of gzip streams: the (optional) signature, the control
+segment with the .PKGINFO and the data. Only the control segments of new or
+changed apks get read, the blocks of all other packages are taken from the
+existing APKINDEX as they are.
+"""
+import base64
+import hashlib
+import io
+import logging
+import multiprocessing.pool
+import os
+import tarfile
+import tempfile
+import time
+import traceback
+import zlib
+
+import pmb.config
+import pmb.helpers.run
+
+
+def gzip_members(handle):
+    """
+    Read the gzip streams at the beginning of a file one after another,
+    without reading the rest of the file.
+
+    :param handle: file object, opened in binary mode
+    :returns: generator of (compressed, decompressed) bytes for each stream
+    """
+    rest = b""
+    while True:
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        compressed = bytearray()
+        decompressed = []
+        chunk = rest
+        while not decompressor.eof:
+            if not chunk:
+                chunk = handle.read(65536)
+                if not chunk:
+                    raise RuntimeError("Unexpected end of gzip stream in " +
+                                       handle.name)
+            compressed += chunk
+            decompressed.append(decompressor.decompress(chunk))
+            chunk = b""
+        rest = decompressor.unused_data
+        yield (bytes(compressed[:len(compressed) - len(rest)]),
+               b"".join(decompressed))
+
+
+def pkginfo(path):
+    """
+    Read the .PKGINFO of an apk file.
+
+    :param path: full path to the apk
+    :returns: dictionary with the keys and values of the .PKGINFO, where
+              the values of "depend", "provides" and "install_if" are lists
+              and all other values are strings. Additionally, there is
+              "checksum" (apk's "Q1" + base64 encoded sha1 of the control
+              segment) and "file_size". Example:
+              { "pkgname": "hello-world",
+                "pkgver": "1-r2",
+                "depend": ["so:libc.musl-x86_64.so.1"],
+                "checksum": "Q1Wsl+bEJYu0AqV4eaq+Gsf8nzBhg=",
+                "file_size": "6712", ... }
+    """
+    with open(path, "rb") as handle:
+        for i, (compressed, decompressed) in enumerate(gzip_members(handle)):
+            with tarfile.open(fileobj=io.BytesIO(decompressed)) as tar:
+                names = tar.getnames()
+                if ".PKGINFO" in names:
+                    content = tar.extractfile(".PKGINFO").read().decode()
+                    break
+            if i or not all(name.startswith(".SIGN.") for name in names):
+                raise RuntimeError("Could not find .PKGINFO in " + path)
+
+    ret = {"depend": [], "provides": [], "install_if": []}
+    for line in content.splitlines():
+        if line.startswith("#") or " = " not in line:
+            continue
+        key, value = line.split(" = ", 1)
+        if key in ret and isinstance(ret[key], list):
+            ret[key].append(value)
+        else:
+            ret[key] = value
+    for key in ["pkgname", "pkgver"]:
+        if key not in ret:
+            raise RuntimeError("Missing key '" + key + "' in .PKGINFO of " +
+                               path)
+    sha1 = hashlib.sha1(compressed).digest()
+    ret["checksum"] = "Q1" + base64.b64encode(sha1).decode()
+    ret["file_size"] = str(os.path.getsize(path))
+    return ret
+
+
+def block(info, arch):
+    """
+    Generate an APKINDEX block in the same format as 'apk index'.
+
+    :param info: return value of pkginfo()
+    :param arch: architecture, that gets written instead of the one from the
+                 .PKGINFO (like 'apk index --rewrite-arch')
+    :returns: the block as string, ending with an empty line
+    """
+    lines = ["C:" + info["checksum"],
+             "P:" + info["pkgname"],
+             "V:" + info["pkgver"],
+             "A:" + arch,
+             "S:" + info["file_size"],
+             "I:" + info.get("size", "0"),
+             "T:" + info.get("pkgdesc", ""),
+             "U:" + info.get("url", ""),
+             "L:" + info.get("license", "")]
+    for key, pkginfo_key in [("o", "origin"), ("m", "maintainer"),
+                             ("t", "builddate"), ("c", "commit"),
+                             ("k", "provider_priority")]:
+        if info.get(pkginfo_key):
+            lines.append(key + ":" + info[pkginfo_key])
+    for key, pkginfo_key in [("D", "depend"), ("p", "provides"),
+                             ("i", "install_if")]:
+        if info[pkginfo_key]:
+            lines.append(key + ":" + " ".join(info[pkginfo_key]))
+    return "\n".join(lines) + "\n\n"
+
+
+def blocks_existing(path):
+    """
+    Read the blocks of an existing APKINDEX.tar.gz without parsing them.
+
+    :returns: {"hello-world-1-r2.apk": (block, file_size), ...}, where
+              block is the unmodified text of the block (see block())
+    """
+    ret = {}
+    with tarfile.open(path, "r:gz") as tar:
+        content = tar.extractfile(tar.getmember("APKINDEX")).read().decode()
+    for text in content.split("\n\n"):
+        if not text.strip():
+            continue
+        values = dict(line.split(":", 1) for line in text.splitlines()
+                      if line[1:2] == ":")
+        filename = values["P"] + "-" + values["V"] + ".apk"
+        ret[filename] = (text.strip("\n") + "\n\n", values.get("S"))
+    return ret
+
+
+def write(args, folder, arch, output):
+    """
+    Write an unsigned APKINDEX.tar.gz for a folder with apk files. The
+    .PKGINFO gets read from all apks, that are not in the folder's existing
+    APKINDEX.tar.gz, have a different size or have been modified after it.
+
+    :param folder: full path to the folder with the apks
+    :param output: full path to the APKINDEX.tar.gz, that gets written
+    :returns: number of apks, that have been read
+    """
+    path_old = folder + "/APKINDEX.tar.gz"
+    old = {}
+    lastmod_old = 0
+    if os.path.exists(path_old):
+        old = blocks_existing(path_old)
+        lastmod_old = os.stat(path_old).st_mtime
+
+    # Find new and changed apks
+    blocks = {}
+    todo = []
+    for entry in os.scandir(folder):
+        if not entry.name.endswith(".apk"):
+            continue
+        stat = entry.stat()
+        if (entry.name in old and old[entry.name][1] == str(stat.st_size) and
+                max(stat.st_mtime, stat.st_ctime) < lastmod_old):
+            blocks[entry.name] = old[entry.name][0]
+        else:
+            todo.append(entry.name)
+
+    # Read their .PKGINFO files
+    paths = [folder + "/" + name for name in todo]
+    if len(paths) > 1:
+        processes = min(len(paths), (os.cpu_count() or 1) * 2)
+        with multiprocessing.pool.ThreadPool(processes) as pool:
+            infos = pool.map(pkginfo, paths)
+    else:
+        infos = [pkginfo(path) for path in paths]
+    for name, info in zip(todo, infos):
+        logging.verbose(arch + ": read .PKGINFO of " + name)
+        blocks[name] = block(info, arch)
+
+    # Write the archive
+    content = "".join(blocks[name] for name in sorted(blocks)).encode()
+    tarinfo = tarfile.TarInfo("APKINDEX")
+    tarinfo.size = len(content)
+    tarinfo.mode = 0o644
+    tarinfo.mtime = int(time.time())
+    with tarfile.open(output, "w:gz", format=tarfile.USTAR_FORMAT) as tar:
+        tar.addfile(tarinfo, io.BytesIO(content))
+    return len(todo)
+
+
+def update(args, arch):
+    """
+    Write APKINDEX.tar.gz_ (unsigned) for a local repository with write(),
+    as replacement for running 'apk index' in the chroot.
+
+    :returns: True on success, False when the index could not be generated
+              and 'apk index' needs to be used instead
+    """
+    folder = args.work + "/packages/" + arch
+    handle, temp = tempfile.mkstemp(prefix="pmbootstrap_apkindex_")
+    os.close(handle)
+    os.chmod(temp, 0o644)
+    try:
+        try:
+            count = write(args, folder, arch, temp)
+        except (OSError, RuntimeError, KeyError, ValueError, EOFError,
+                tarfile.TarError, zlib.error):
+            logging.debug(traceback.format_exc())
+            logging.info("WARNING: Failed to update the " + arch +
+                         " APKINDEX incrementally, using 'apk index'")
+            return False
+        logging.debug(arch + ": " + str(count) + " apk(s) added to the index")
+        target = folder + "/APKINDEX.tar.gz_"
+        pmb.helpers.run.root(args, ["cp", temp, target])
+        pmb.helpers.run.root(args, ["chown", pmb.config.chroot_uid_user +
+                                    ":" + pmb.config.chroot_uid_user, target])
+        return True
+    finally:
+        os.remove(temp)
@@ -23,12 +23,17 @@ import glob
 import pmb.config
 import pmb.chroot
 import pmb.chroot.apk
+import pmb.chroot.overlay
+import pmb.chroot.snapshot
 import pmb.helpers.run
 
 
 def init(args, suffix="native"):
-    # Check if already initialized
+    # Check if already initialized (overlay chroots need to be mounted for
+    # that)
     marker = "/var/local/pmbootstrap_chroot_build_init_done"
+    if pmb.chroot.overlay.enabled(args, suffix):
+        pmb.chroot.mount(args, suffix)
     if os.path.exists(args.work + "/chroot_" + suffix + marker):
         return
 
@@ -84,3 +89,6 @@ def init(args, suffix="native"):
 
     # Mark the chroot as initialized
     pmb.chroot.root(args, ["touch", marker], suffix)
+
+    # Create new chroots from this state next time
+    pmb.chroot.snapshot.save(args, suffix)
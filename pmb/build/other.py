@@ -19,8 +19,13 @@ along with pmbootstrap.  If not, see <http://www.gnu.org/licenses/>.
 import os
 import logging
 import glob
+import hashlib
+import json
+import pickle
+import shlex
 import shutil
 
+import pmb.build.index
 import pmb.build.other
 import pmb.chroot
 import pmb.helpers.run
@@ -29,6 +34,62 @@ import pmb.parse.apkindex
 import pmb.parse.version
 
 
+def aports_index(args):
+    """
+    Map all pkgnames and subpackages in the aports folder to the aport folders,
+    that provide them. The index gets stored in $WORK/cache_aports_index.pickle
+    together with the last modified times of the APKBUILDs, so only changed
+    APKBUILDs need to be parsed again in the next pmbootstrap call.
+
+    :returns: dictionary like: {"hello-world": "/.../aports/main/hello-world",
+                                "hello-world-doc": "/.../main/hello-world"}
+    """
+    # Use the result from the current session
+    if args.cache["aports_index"] is not None:
+        return args.cache["aports_index"]
+
+    # Load the persistent cache
+    cache = args.work + "/cache_aports_index.pickle"
+    apkbuilds = {}
+    try:
+        with open(cache, "rb") as handle:
+            loaded = pickle.load(handle)
+        if loaded.get("aports") == args.aports:
+            apkbuilds = loaded["apkbuilds"]
+    except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+        pass
+
+    # Parse new and modified APKBUILDs, drop removed ones
+    current = {}
+    changed = []
+    for path in sorted(glob.glob(args.aports + "/*/*/APKBUILD")):
+        lastmod = os.path.getmtime(path)
+        if path in apkbuilds and apkbuilds[path][0] == lastmod:
+            current[path] = apkbuilds[path]
+        else:
+            current[path] = (lastmod, None)
+            changed.append(path)
+    for path, apkbuild in pmb.parse.apkbuild_many(args, changed).items():
+        current[path] = (current[path][0], [apkbuild["pkgname"]] +
+                         apkbuild["subpackages"])
+    if changed or len(current) != len(apkbuilds):
+        logging.verbose("Update aports index: " + cache)
+        os.makedirs(args.work, exist_ok=True)
+        with open(cache + "_", "wb") as handle:
+            pickle.dump({"aports": args.aports, "apkbuilds": current},
+                        handle, pickle.HIGHEST_PROTOCOL)
+        os.replace(cache + "_", cache)
+
+    # Build the index (first aport wins, like in the old subpackage search)
+    ret = {}
+    for path, (lastmod, pkgnames) in current.items():
+        for pkgname in pkgnames:
+            if pkgname not in ret:
+                ret[pkgname] = os.path.dirname(path)
+    args.cache["aports_index"] = ret
+    return ret
+
+
 def find_aport(args, package, must_exist=True):
     """
     Find the aport, that provides a certain subpackage.
@@ -52,11 +113,7 @@ def find_aport(args, package, must_exist=True):
             ret = paths[0]
         else:
             # Search in subpackages
-            for path_current in glob.glob(args.aports + "/*/*/APKBUILD"):
-                apkbuild = pmb.parse.apkbuild(args, path_current)
-                if package in apkbuild["subpackages"]:
-                    ret = os.path.dirname(path_current)
-                    break
+            ret = aports_index(args).get(package)
 
     # Crash when necessary
     if ret is None and must_exist:
@@ -68,23 +125,80 @@ def find_aport(args, package, must_exist=True):
     return ret
 
 
+def buildpath_files(path, sources=None):
+    """
+    List all files and folders inside a folder, for copy_to_buildpath().
+
+    :param sources: when set, do not descend into folders, that are not in
+                    this dictionary (e.g. abuild's src/ in the build folder)
+    :returns: {"relative/path": None for folders, (size, mtime) for files}
+    """
+    ret = {}
+    if not os.path.isdir(path) or not os.access(path, os.R_OK | os.X_OK):
+        return ret
+    for root, dirs, files in os.walk(path):
+        relative = os.path.relpath(root, path)
+        prefix = "" if relative == "." else relative + "/"
+        for folder in list(dirs):
+            ret[prefix + folder] = None
+            if sources is not None and sources.get(prefix + folder,
+                                                   False) is not None:
+                dirs.remove(folder)
+        for file in files:
+            stat = os.stat(os.path.join(root, file))
+            ret[prefix + file] = (stat.st_size, stat.st_mtime_ns)
+    return ret
+
+
 def copy_to_buildpath(args, package, suffix="native"):
+    """
+    Synchronize the aport folder with /home/user/build in the chroot. Only
+    files, that have changed since the last call, get copied, and everything
+    that is not part of the aport gets removed (e.g. the output of the last
+    build). All changes get done in one privileged shell call.
+    """
     # Sanity check
     aport = find_aport(args, package)
     if not os.path.exists(aport + "/APKBUILD"):
         raise ValueError("Path does not contain an APKBUILD file:" +
                          aport)
 
-    # Clean up folder
+    # Compare the aport with the build folder
     build = args.work + "/chroot_" + suffix + "/home/user/build"
-    if os.path.exists(build):
-        pmb.chroot.root(args, ["rm", "-rf", "/home/user/build"],
-                        suffix=suffix)
-
-    # Copy aport contents
-    pmb.helpers.run.root(args, ["cp", "-r", aport + "/", build])
-    pmb.chroot.root(args, ["chown", "-R", "user:user",
-                           "/home/user/build"], suffix=suffix)
+    sources = buildpath_files(aport)
+    targets = buildpath_files(build, sources)
+    remove = [path for path, stat in targets.items() if
+              path not in sources or (stat is None) != (sources[path] is None)]
+    remove = [path for path in remove if os.path.dirname(path) not in remove]
+    mkdir = [path for path, stat in sorted(sources.items()) if stat is None and
+             (path in remove or path not in targets)]
+    copy = [path for path, stat in sorted(sources.items()) if stat is not None
+            and (path in remove or targets.get(path) != stat)]
+    if not os.path.exists(build):
+        mkdir.insert(0, "")
+
+    # Apply the changes
+    if not remove and not mkdir and not copy:
+        return
+    logging.debug("Synchronize " + aport + " with " + build + " (remove: " +
+                  str(len(remove)) + ", copy: " + str(len(copy)) + ")")
+
+    def quote(paths, folder=build):
+        return " ".join(shlex.quote(os.path.join(folder, path))
+                        for path in paths)
+
+    uid = pmb.config.chroot_uid_user
+    script = "set -e\n"
+    if remove:
+        script += "rm -rf -- " + quote(remove) + "\n"
+    if mkdir:
+        script += "mkdir -p -- " + quote(mkdir) + "\n"
+    for path in copy:
+        script += ("cp -p -- " + quote([path], aport) + " " +
+                   quote([path]) + "\n")
+    if mkdir or copy:
+        script += "chown " + uid + ":" + uid + " -- " + quote(mkdir + copy)
+    pmb.helpers.run.root(args, ["sh", "-c", script])
 
 
 def aports_files_out_of_sync_with_git(args, package=None):
@@ -166,32 +280,106 @@ def sources_newer_than_binary_package(args, package, index_data):
                                               lastmod_target=lastmod_target)
 
 
-def is_necessary(args, arch, apkbuild, apkindex_path=None):
+def aport_hash(args, aport):
     """
-    Check if the package has already been built. Compared to abuild's check,
-    this check also works for different architectures, and it recognizes
-    changed files in an aport folder, even if the pkgver and pkgrel did not
-    change.
+    Calculate a checksum of all files inside an aport folder (file names and
+    contents), so changed sources can be detected without git and without
+    relying on the last modified timestamps. The result gets cached for the
+    current session (like pmb.parse.apkbuild(), we assume that the aports
+    do not change in one pmbootstrap call).
+
+    :param aport: full path to the aport folder
+    :returns: sha256 hex digest
+    """
+    if aport in args.cache["aport_hash"]:
+        return args.cache["aport_hash"][aport]
+
+    ret = hashlib.sha256()
+    for root, dirs, files in os.walk(aport):
+        dirs.sort()
+        for file in sorted(files):
+            path = os.path.join(root, file)
+            ret.update(os.path.relpath(path, aport).encode("utf-8") + b"\0")
+            with open(path, "rb") as handle:
+                ret.update(hashlib.sha256(handle.read()).digest())
+    args.cache["aport_hash"][aport] = ret.hexdigest()
+    return args.cache["aport_hash"][aport]
+
+
+def aport_hashes(args):
+    """
+    Load the checksums of the aports, that the packages in the local
+    repository were built from. They get stored in $WORK/aport_hashes.json
+    by aport_hash_save().
 
-    :param arch: package target architecture
-    :param apkbuild: from pmb.parse.apkbuild()
-    :param apkindex_path: override the APKINDEX.tar.gz path
-    :returns: boolean
+    :returns: {"x86_64": {"hello-world": {"version": "1-r4",
+                                          "hash": "..."}, ...}, ...}
+    """
+    if args.cache["aport_hashes"] is None:
+        try:
+            with open(args.work + "/aport_hashes.json") as handle:
+                args.cache["aport_hashes"] = json.load(handle)
+        except FileNotFoundError:
+            args.cache["aport_hashes"] = {}
+    return args.cache["aport_hashes"]
+
+
+def aport_hash_save(args, arches, apkbuild, aport):
+    """
+    Remember the checksum of an aport after building a package from it.
+
+    :param arches: list of architectures, in which repositories the package
+                   is now available (more than one for noarch packages)
+    """
+    hashes = aport_hashes(args)
+    entry = {"version": apkbuild["pkgver"] + "-r" + apkbuild["pkgrel"],
+             "hash": aport_hash(args, aport)}
+    for arch in arches:
+        hashes.setdefault(arch, {})[apkbuild["pkgname"]] = entry
+
+    path = args.work + "/aport_hashes.json"
+    with open(path + "_", "w") as handle:
+        json.dump(hashes, handle, indent=4, sort_keys=True)
+    os.replace(path + "_", path)
+
+
+def aport_hash_changed(args, arch, apkbuild, aport):
+    """
+    Compare an aport with the checksum, that was saved when building the
+    package in the local repository.
+
+    :returns: True/False when the aport has been changed since the build or
+              not, None when no checksum is available (package was not built
+              locally, was built by an older pmbootstrap version or has been
+              deleted in the meantime)
+    """
+    pkgname = apkbuild["pkgname"]
+    version = apkbuild["pkgver"] + "-r" + apkbuild["pkgrel"]
+    entry = aport_hashes(args).get(arch, {}).get(pkgname)
+    if not entry or entry["version"] != version:
+        return None
+    apk = args.work + "/packages/" + arch + "/" + pkgname + "-" + version
+    if not os.path.exists(apk + ".apk"):
+        return None
+    return entry["hash"] != aport_hash(args, aport)
+
+
+def is_necessary_reason(args, apkbuild, index_data, sources_changed):
+    """
+    Decide, if a package needs to be built, see is_necessary().
+
+    :param index_data: the package's entry from the APKINDEX or None
+    :param sources_changed: function without parameters, that returns True
+                            when the aport's files have changed since the
+                            binary package was built (see is_necessary()). It
+                            only gets called, when the versions are the same.
+    :returns: None when no build is necessary, otherwise the reason
     """
-    # Get package name, version, define start of debug message
+    # Get package name, version
     package = apkbuild["pkgname"]
     version_new = apkbuild["pkgver"] + "-r" + apkbuild["pkgrel"]
-    msg = "Build is necessary for package '" + package + "': "
-
-    # Get old version from APKINDEX
-    if apkindex_path:
-        index_data = pmb.parse.apkindex.read(
-            args, package, apkindex_path, False)
-    else:
-        index_data = pmb.parse.apkindex.read_any_index(args, package, arch)
     if not index_data:
-        logging.debug(msg + "No binary package available")
-        return True
+        return "No binary package available"
 
     # a) Binary repo has a newer version
     version_old = index_data["version"]
@@ -200,35 +388,66 @@ def is_necessary(args, arch, apkbuild, apkindex_path=None):
                         " has version " + version_new + ", but the binary package"
                         " repositories already have version " + version_old + "!"
                         " See also: <https://postmarketos.org/warning-repo2>")
-        return False
+        return None
 
     # b) Aports folder has a newer version
     if version_new != version_old:
-        logging.debug(msg + "Binary package out of date (binary: " + version_old +
-                      ", aport: " + version_new + ")")
-        return True
+        return ("Binary package out of date (binary: " + version_old +
+                ", aport: " + version_new + ")")
 
     # Aports and binary repo have the same version.
     if not args.timestamp_based_rebuild:
-        return False
-
-    # c) Same version, source files out of sync with upstream, source
-    # files newer than binary package
-    files_out_of_sync = aports_files_out_of_sync_with_git(args, package)
-    sources_newer = sources_newer_than_binary_package(
-        args, package, index_data)
-    if len(files_out_of_sync) and sources_newer:
-        logging.debug(msg + "Binary package and aport have the same pkgver and"
-                      " pkgrel, but there are aport source files out of sync"
-                      " with the upstream git repository *and* these source"
-                      " files have a more recent 'last modified' timestamp than"
-                      " the binary package's build timestamp.")
-        return True
+        return None
+
+    # c) Same version, source files changed
+    if sources_changed():
+        return ("Binary package and aport have the same pkgver and"
+                " pkgrel, but the aport source files have been changed"
+                " since the binary package was built.")
 
-    # d) Same version, source files *in sync* with upstream *or* source
-    # files *older* than binary package
+    # d) Same version, source files not changed
+    return None
+
+
+def is_necessary(args, arch, apkbuild, apkindex_path=None):
+    """
+    Check if the package has already been built. Compared to abuild's check,
+    this check also works for different architectures, and it recognizes
+    changed files in an aport folder, even if the pkgver and pkgrel did not
+    change.
+
+    :param arch: package target architecture
+    :param apkbuild: from pmb.parse.apkbuild()
+    :param apkindex_path: override the APKINDEX.tar.gz path
+    :returns: boolean
+    """
+    # Get old version from APKINDEX
+    package = apkbuild["pkgname"]
+    if apkindex_path:
+        index_data = pmb.parse.apkindex.read(
+            args, package, apkindex_path, False)
     else:
-        return False
+        index_data = pmb.parse.apkindex.read_any_index(args, package, arch)
+
+    def sources_changed():
+        # Compare with the checksum from the build
+        aport = find_aport(args, package)
+        changed = aport_hash_changed(args, arch or args.arch_native,
+                                     apkbuild, aport)
+        if changed is not None:
+            return changed
+
+        # Fallback: source files out of sync with upstream *and* newer than
+        # the binary package
+        return (len(aports_files_out_of_sync_with_git(args, package)) and
+                sources_newer_than_binary_package(args, package, index_data))
+
+    reason = is_necessary_reason(args, apkbuild, index_data, sources_changed)
+    if reason:
+        logging.debug("Build is necessary for package '" + package + "': " +
+                      reason)
+        return True
+    return False
 
 
 def index_repo(args, arch=None):
@@ -243,23 +462,49 @@ def index_repo(args, arch=None):
 
     if arch:
         paths = [args.work + "/packages/" + arch]
+        args.cache["index_pending"].discard(arch)
     else:
         paths = glob.glob(args.work + "/packages/*")
+        args.cache["index_pending"].clear()
 
     for path in paths:
         path_arch = os.path.basename(path)
         path_repo_chroot = "/home/user/packages/user/" + path_arch
         logging.info("(native) index " + path_arch + " repository")
-        commands = [
-            ["apk", "index", "--output", "APKINDEX.tar.gz_",
-             "--rewrite-arch", path_arch, "*.apk"],
+        commands = []
+        if not pmb.build.index.update(args, path_arch):
+            apks = sorted(os.path.basename(apk) for apk in
+                          glob.glob(path + "/*.apk"))
+            commands += [["apk", "index", "--output", "APKINDEX.tar.gz_",
+                          "--rewrite-arch", path_arch] + apks]
+        commands += [
             ["abuild-sign", "APKINDEX.tar.gz_"],
             ["mv", "APKINDEX.tar.gz_", "APKINDEX.tar.gz"]
         ]
-        for command in commands:
-            pmb.chroot.user(args, command, working_dir=path_repo_chroot)
-        pmb.parse.apkindex.clear_cache(args, args.work + path +
-                                       "/APKINDEX.tar.gz")
+        pmb.chroot.user_batch(args, commands, working_dir=path_repo_chroot)
+        pmb.parse.apkindex.clear_cache(args, path + "/APKINDEX.tar.gz")
+
+
+def index_repo_later(args, arch):
+    """
+    Mark a repo as changed, so it gets indexed only once with index_flush(),
+    no matter how many packages get added before the index is needed.
+    """
+    logging.verbose("Index " + arch + " repository later")
+    args.cache["index_pending"].add(arch)
+
+
+def index_flush(args, arch=None):
+    """
+    Index the repos, that have been marked with index_repo_later(). This
+    happens automatically, before the APKINDEX of such a repo gets read (see
+    pmb.parse.apkindex.flush_pending_index()), and when pmbootstrap exits.
+
+    :param arch: when not defined, index all marked repos
+    """
+    for pending in sorted(args.cache["index_pending"]):
+        if not arch or arch == pending:
+            index_repo(args, pending)
 
 
 def symlink_noarch_package(args, arch_apk):
@@ -274,10 +519,10 @@ def symlink_noarch_package(args, arch_apk):
         if not os.path.exists(arch_folder_outside):
             pmb.chroot.user(args, ["mkdir", "-p", arch_folder])
 
-        # Add symlink, rewrite index
+        # Add symlink, rewrite index when it is needed
         pmb.chroot.user(args, ["ln", "-sf", "../" + arch_apk, "."],
                         working_dir=arch_folder)
-        index_repo(args, arch)
+        index_repo_later(args, arch)
 
 
 def ccache_stats(args, arch):
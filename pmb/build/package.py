@@ -21,7 +21,9 @@ import logging
 
 import pmb.build
 import pmb.build.autodetect
+import pmb.build.binary_cache
 import pmb.build.buildinfo
+import pmb.build.timing
 import pmb.chroot
 import pmb.chroot.apk
 import pmb.chroot.distccd
@@ -29,6 +31,49 @@ import pmb.parse
 import pmb.parse.arch
 
 
+def run_abuild(args, apkbuild, carch_buildenv, suffix, cross, force, output,
+               timer=None):
+    """
+    Build a package with abuild inside the prepared build chroot.
+
+    :param output: output path relative to the packages folder
+    :param timer: see pmb.build.timing.start()
+    """
+    pkgname = apkbuild["pkgname"]
+    logging.info("(" + suffix + ") build " + output)
+
+    # Sanity check
+    if cross == "native" and "!tracedeps" not in apkbuild["options"]:
+        logging.info("WARNING: Option !tracedeps is not set, but we're"
+                     " cross-compiling in the native chroot. This will probably"
+                     " fail!")
+
+    # Run abuild with ignored dependencies
+    pmb.build.copy_to_buildpath(args, pkgname, suffix)
+    pmb.build.timing.phase(timer, "copy_to_buildpath")
+    cmd = []
+    env = {"CARCH": carch_buildenv}
+    if cross == "native":
+        hostspec = pmb.parse.arch.alpine_to_hostspec(carch_buildenv)
+        env["CROSS_COMPILE"] = hostspec + "-"
+        env["CC"] = hostspec + "-gcc"
+    if cross == "distcc":
+        env["PATH"] = "/usr/lib/distcc/bin:" + pmb.config.chroot_path
+        env["DISTCC_HOSTS"] = "127.0.0.1:" + args.port_distccd
+    for key, value in env.items():
+        cmd += [key + "=" + value]
+    cmd += ["abuild", "-d"]
+    if force:
+        cmd += ["-f"]
+    pmb.chroot.user(args, cmd, suffix, "/home/user/build")
+    pmb.build.timing.phase(timer, "abuild")
+
+    # Verify output file
+    path = args.work + "/packages/" + output
+    if not os.path.exists(path):
+        raise RuntimeError("Package not found after build: " + path)
+
+
 def package(args, pkgname, carch, force=False, buildinfo=False):
     """
     Build a package with Alpine Linux' abuild.
@@ -37,6 +82,7 @@ def package(args, pkgname, carch, force=False, buildinfo=False):
     :returns: output path relative to the packages folder
     """
     # Get aport, skip upstream only packages
+    timer = pmb.build.timing.start()
     aport = pmb.build.find_aport(args, pkgname, False)
     if not aport:
         if pmb.parse.apkindex.read_any_index(args, pkgname, carch):
@@ -51,23 +97,28 @@ def package(args, pkgname, carch, force=False, buildinfo=False):
     suffix = pmb.build.autodetect.suffix(args, apkbuild, carch_buildenv)
     cross = pmb.build.autodetect.crosscompile(args, apkbuild, carch_buildenv,
                                               suffix)
+    pmb.build.timing.phase(timer, "autodetect")
 
     # Skip already built versions
     if not force and not pmb.build.is_necessary(args, carch, apkbuild):
         return
+    pmb.build.timing.phase(timer, "is_necessary")
 
     # Initialize build environment, install/build makedepends
     pmb.build.init(args, suffix)
+    pmb.build.timing.phase(timer, "init")
     if len(apkbuild["makedepends"]):
         pmb.chroot.apk.install(args, apkbuild["makedepends"], suffix)
+    pmb.build.timing.phase(timer, "makedepends")
     if cross:
-        pmb.chroot.apk.install(args, ["gcc-" + carch_buildenv,
-                                      "g++-" + carch_buildenv,
-                                      "ccache-cross-symlinks"])
+        cross_packages = pmb.build.autodetect.crosscompile_packages(
+            carch_buildenv)
+        pmb.chroot.apk.install(args, cross_packages)
         if cross == "distcc":
             pmb.chroot.apk.install(args, ["distcc"], suffix=suffix,
                                    build=False)
             pmb.chroot.distccd.start(args, carch_buildenv)
+        pmb.build.timing.phase(timer, "cross")
 
     # Avoid re-building for circular dependencies
     if not force and not pmb.build.is_necessary(args, carch, apkbuild):
@@ -75,53 +126,47 @@ def package(args, pkgname, carch, force=False, buildinfo=False):
 
     # Configure abuild.conf
     pmb.build.other.configure_abuild(args, suffix)
+    pmb.build.timing.phase(timer, "configure_abuild")
 
-    # Generate output name, log build message
+    # Generate output name
     output = (carch_buildenv + "/" + apkbuild["pkgname"] + "-" +
               apkbuild["pkgver"] + "-r" + apkbuild["pkgrel"] + ".apk")
-    logging.info("(" + suffix + ") build " + output)
 
-    # Sanity check
-    if cross == "native" and "!tracedeps" not in apkbuild["options"]:
-        logging.info("WARNING: Option !tracedeps is not set, but we're"
-                     " cross-compiling in the native chroot. This will probably"
-                     " fail!")
-
-    # Run abuild with ignored dependencies
-    pmb.build.copy_to_buildpath(args, pkgname, suffix)
-    cmd = []
-    env = {"CARCH": carch_buildenv}
-    if cross == "native":
-        hostspec = pmb.parse.arch.alpine_to_hostspec(carch_buildenv)
-        env["CROSS_COMPILE"] = hostspec + "-"
-        env["CC"] = hostspec + "-gcc"
-    if cross == "distcc":
-        env["PATH"] = "/usr/lib/distcc/bin:" + pmb.config.chroot_path
-        env["DISTCC_HOSTS"] = "127.0.0.1:" + args.port_distccd
-    for key, value in env.items():
-        cmd += [key + "=" + value]
-    cmd += ["abuild", "-d"]
-    if force:
-        cmd += ["-f"]
-    pmb.chroot.user(args, cmd, suffix, "/home/user/build")
-
-    # Verify output file
-    path = args.work + "/packages/" + output
-    if not os.path.exists(path):
-        raise RuntimeError("Package not found after build: " + path)
+    # Restore the packages from an earlier build with the same inputs, or
+    # build them with abuild
+    cache_key = pmb.build.binary_cache.key(args, aport, carch_buildenv,
+                                           suffix, apkbuild, cross)
+    result = "restored"
+    if force or not pmb.build.binary_cache.restore(args, cache_key,
+                                                   carch_buildenv, apkbuild):
+        pmb.build.timing.phase(timer, "build_cache")
+        run_abuild(args, apkbuild, carch_buildenv, suffix, cross, force,
+                   output, timer)
+        pmb.build.binary_cache.save(args, cache_key, carch_buildenv, apkbuild)
+        result = "built"
+    pmb.build.timing.phase(timer, "build_cache")
 
     # Create .buildinfo.json file
     if buildinfo:
         logging.info("(" + suffix + ") generate " + output + ".buildinfo.json")
         pmb.build.buildinfo.write(args, output, carch_buildenv, suffix,
                                   apkbuild)
+        pmb.build.timing.phase(timer, "buildinfo")
 
     # Symlink noarch packages
+    arches = [carch_buildenv]
     if "noarch" in apkbuild["arch"]:
         pmb.build.symlink_noarch_package(args, output)
+        arches += pmb.config.build_device_architectures
+        pmb.build.timing.phase(timer, "symlink_noarch")
+
+    # Remember the aport's checksum for is_necessary()
+    pmb.build.other.aport_hash_save(args, arches, apkbuild, aport)
 
     # Clear APKINDEX cache
     pmb.parse.apkindex.clear_cache(args, args.work + "/packages/" +
                                    carch_buildenv + "/APKINDEX.tar.gz")
+    pmb.build.timing.phase(timer, "finish")
+    pmb.build.timing.save(args, timer, carch_buildenv, apkbuild, result)
 
     return output
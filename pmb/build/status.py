@@ -0,0 +1,156 @@
+"""
+Copyright 2017 Oliver Smith
+
+This file is part of pmbootstrap.
+
+pmbootstrap is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+pmbootstrap is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with pmbootstrap.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import glob
+import os
+
+import pmb.build.other
+import pmb.config
+import pmb.parse
+import pmb.parse.apkindex
+
+
+def arch_matches(args, apkbuild, arch):
+    """
+    Check if an aport gets built for a specific architecture. Packages with
+    arch="noarch" only get built for the native architecture (and then
+    symlinked to the other architectures).
+    """
+    arches = apkbuild["arch"]
+    if "!" + arch in arches:
+        return False
+    if "noarch" in arches:
+        return arch == args.arch_native
+    return "all" in arches or arch in arches
+
+
+def lastmod_aports(args, files):
+    """
+    Get the last modified timestamp of all aports with the given files.
+
+    :param files: full paths to files inside aport folders
+    :returns: {"/full/path/to/aport": last_modified_timestamp, ...}
+    """
+    aports_absolute = os.path.realpath(args.aports) + "/"
+    ret = {}
+    for file in files:
+        if not file.startswith(aports_absolute):
+            continue
+        split = file[len(aports_absolute):].split("/")
+        if len(split) < 3:
+            continue
+        aport = aports_absolute + split[0] + "/" + split[1]
+        if aport in ret:
+            continue
+        ret[aport] = max([entry.stat().st_mtime for entry in
+                          os.scandir(aport) if not entry.name.startswith(".")]
+                         or [0])
+    return ret
+
+
+def build_order(args, stale):
+    """
+    Sort packages, so dependencies inside the list get built first.
+
+    :param stale: {pkgname: apkbuild, ...}
+    :returns: list of pkgnames. Circular dependencies get resolved by taking
+              the alphabetically first package.
+    """
+    index = pmb.build.other.aports_index(args)
+    depends = {}
+    for pkgname, apkbuild in stale.items():
+        depends[pkgname] = set()
+        for depend in apkbuild["depends"] + apkbuild["makedepends"]:
+            aport = index.get(depend)
+            if aport and os.path.basename(aport) in stale:
+                depends[pkgname].add(os.path.basename(aport))
+        depends[pkgname].discard(pkgname)
+
+    ret = []
+    while depends:
+        ready = sorted(pkgname for pkgname, todo in depends.items()
+                       if not todo)
+        for pkgname in ready or [sorted(depends)[0]]:
+            ret.append(pkgname)
+            del depends[pkgname]
+            for todo in depends.values():
+                todo.discard(pkgname)
+    return ret
+
+
+def status(args, arches=None):
+    """
+    Find all aports, that need to be built (see pmb.build.is_necessary()),
+    for all architectures at once. All APKBUILDs get parsed in one go, the
+    APKINDEX files are read through one merged index per architecture. For
+    packages without aport checksum from the build, git gets called once and
+    only the aport folders with files out of sync with git get their
+    timestamps checked.
+
+    :param arches: list of architectures, defaults to the native one and
+                   pmb.config.build_device_architectures
+    :returns: list of (arch, pkgname, reason) in build order
+    """
+    if not arches:
+        arches = [args.arch_native]
+        arches += [arch for arch in pmb.config.build_device_architectures
+                   if arch != args.arch_native]
+
+    # Parse all APKBUILDs
+    paths = sorted(glob.glob(args.aports + "/*/*/APKBUILD"))
+    apkbuilds = pmb.parse.apkbuild_many(args, paths)
+
+    # Timestamps of the aports with files out of sync with git (only
+    # calculated when needed, see sources_changed() below)
+    lastmods = {}
+
+    def lastmod(aport):
+        if "git" not in lastmods:
+            files = pmb.build.other.aports_files_out_of_sync_with_git(args)
+            lastmods["git"] = lastmod_aports(args, files)
+        return lastmods["git"].get(aport)
+
+    ret = []
+    for arch in arches:
+        index = pmb.parse.apkindex.merged_index(args, arch)
+        stale = {}
+        reasons = {}
+        for path in paths:
+            apkbuild = apkbuilds[path]
+            if not arch_matches(args, apkbuild, arch):
+                continue
+            pkgname = apkbuild["pkgname"]
+            index_data = index.get(pkgname)
+            aport = os.path.realpath(os.path.dirname(path))
+
+            def sources_changed():
+                changed = pmb.build.other.aport_hash_changed(args, arch,
+                                                             apkbuild, aport)
+                if changed is not None:
+                    return changed
+                return (lastmod(aport) or 0) > float(index_data["timestamp"])
+
+            reason = pmb.build.other.is_necessary_reason(args, apkbuild,
+                                                         index_data,
+                                                         sources_changed)
+            if reason:
+                stale[pkgname] = apkbuild
+                reasons[pkgname] = reason
+        for pkgname in build_order(args, stale):
+            ret.append((arch, pkgname, reasons[pkgname]))
+    return ret
@@ -0,0 +1,167 @@
+"""
+Copyright 2017 Oliver Smith
+
+This file is part of pmbootstrap.
+
+pmbootstrap is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+pmbootstrap is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with pmbootstrap.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+"""
+Wall-clock time of each phase of pmb.build.package() gets recorded in
+$WORK/build_times.jsonl, one JSON object per build and line, so saving a
+build is a cheap append. 'pmbootstrap stats --builds' generates a report
+from it.
+"""
+import collections
+import json
+import logging
+import os
+import time
+
+
+def start():
+    """
+    Start measuring the phases of a build.
+
+    :returns: timer dictionary, that gets passed to phase() and save()
+    """
+    now = time.time()
+    return {"start": now,
+            "last": now,
+            "phases": collections.OrderedDict()}
+
+
+def phase(timer, name):
+    """
+    Finish a phase: record the time since the previous phase ended (or since
+    the timer was started).
+
+    :param timer: return value of start(), or None to do nothing
+    """
+    if not timer:
+        return
+    now = time.time()
+    timer["phases"][name] = (timer["phases"].get(name, 0) + now -
+                             timer["last"])
+    timer["last"] = now
+
+
+def save(args, timer, arch, apkbuild, result):
+    """
+    Append a finished build to $WORK/build_times.jsonl.
+
+    :param arch: architecture, that the package has been built for
+    :param result: "built" or "restored" (from the build cache)
+    """
+    entry = collections.OrderedDict([
+        ("date", int(timer["start"])),
+        ("arch", arch),
+        ("pkgname", apkbuild["pkgname"]),
+        ("version", apkbuild["pkgver"] + "-r" + apkbuild["pkgrel"]),
+        ("result", result),
+        ("total", round(timer["last"] - timer["start"], 3)),
+        ("phases", collections.OrderedDict(
+            (name, round(seconds, 3)) for name, seconds in
+            timer["phases"].items()))])
+    with open(args.work + "/build_times.jsonl", "a") as handle:
+        handle.write(json.dumps(entry) + "\n")
+
+
+def load(args):
+    """
+    :returns: list of all recorded builds (see save()), oldest first
+    """
+    path = args.work + "/build_times.jsonl"
+    if not os.path.exists(path):
+        return []
+    ret = []
+    with open(path) as handle:
+        for line in handle:
+            try:
+                ret.append(json.loads(line))
+            except ValueError:
+                logging.debug("Skipping invalid line in " + path + ": " +
+                              line)
+    return ret
+
+
+def format_seconds(seconds):
+    """
+    :returns: e.g. "1:02:03" for 3723 seconds, or "2.5s" below one minute
+    """
+    if seconds < 60:
+        return str(round(seconds, 1)) + "s"
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    if hours:
+        return "{}:{:02}:{:02}".format(hours, minutes, seconds)
+    return "{}:{:02}".format(minutes, seconds)
+
+
+def report(args, limit=10, arch=None):
+    """
+    Summarize the recorded builds.
+
+    :param limit: amount of slowest packages and of days, that get listed
+    :param arch: only include builds for this architecture
+    :returns: list of lines
+    """
+    builds = [build for build in load(args) if not arch or
+              build["arch"] == arch]
+    if not builds:
+        return ["No builds recorded yet (" + args.work + "/build_times.jsonl)"]
+
+    # Group by package, oldest build first
+    packages = collections.OrderedDict()
+    for build in builds:
+        key = build["arch"] + "/" + build["pkgname"]
+        packages.setdefault(key, []).append(build)
+
+    # Slowest packages by their latest build, with the trend compared to the
+    # average of their previous builds
+    ret = ["Slowest packages (latest build, builds, trend):"]
+    slowest = sorted(packages.items(), key=lambda item: -item[1][-1]["total"])
+    for key, history in slowest[:limit]:
+        latest = history[-1]
+        trend = "-"
+        if len(history) > 1:
+            previous = [build["total"] for build in history[:-1]]
+            average = sum(previous) / len(previous)
+            if average:
+                trend = "{:+.0%}".format(latest["total"] / average - 1)
+        ret.append("  {:<40} {:>9} {:>4}x {:>6}".format(
+            key, format_seconds(latest["total"]), len(history), trend))
+
+    # Where the time goes: sum of each phase over all builds
+    phases = collections.OrderedDict()
+    for build in builds:
+        for name, seconds in build["phases"].items():
+            phases[name] = phases.get(name, 0) + seconds
+    total = sum(phases.values()) or 1
+    ret.append("Time per phase (" + str(len(builds)) + " builds):")
+    for name, seconds in sorted(phases.items(), key=lambda item: -item[1]):
+        ret.append("  {:<20} {:>9} {:>5.1%}".format(
+            name, format_seconds(seconds), seconds / total))
+
+    # Trend over time: total build time per day
+    days = collections.OrderedDict()
+    for build in builds:
+        day = time.strftime("%Y-%m-%d", time.localtime(build["date"]))
+        count, seconds = days.get(day, (0, 0))
+        days[day] = (count + 1, seconds + build["total"])
+    ret.append("Builds per day:")
+    for day, (count, seconds) in list(days.items())[-limit:]:
+        ret.append("  {} {:>4}x {:>9}".format(day, count,
+                                              format_seconds(seconds)))
+    return ret
@@ -16,6 +16,7 @@ GNU General Public License for more details.
 You should have received a copy of the GNU General Public License
 along with pmbootstrap.  If not, see <http://www.gnu.org/licenses/>.
 """
+import glob
 import os
 import logging
 import shlex
@@ -180,6 +181,43 @@ def replace_aports_packages_with_path(args, packages, suffix, arch):
     return ret
 
 
+def size_estimate(args, packages, arch):
+    """
+    Estimate how much needs to be downloaded and how much disk space gets
+    used, when installing a list of packages. The sizes come from the
+    APKINDEX files. Packages from the local repository, and packages that
+    are in apk's cache with the same size already, do not need to be
+    downloaded.
+
+    :param packages: list of pkgnames, including all dependencies (see
+                     pmb.parse.depends.recurse())
+    :returns: (download, installed) sizes in bytes
+    """
+    download = 0
+    installed = 0
+    for package in packages:
+        index_data = pmb.parse.apkindex.read_any_index(args, package, arch)
+        if not index_data or index_data["size"] is None:
+            continue
+        size = int(index_data["size"])
+        installed += int(index_data["installed_size"] or 0)
+
+        # Skip local and cached packages
+        apk = index_data["pkgname"] + "-" + index_data["version"]
+        if os.path.exists(args.work + "/packages/" + arch + "/" + apk +
+                          ".apk"):
+            continue
+        cached = False
+        for path in glob.glob(args.work + "/cache_apk_" + arch + "/" +
+                              glob.escape(apk) + ".*.apk"):
+            if os.path.getsize(path) == size:
+                cached = True
+                break
+        if not cached:
+            download += size
+    return (download, installed)
+
+
 def install(args, packages, suffix="native", build=True):
     """
     :param build: automatically build the package, when it does not exist yet
@@ -193,8 +231,7 @@ def install(args, packages, suffix="native", build=True):
 
     # Add depends to packages
     arch = pmb.parse.arch.from_chroot_suffix(args, suffix)
-    packages_with_depends = pmb.parse.depends.recurse(args, packages, arch,
-                                                      strict=True)
+    packages_with_depends = pmb.parse.depends.recurse(args, packages, arch)
 
     # Filter out up-to-date packages
     packages_installed = installed(args, suffix)
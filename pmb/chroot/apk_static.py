@@ -154,13 +154,20 @@ def download(args, file):
     return pmb.helpers.http.download(args, base_url + "/" + file, file)
 
 
-def init(args):
+def latest_version(args):
     """
-    Download, verify, extract $WORK/apk.static.
+    Get the version of apk-tools-static from the (cached) Alpine APKINDEX.
     """
     apkindex = download(args, "APKINDEX.tar.gz")
     index_data = pmb.parse.apkindex.read(args, "apk-tools-static", apkindex)
-    version = index_data["version"]
+    return index_data["version"]
+
+
+def init(args):
+    """
+    Download, verify, extract $WORK/apk.static.
+    """
+    version = latest_version(args)
     version_min = pmb.config.apk_tools_static_min_version
     apk_name = "apk-tools-static-" + version + ".apk"
     if pmb.parse.version.compare(version, version_min) == -1:
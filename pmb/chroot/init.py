@@ -23,6 +23,7 @@ import filecmp
 
 import pmb.chroot
 import pmb.chroot.apk_static
+import pmb.chroot.snapshot
 import pmb.config
 import pmb.helpers.repo
 import pmb.helpers.run
@@ -52,7 +53,8 @@ def init(args, suffix="native"):
     emulate = pmb.parse.arch.cpu_emulation_required(args, arch)
 
     pmb.chroot.mount(args, suffix)
-    if os.path.islink(chroot + "/bin/sh"):
+    if (os.path.islink(chroot + "/bin/sh") or
+            pmb.chroot.snapshot.restore(args, suffix)):
         if emulate:
             pmb.chroot.binfmt.register(args, arch)
         copy_resolv_conf(args, suffix)
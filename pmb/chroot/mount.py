@@ -17,6 +17,7 @@ You should have received a copy of the GNU General Public License
 along with pmbootstrap.  If not, see <http://www.gnu.org/licenses/>.
 """
 import os
+import pmb.chroot.overlay
 import pmb.config
 import pmb.parse
 import pmb.helpers.mount
@@ -25,6 +26,10 @@ import pmb.helpers.mount
 def mount(args, suffix="native"):
     arch = pmb.parse.arch.from_chroot_suffix(args, suffix)
 
+    # Overlay chroots: mount the chroot folder itself first
+    if pmb.chroot.overlay.enabled(args, suffix):
+        pmb.chroot.overlay.mount(args, suffix)
+
     # Get all mountpoints
     mountpoints = {}
     for source, target in pmb.config.chroot_mount_bind.items():
@@ -0,0 +1,125 @@
+"""
+Copyright 2017 Oliver Smith
+
+This file is part of pmbootstrap.
+
+pmbootstrap is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+pmbootstrap is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with pmbootstrap.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+"""
+With --overlay-chroot, the native and buildroot chroots are overlayfs mounts:
+
+* lower layer (read-only): $WORK/chroot_base_<arch>_<key>, extracted once
+  from the chroot snapshot (see pmb.chroot.snapshot) and shared by all
+  chroots of that architecture
+* upper layer: $WORK/chroot_upper_<suffix>, everything that changed in the
+  chroot after its creation
+
+Zapping a chroot removes only its upper layer.
+"""
+import glob
+import logging
+import os
+
+import pmb.chroot.snapshot
+import pmb.helpers.mount
+import pmb.helpers.run
+import pmb.parse.arch
+
+
+def enabled(args, suffix):
+    return args.overlay_chroot and pmb.chroot.snapshot.supported(suffix)
+
+
+def base(args, suffix):
+    """
+    Get the lower layer for a chroot, extract it from the snapshot if
+    necessary.
+
+    :returns: full path to the lower layer, or None if there is no snapshot
+              yet (then the chroot gets created without overlay)
+    """
+    snapshot = pmb.chroot.snapshot.path(args, suffix)
+    if not os.path.exists(snapshot):
+        return None
+    name = os.path.basename(snapshot)[:-len(".tar.gz")]
+    ret = args.work + "/chroot_base_" + name
+    if os.path.exists(ret):
+        return ret
+
+    logging.info("(" + suffix + ") extract chroot base layer")
+    pmb.helpers.run.root(args, ["mkdir", "-p", ret + "_"])
+    pmb.helpers.run.root(args, ["tar", "-xzpf", snapshot, "--numeric-owner",
+                                "-C", ret + "_"])
+    pmb.helpers.run.root(args, ["mv", ret + "_", ret])
+
+    # Remove outdated lower layers of the same architecture, that are not used
+    # by a mounted chroot anymore
+    arch = pmb.parse.arch.from_chroot_suffix(args, suffix)
+    lowerdirs = pmb.helpers.mount.mount_table()["lowerdirs"]
+    for old in glob.glob(args.work + "/chroot_base_" + arch + "_*"):
+        if old != ret and os.path.realpath(old) not in lowerdirs:
+            pmb.helpers.run.root(args, ["rm", "-rf", old])
+    return ret
+
+
+def mount(args, suffix):
+    """
+    Mount the chroot folder as overlay. Existing chroots, that have been
+    created without overlay, stay as they are.
+
+    :returns: True when the chroot is an overlay mount
+    """
+    chroot = args.work + "/chroot_" + suffix
+    if pmb.helpers.mount.ismount(chroot):
+        return True
+    upper = args.work + "/chroot_upper_" + suffix
+    if (os.path.exists(chroot) and os.listdir(chroot) and
+            not os.path.exists(upper)):
+        return False
+    lower = base(args, suffix)
+    if not lower:
+        return False
+
+    # The upper layer only fits the lower layer, that it was created with (a
+    # missing marker means, that creating the upper layer was interrupted)
+    marker = upper + "/base"
+    if os.path.exists(upper):
+        base_upper = None
+        if os.path.exists(marker):
+            with open(marker) as handle:
+                base_upper = handle.read()
+        if base_upper != lower:
+            logging.info("(" + suffix + ") chroot base layer has changed,"
+                         " discarding the chroot's upper layer")
+            pmb.helpers.run.root(args, ["rm", "-rf", upper])
+    if not os.path.exists(upper):
+        pmb.helpers.run.user(args, ["mkdir", "-p", upper])
+        pmb.helpers.run.root(args, ["mkdir", upper + "/upper",
+                                    upper + "/work"])
+        with open(marker, "w") as handle:
+            handle.write(lower)
+
+    # Mount the overlay
+    if not os.path.exists(chroot):
+        pmb.helpers.run.root(args, ["mkdir", "-p", chroot])
+    pmb.helpers.run.root(args, ["mount", "-t", "overlay", "-o",
+                                "lowerdir=" + lower + ",upperdir=" + upper +
+                                "/upper,workdir=" + upper + "/work",
+                                "overlay", chroot])
+    pmb.helpers.mount.changed()
+    if not pmb.helpers.mount.ismount(chroot):
+        raise RuntimeError("Mount failed: overlay -> " + chroot + " (does"
+                           " your kernel support overlayfs?)")
+    return True
@@ -0,0 +1,143 @@
+"""
+Copyright 2017 Oliver Smith
+
+This file is part of pmbootstrap.
+
+pmbootstrap is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+pmbootstrap is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with pmbootstrap.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+"""
+With --resident-chroot, pmb.chroot.root() does not start sudo, sh and chroot
+for each command. Instead, one shell per chroot gets started once (with the
+same cleaned environment) and keeps running as root inside the chroot. The
+commands get written to its stdin, each one runs in a subshell, and a marker
+with the exit code gets printed after the output of each command.
+"""
+import codecs
+import logging
+import os
+import subprocess
+
+
+def start(args, suffix, cmd_full):
+    """
+    Start the resident shell for a chroot.
+
+    :param cmd_full: command, that starts "sh" inside the chroot as root
+                     (see pmb.chroot.root())
+    :returns: {"process": subprocess.Popen, "marker": bytes}
+    """
+    logging.debug("(" + suffix + ") start resident shell")
+    process = subprocess.Popen(cmd_full, stdin=subprocess.PIPE,
+                               stdout=subprocess.PIPE)
+    ret = {"process": process,
+           "marker": ("pmbootstrap-resident-" +
+                      os.urandom(8).hex()).encode()}
+    args.cache["resident"][suffix] = ret
+    return ret
+
+
+def stop(args, suffix=None):
+    """
+    Stop the resident shells by closing their stdin.
+
+    :param suffix: only stop the shell of this chroot (default: all)
+    """
+    for name in sorted(args.cache["resident"]):
+        if suffix and name != suffix:
+            continue
+        process = args.cache["resident"].pop(name)["process"]
+        logging.debug("(" + name + ") stop resident shell")
+        process.stdin.close()
+        process.wait()
+        process.stdout.close()
+
+
+def read_output(resident, handle_output):
+    """
+    Read the output of the current command until the marker.
+
+    :param handle_output: function, that gets called with each chunk of the
+                          command's output (bytes)
+    :returns: exit code of the command
+    """
+    marker = resident["marker"]
+    fd = resident["process"].stdout.fileno()
+    pending = b""
+    while True:
+        chunk = os.read(fd, 65536)
+        if not chunk:
+            raise RuntimeError("The resident shell exited unexpectedly")
+        pending += chunk
+        index = pending.find(marker)
+        if index == -1:
+            # Keep what could be the beginning of the marker
+            keep = len(pending) - len(marker) + 1
+            if keep > 0:
+                handle_output(pending[:keep])
+                pending = pending[keep:]
+            continue
+        end = pending.find(b"\n", index)
+        if end != -1:
+            handle_output(pending[:index])
+            return int(pending[index + len(marker):end])
+
+
+def run(args, suffix, cmd_full, cmd_inner_shell, log_message,
+        return_stdout=False, check=True):
+    """
+    Run a command in the resident shell of a chroot, start the shell if
+    necessary. Like pmb.helpers.run.core(), the output gets written to the
+    log (stderr only if return_stdout is not set). Commands with log=False
+    need the terminal and do not get passed to this function.
+
+    :param cmd_full: see start()
+    :param cmd_inner_shell: shell code, that gets run inside the chroot
+    """
+    logging.debug(log_message)
+    resident = args.cache["resident"].get(suffix)
+    if not resident or resident["process"].poll() is not None:
+        resident = start(args, suffix, cmd_full)
+
+    # Run the command in a subshell, so "cd" and variables do not leak into
+    # the next command
+    script = "(" + cmd_inner_shell + ") </dev/null"
+    if not return_stdout:
+        script += " 2>&1"
+    script += "; printf '%s%d\\n' " + resident["marker"].decode() + " $?\n"
+    process = resident["process"]
+    process.stdin.write(script.encode())
+    process.stdin.flush()
+
+    # Write the output to the log while the command runs
+    output = []
+    decoder = codecs.getincrementaldecoder("utf-8")("replace")
+
+    def handle_output(chunk):
+        if return_stdout:
+            output.append(chunk)
+        text = decoder.decode(chunk)
+        if text:
+            args.logfd.write(text)
+            args.logfd.flush()
+    code = read_output(resident, handle_output)
+
+    if code and check:
+        logging.debug("^" * 70)
+        logging.info("NOTE: The failed command's output is above"
+                     " the ^^^ line in the logfile: " + args.log)
+        raise RuntimeError("Command failed: " + log_message) from \
+            subprocess.CalledProcessError(code, log_message)
+    if return_stdout and not code:
+        return b"".join(output).decode("utf-8")
@@ -16,6 +16,8 @@ GNU General Public License for more details.
 You should have received a copy of the GNU General Public License
 along with pmbootstrap.  If not, see <http://www.gnu.org/licenses/>.
 """
+import functools
+import logging
 import os
 import shutil
 import shlex
@@ -23,12 +25,15 @@ import shlex
 import pmb.config
 import pmb.chroot
 import pmb.chroot.binfmt
+import pmb.chroot.resident
 import pmb.helpers.run
 
 
+@functools.lru_cache()
 def executables_absolute_path():
     """
-    Get the absolute paths to the sh and chroot executables.
+    Get the absolute paths to the sh and chroot executables. The result gets
+    cached, because this gets called for each command in a chroot.
     """
     ret = {}
     for binary in ["sh", "chroot"]:
@@ -40,13 +45,34 @@ def executables_absolute_path():
     return ret
 
 
-def root(args, cmd, suffix="native", working_dir="/", log=True,
-         auto_init=True, return_stdout=False, check=True):
+def shell_command(args, suffix="native", command="sh"):
     """
-    Run a command inside a chroot as root.
+    Get the command, that runs a command line inside a chroot as root (with
+    sudo chroot, and with cleaned environment variables).
 
-    :param log: When set to true, redirect all output to the logfile
-    :param auto_init: Automatically initialize the chroot
+    :param command: command line inside the chroot (the default "sh" reads
+                    the commands from stdin)
+    :returns: the command as list
+    """
+    executables = executables_absolute_path()
+    cmd_env = ("env -i" +  # unset all
+               " CHARSET=UTF-8" +
+               " PATH=" + pmb.config.chroot_path +
+               " SHELL=/bin/ash" +
+               " HISTFILE=~/.ash_history" +
+               " " + executables["chroot"] +
+               " " + args.work + "/chroot_" + suffix +
+               " " + command)
+    return ["sudo", executables["sh"], "-c", cmd_env]
+
+
+def shell(args, script, log_message, suffix="native", log=True,
+          auto_init=True, return_stdout=False, check=True):
+    """
+    Run shell code inside a chroot as root (see root() and root_batch()).
+
+    :param script: shell code, that gets passed to "sh -c" in the chroot
+    :param log_message: written to the log instead of the script
     """
     # Get and verify chroot folder
     chroot = args.work + "/chroot_" + suffix
@@ -56,31 +82,97 @@ def root(args, cmd, suffix="native", working_dir="/", log=True,
     if auto_init:
         pmb.chroot.init(args, suffix)
 
-    # Run the args with sudo chroot, and with cleaned environment
-    # variables
-    executables = executables_absolute_path()
+    # Run the command in the resident shell (not for interactive commands)
+    if args.resident_chroot and log:
+        cmd_resident = shell_command(args, suffix)
+        return pmb.chroot.resident.run(args, suffix, cmd_resident, script,
+                                       log_message, return_stdout, check)
+
+    # Run the command with sudo chroot
+    cmd_full = shell_command(args, suffix, "sh -c " + shlex.quote(script))
+    return pmb.helpers.run.core(args, cmd_full, log_message, log,
+                                return_stdout, check)
+
+
+def root(args, cmd, suffix="native", working_dir="/", log=True,
+         auto_init=True, return_stdout=False, check=True):
+    """
+    Run a command inside a chroot as root.
+
+    :param log: When set to true, redirect all output to the logfile
+    :param auto_init: Automatically initialize the chroot
+    """
     for i in range(len(cmd)):
         cmd[i] = shlex.quote(cmd[i])
     cmd_inner_shell = ("cd " + shlex.quote(working_dir) + ";" +
                        " ".join(cmd))
 
-    cmd_full = ["sudo", executables["sh"], "-c",
-                "env -i" +  # unset all
-                " CHARSET=UTF-8" +
-                " PATH=" + pmb.config.chroot_path +
-                " SHELL=/bin/ash" +
-                " HISTFILE=~/.ash_history" +
-                " " + executables["chroot"] +
-                " " + chroot +
-                " sh -c " + shlex.quote(cmd_inner_shell)
-                ]
-
     # Generate log message
     log_message = "(" + suffix + ") % "
     if working_dir != "/":
         log_message += "cd " + working_dir + " && "
     log_message += " ".join(cmd)
 
-    # Run the command
-    return pmb.helpers.run.core(args, cmd_full, log_message, log,
-                                return_stdout, check)
+    return shell(args, cmd_inner_shell, log_message, suffix, log, auto_init,
+                 return_stdout, check)
+
+
+def batch_script(cmds, working_dir):
+    """
+    Generate a shell script, that runs multiple commands after each other
+    and stops at the first failing one.
+
+    :param cmds: list of commands, e.g. [["mkdir", "-p", "/tmp/a"], ...]
+    :returns: (script, log_message). The script prints each command before
+              running it (so the output in the log can be told apart), and
+              exits with the number of the failed command (starting at 1).
+    """
+    if len(cmds) > 250:
+        raise RuntimeError("Too many commands in one batch: " +
+                           str(len(cmds)))
+    script = "cd " + shlex.quote(working_dir) + " || exit 255\n"
+    steps = []
+    for i, cmd in enumerate(cmds, 1):
+        line = " ".join(shlex.quote(arg) for arg in cmd)
+        steps.append(line)
+        script += ("echo " + shlex.quote("% [" + str(i) + "/" +
+                                         str(len(cmds)) + "] " + line) +
+                   "\n" + line + " || exit " + str(i) + "\n")
+    log_message = ""
+    if working_dir != "/":
+        log_message += "cd " + working_dir + " && "
+    log_message += " && ".join(steps)
+    return (script, log_message)
+
+
+def batch(args, cmds, script, log_message, suffix, log, auto_init, check):
+    """
+    Run a script from batch_script() and find out, which command failed.
+    """
+    try:
+        shell(args, script, log_message, suffix, log, auto_init)
+    except RuntimeError as e:
+        step = getattr(e.__cause__, "returncode", None)
+        if not step or step > len(cmds):
+            raise
+        message = ("Command failed: (" + suffix + ") % " +
+                   " ".join(cmds[step - 1]) + " (step " + str(step) + "/" +
+                   str(len(cmds)) + ")")
+        if check:
+            raise RuntimeError(message) from e
+        logging.debug(message)
+
+
+def root_batch(args, cmds, suffix="native", working_dir="/", log=True,
+               auto_init=True, check=True):
+    """
+    Run multiple commands inside a chroot as root, with only one chroot
+    invocation. The commands run in order, and the first failing command
+    stops the batch.
+
+    :param cmds: list of commands, e.g. [["mkdir", "-p", "/tmp/a"], ...]
+    :param check: raise an exception, which names the failing command
+    """
+    script, log_message = batch_script(cmds, working_dir)
+    batch(args, cmds, script, "(" + suffix + ") % " + log_message, suffix,
+          log, auto_init, check)
@@ -24,8 +24,10 @@ from contextlib import closing
 
 import pmb.chroot
 import pmb.chroot.distccd
+import pmb.chroot.resident
 import pmb.helpers.mount
 import pmb.install.losetup
+import pmb.parse
 import pmb.parse.arch
 
 
@@ -90,6 +92,8 @@ def shutdown(args, only_install_related=False):
 
     if not only_install_related:
         # Clean up the rest
+        pmb.chroot.resident.stop(args)
+        pmb.parse.apkbuild_eval_stop(args)
         pmb.helpers.mount.umount_all(args, args.work)
         arch = args.deviceinfo["arch"]
         if pmb.parse.arch.cpu_emulation_required(args, arch):
@@ -0,0 +1,124 @@
+"""
+Copyright 2017 Oliver Smith
+
+This file is part of pmbootstrap.
+
+pmbootstrap is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+pmbootstrap is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with pmbootstrap.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+"""
+After pmb.build.init() has prepared a native or buildroot chroot, a
+compressed snapshot of it gets stored in $WORK/cache_chroot_snapshot/. When
+the chroot gets created again (e.g. after 'pmbootstrap zap'), it gets
+extracted from there instead of installing alpine-base and the build
+packages from scratch. The snapshot's name contains a checksum of everything
+that went into it, so it is not used anymore when one of these changes.
+"""
+import glob
+import hashlib
+import json
+import logging
+import os
+
+import pmb.chroot.apk
+import pmb.chroot.apk_static
+import pmb.config
+import pmb.helpers.mount
+import pmb.helpers.run
+import pmb.parse.arch
+
+
+def supported(suffix):
+    """
+    Only chroots for building get snapshots, the rootfs chroots of devices
+    must not contain the build packages.
+    """
+    return suffix == "native" or suffix.startswith("buildroot_")
+
+
+def path(args, suffix):
+    """
+    :returns: full path to the snapshot file for a chroot, e.g.
+              "$WORK/cache_chroot_snapshot/armhf_0123456789abcdef.tar.gz"
+    """
+    arch = pmb.parse.arch.from_chroot_suffix(args, suffix)
+    data = {"arch": arch,
+            "apk_tools": pmb.chroot.apk_static.latest_version(args),
+            "build_packages": pmb.config.build_packages,
+            "alpine_version": args.alpine_version,
+            "mirror_alpine": args.mirror_alpine,
+            "mirror_postmarketos": args.mirror_postmarketos}
+    key = hashlib.sha256(json.dumps(data, sort_keys=True).encode()).hexdigest()
+    return (args.work + "/cache_chroot_snapshot/" + arch + "_" + key[:16] +
+            ".tar.gz")
+
+
+def save(args, suffix):
+    """
+    Store a snapshot of a chroot, unless there is one already. Older snapshots
+    for the same architecture get removed.
+    """
+    if not supported(suffix):
+        return
+    target = path(args, suffix)
+    if os.path.exists(target):
+        return
+
+    # Skip the mounted folders, their content is not part of the chroot (the
+    # mountpoints are resolved, $WORK may be a symlink)
+    chroot = args.work + "/chroot_" + suffix
+    chroot_realpath = os.path.realpath(chroot)
+    excludes = []
+    for mountpoint in pmb.helpers.mount.umount_all_list(chroot):
+        excludes += ["--exclude", "." + mountpoint[len(chroot_realpath):]]
+
+    logging.info("(" + suffix + ") save chroot snapshot")
+    folder = os.path.dirname(target)
+    if not os.path.exists(folder):
+        pmb.helpers.run.user(args, ["mkdir", "-p", folder])
+    pmb.helpers.run.root(args, ["tar", "-czf", target + "_",
+                                "--numeric-owner", "-C", chroot] + excludes +
+                         ["."])
+    pmb.helpers.run.root(args, ["mv", target + "_", target])
+
+    arch = pmb.parse.arch.from_chroot_suffix(args, suffix)
+    for old in glob.glob(folder + "/" + arch + "_*.tar.gz"):
+        if old != target:
+            pmb.helpers.run.root(args, ["rm", old])
+
+
+def restore(args, suffix):
+    """
+    Extract the snapshot of a chroot, that does not exist yet.
+
+    :returns: True when restored, False when there is no usable snapshot
+    """
+    if not supported(suffix):
+        return False
+    source = path(args, suffix)
+    if not os.path.exists(source):
+        return False
+
+    # Non-native chroot: the binfmt registration needs qemu-user-static in
+    # the native chroot (like in pmb.chroot.init())
+    arch = pmb.parse.arch.from_chroot_suffix(args, suffix)
+    if pmb.parse.arch.cpu_emulation_required(args, arch):
+        pmb.chroot.apk.install(args, ["qemu-user-static-repack",
+                                      "qemu-user-static-repack-binfmt"])
+
+    logging.info("(" + suffix + ") restore chroot snapshot")
+    chroot = args.work + "/chroot_" + suffix
+    pmb.helpers.run.root(args, ["tar", "-xzpf", source, "--numeric-owner",
+                                "-C", chroot])
+    return True
@@ -16,7 +16,10 @@ GNU General Public License for more details.
 You should have received a copy of the GNU General Public License
 along with pmbootstrap.  If not, see <http://www.gnu.org/licenses/>.
 """
+import shlex
+
 import pmb.chroot.root
+from pmb.chroot.root import batch, batch_script
 
 
 def user(args, cmd, suffix="native", working_dir="/", log=True,
@@ -30,3 +33,15 @@ def user(args, cmd, suffix="native", working_dir="/", log=True,
     cmd = ["su", "user", "-c", " ".join(cmd)]
     return pmb.chroot.root(args, cmd, suffix, working_dir, log,
                            auto_init, return_stdout, check)
+
+
+def user_batch(args, cmds, suffix="native", working_dir="/", log=True,
+               auto_init=True, check=True):
+    """
+    Run multiple commands inside a chroot as "user", with only one chroot
+    invocation (see pmb.chroot.root_batch()).
+    """
+    script, log_message = batch_script(cmds, working_dir)
+    batch(args, cmds, "su user -c " + shlex.quote(script),
+          "(" + suffix + ") % su user -c " + shlex.quote(log_message), suffix,
+          log, auto_init, check)
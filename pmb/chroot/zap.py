@@ -24,12 +24,14 @@ import pmb.chroot
 import pmb.helpers.run
 
 
-def zap(args, confirm=True, packages=False, http=False, mismatch_bins=False):
+def zap(args, confirm=True, packages=False, http=False, mismatch_bins=False,
+        build_cache=False):
     pmb.chroot.shutdown(args)
     patterns = [
         "chroot_native",
         "chroot_buildroot_*",
         "chroot_rootfs_*",
+        "chroot_upper_*",
     ]
 
     # Only ask for removal, if the user specificed the extra '-p' switch.
@@ -37,7 +39,9 @@ def zap(args, confirm=True, packages=False, http=False, mismatch_bins=False):
     if packages:
         patterns += ["packages"]
     if http:
-        patterns += ["cache_http"]
+        patterns += ["cache_http", "cache_apkindex"]
+    if build_cache:
+        patterns += ["cache_builds"]
 
     for pattern in patterns:
         pattern = os.path.realpath(args.work + "/" + pattern)
@@ -57,12 +61,21 @@ def binaries(args):
         arch = arch_dir.name
         arch_pkg_path = os.path.realpath(args.work) + "/packages/" + arch
         bin_apks = pmb.parse.apkindex.parse(args, arch_pkg_path + "/APKINDEX.tar.gz")
+
+        # Parse all APKBUILDs at once
+        aports = {}
+        for bin_apk in bin_apks:
+            bin_pkgname = bin_apks[bin_apk]["pkgname"]
+            # Do not fail if unable to find aport
+            aports[bin_pkgname] = pmb.build.other.find_aport(args, bin_pkgname, False)
+        pmb.parse.apkbuild_many(args, [aport + "/APKBUILD" for aport in
+                                       aports.values() if aport])
+
         for bin_apk in bin_apks:
             bin_pkgname = bin_apks[bin_apk]["pkgname"]
             bin_version = bin_apks[bin_apk]["version"]
             bin_apk_path = arch_pkg_path + "/" + bin_pkgname + "-" + bin_version + ".apk"
-            # Do not fail if unable to find aport
-            aport = pmb.build.other.find_aport(args, bin_pkgname, False)
+            aport = aports[bin_pkgname]
             if not aport:
                 logging.warning("WARNING: Could not resolve aport for package " + bin_apk_path)
                 continue
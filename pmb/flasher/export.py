@@ -138,8 +138,7 @@ def odin_flashable_tar(args, flavor, folder):
                 ["sh", "/tmp/_odin.sh"],
                 ["rm", "/tmp/_odin.sh"]
                 ]
-    for command in commands:
-        pmb.chroot.root(args, command, suffix)
+    pmb.chroot.root_batch(args, commands, suffix)
 
     # Move Odin flashable tar to native chroot and cleanup temp folder
     pmb.chroot.user(args, ["mkdir", "-p", "/home/user/rootfs"])
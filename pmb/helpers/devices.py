@@ -37,8 +37,8 @@ def list_apkbuilds(args):
     """
     :returns: { "first-device": {"pkgname": ..., "pkgver": ...}, ... }
     """
-    ret = {}
-    for device in list(args):
-        apkbuild_path = args.aports + "/device-" + device + "/APKBUILD"
-        ret[device] = pmb.parse.apkbuild(args, apkbuild_path)
-    return ret
+    devices = list(args)
+    paths = [args.aports + "/device/device-" + device + "/APKBUILD" for
+             device in devices]
+    apkbuilds = pmb.parse.apkbuild_many(args, paths)
+    return {device: apkbuilds[path] for device, path in zip(devices, paths)}
@@ -25,6 +25,7 @@ import sys
 
 import pmb.aportgen
 import pmb.build
+import pmb.build.timing
 import pmb.config
 import pmb.challenge
 import pmb.chroot
@@ -157,7 +158,7 @@ def parse_apkindex(args):
             raise RuntimeError("Package not found in the APKINDEX: " +
                                args.package)
         result = result[args.package]
-    print(json.dumps(result, indent=4))
+    print(json.dumps(result, indent=4, default=dict))
 
 
 def qemu(args):
@@ -168,7 +169,19 @@ def shutdown(args):
     pmb.chroot.shutdown(args)
 
 
+def status(args):
+    ret = pmb.build.status(args, args.arches)
+    for arch, pkgname, reason in ret:
+        print(arch + "/" + pkgname + ": " + reason)
+    if not ret:
+        logging.info("All aports are up to date")
+
+
 def stats(args):
+    if args.builds:
+        for line in pmb.build.timing.report(args, args.limit, args.arch):
+            print(line)
+        return
     pmb.build.ccache_stats(args, args.arch)
 
 
@@ -187,4 +200,6 @@ def log_distccd(args):
 
 
 def zap(args):
-    pmb.chroot.zap(args, packages=args.packages, http=args.http, mismatch_bins=args.mismatch_bins)
+    pmb.chroot.zap(args, packages=args.packages, http=args.http,
+                   mismatch_bins=args.mismatch_bins,
+                   build_cache=args.build_cache)
@@ -17,23 +17,83 @@ You should have received a copy of the GNU General Public License
 along with pmbootstrap.  If not, see <http://www.gnu.org/licenses/>.
 """
 import os
+import select
 import pmb.helpers.run
 
+# Parsed /proc/mounts of this pmbootstrap session (see mount_table())
+mount_table_cache = {}
+
+
+def parse_mounts(handle, source):
+    """
+    Parse a mount table in the format of /proc/mounts.
+
+    :param handle: iterable over the lines
+    :param source: file name for error messages
+    :returns: {"mountpoints": list of all mount points, in the order of the
+               file, "lookup": set of all mount points and mount sources,
+               "lowerdirs": set of the lower layers of all overlay mounts}
+    """
+    mountpoints = []
+    lookup = set()
+    lowerdirs = set()
+    for line in handle:
+        words = line.split()
+        if len(words) < 2:
+            raise RuntimeError("Failed to parse line in " + source + ": " +
+                               line)
+        mountpoints.append(words[1])
+        lookup.update(words[:2])
+        if len(words) > 3 and words[2] == "overlay":
+            for option in words[3].split(","):
+                if option.startswith("lowerdir="):
+                    lowerdirs.update(option[len("lowerdir="):].split(":"))
+    return {"mountpoints": mountpoints, "lookup": lookup,
+            "lowerdirs": lowerdirs}
+
+
+def mount_table():
+    """
+    Get the parsed /proc/mounts. The file stays open for the whole session,
+    and only gets read again when the kernel reports a change through poll()
+    (POLLPRI), or when pmbootstrap has mounted or umounted something itself
+    (see changed()).
+
+    :returns: see parse_mounts()
+    """
+    table = mount_table_cache
+    if not table:
+        handle = open("/proc/mounts", "r")
+        poll = select.poll()
+        poll.register(handle, select.POLLPRI | select.POLLERR)
+        table.update({"handle": handle, "poll": poll, "stale": True})
+
+    # Polling resets the change notification, so do it before reading
+    events = table["poll"].poll(0)
+    if table["stale"] or any(event & (select.POLLPRI | select.POLLERR)
+                             for fd, event in events):
+        table["handle"].seek(0)
+        table.update(parse_mounts(table["handle"].read().splitlines(),
+                                  "/proc/mounts"))
+        table["stale"] = False
+    return table
+
+
+def changed():
+    """
+    Read the mount table again on the next lookup, after mounting or
+    umounting something.
+    """
+    if mount_table_cache:
+        mount_table_cache["stale"] = True
+
 
 def ismount(folder):
     """
     Ismount() implementation, that works for mount --bind.
     Workaround for: https://bugs.python.org/issue29707
     """
-    folder = os.path.realpath(os.path.realpath(folder))
-    with open("/proc/mounts", "r") as handle:
-        for line in handle:
-            words = line.split()
-            if len(words) >= 2 and words[1] == folder:
-                return True
-            if words[0] == folder:
-                return True
-    return False
+    return os.path.realpath(folder) in mount_table()["lookup"]
 
 
 def bind(args, source, destination, create_folders=True):
@@ -55,6 +115,7 @@ def bind(args, source, destination, create_folders=True):
 
     # Actually mount the folder
     pmb.helpers.run.root(args, ["mount", "--bind", source, destination])
+    changed()
 
     # Verify, that it has worked
     if not ismount(destination):
@@ -77,6 +138,7 @@ def bind_blockdevice(args, source, destination):
     # Mount
     pmb.helpers.run.root(args, ["mount", "--bind", source,
                                 destination])
+    changed()
 
 
 def umount_all_list(prefix, source="/proc/mounts"):
@@ -85,16 +147,14 @@ def umount_all_list(prefix, source="/proc/mounts"):
     :source: can be changed for testcases
     :returns: a list of folders, that need to be umounted
     """
-    ret = []
+    if source == "/proc/mounts":
+        mountpoints = mount_table()["mountpoints"]
+    else:
+        with open(source, "r") as handle:
+            mountpoints = parse_mounts(handle, source)["mountpoints"]
     prefix = os.path.realpath(prefix)
-    with open(source, "r") as handle:
-        for line in handle:
-            words = line.split()
-            if len(words) < 2:
-                raise RuntimeError("Failed to parse line in " + source + ": " +
-                                   line)
-            if words[1].startswith(prefix):
-                ret.append(words[1])
+    ret = [mountpoint for mountpoint in mountpoints
+           if mountpoint.startswith(prefix)]
     ret.sort(reverse=True)
     return ret
 
@@ -105,5 +165,6 @@ def umount_all(args, folder):
     """
     for mountpoint in umount_all_list(folder):
         pmb.helpers.run.root(args, ["umount", mountpoint])
+        changed()
         if ismount(mountpoint):
             raise RuntimeError("Failed to umount: " + mountpoint)
@@ -30,6 +30,7 @@ import pmb.install.blockdevice
 import pmb.install.file
 import pmb.install.recovery
 import pmb.install
+import pmb.parse.depends
 
 
 def mount_device_rootfs(args, suffix="native"):
@@ -265,6 +266,16 @@ def install(args):
     for pkgname in install_packages:
         pmb.build.package(args, pkgname, args.deviceinfo["arch"])
 
+    # Estimate the download volume and the size of the rootfs
+    arch = args.deviceinfo["arch"]
+    packages = pmb.parse.depends.recurse(args, install_packages, arch)
+    (download, installed) = pmb.chroot.apk.size_estimate(args, packages,
+                                                         arch)
+    logging.info("(" + suffix + ") " + str(len(packages)) + " packages,"
+                 " download: {:.1f} MiB, installed size: {:.1f} MiB"
+                 " (estimated)".format(download / 1024 / 1024,
+                                       installed / 1024 / 1024))
+
     # Install all packages to device rootfs chroot (and rebuild the initramfs,
     # because that doesn't always happen automatically yet, e.g. when the user
     # installed a hook without pmbootstrap - see #69 for more info)
@@ -59,5 +59,4 @@ def create_zip(args, suffix):
         ["tar", "-pczf", "rootfs.tar.gz", "--exclude", "./home/user/*",
          "-C", rootfs, "."],
         ["build-recovery-zip"]]
-    for command in commands:
-        pmb.chroot.root(args, command, suffix, working_dir=zip_root)
+    pmb.chroot.root_batch(args, commands, suffix, working_dir=zip_root)
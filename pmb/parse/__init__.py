@@ -17,7 +17,8 @@ You should have received a copy of the GNU General Public License
 along with pmbootstrap.  If not, see <http://www.gnu.org/licenses/>.
 """
 from pmb.parse.arguments import arguments
-from pmb.parse.apkbuild import apkbuild
+from pmb.parse.apkbuild import apkbuild, apkbuild_many, apkbuild_eval, \
+    apkbuild_eval_stop
 from pmb.parse.binfmt_info import binfmt_info
 from pmb.parse.deviceinfo import deviceinfo
 import pmb.parse.arch
@@ -16,9 +16,16 @@ GNU General Public License for more details.
 You should have received a copy of the GNU General Public License
 along with pmbootstrap.  If not, see <http://www.gnu.org/licenses/>.
 """
+import hashlib
 import os
 import logging
+import multiprocessing
+import pickle
+import shlex
+import subprocess
+import pmb.chroot
 import pmb.config
+from pmb.chroot.root import shell_command
 
 
 def replace_variables(apkbuild):
@@ -96,42 +103,95 @@ def apkbuild(args, path):
     if path in args.cache["apkbuild"]:
         return args.cache["apkbuild"][path]
 
+    # Parse and fill cache
+    ret = parse_file(path)
+    args.cache["apkbuild"][path] = ret
+    return ret
+
+
+def apkbuild_many(args, paths):
+    """
+    Parse multiple APKBUILD files at once. When many of them are not in the
+    cache yet, they get parsed in parallel with one process per CPU core.
+    With --eval-apkbuilds, they get evaluated with apkbuild_eval() instead,
+    and apkbuild() returns the exact values for them afterwards.
+
+    :param paths: list of full paths to APKBUILDs
+    :returns: dictionary with the paths as keys and the apkbuild() results
+              as values
+    """
+    missing = [path for path in set(paths)
+               if path not in args.cache["apkbuild"]]
+    processes = min(os.cpu_count() or 1, len(missing) // 16)
+    if args.eval_apkbuilds and missing:
+        args.cache["apkbuild"].update(apkbuild_eval(args, missing))
+    elif processes > 1:
+        with multiprocessing.Pool(processes) as pool:
+            results = pool.map(parse_file, missing, 8)
+        for path, ret in zip(missing, results):
+            args.cache["apkbuild"][path] = ret
+
+    return {path: apkbuild(args, path) for path in paths}
+
+
+def parse_value(lines, i):
+    """
+    Get the value of the variable assigned in one line of an APKBUILD. Values
+    in double quotes may span multiple lines, these get joined with spaces.
+
+    :param lines: all lines of the APKBUILD
+    :param i: index of the line with the assignment
+    :returns: the value without quotes (not split up, even for arrays)
+    """
+    # Values on the last line get ignored
+    last = len(lines) - 1
+    if i == last:
+        return ""
+
+    # Unquoted value
+    line_value = lines[i].split("=", 1)[1][:-1]
+    if not line_value.startswith("\""):
+        return line_value.replace("\"", "").strip()
+
+    # Quoted value: extend until we reach the line with the ending quote sign
+    # (the opening quote may be directly followed by a line break)
+    parts = [line_value.replace("\"", "").strip()]
+    if line_value.endswith("\"") and line_value.count("\"") > 1:
+        return parts[0]
+    while i < last - 1:
+        i += 1
+        line_value = lines[i][:-1]
+        parts.append(line_value.replace("\"", "").strip())
+        if line_value.endswith("\""):
+            return " ".join(parts)
+
+    # Not terminated
+    return " ".join(parts) + " "
+
+
+def parse_file(path):
+    """
+    Parse an APKBUILD without using the cache, see apkbuild().
+    """
     with open(path, encoding="utf-8") as handle:
         lines = handle.readlines()
 
-    # Parse all attributes from the config
+    # Parse all attributes from the config in one pass
+    attributes = pmb.config.apkbuild_attributes
     ret = {}
-    for i in range(len(lines)):
-        for attribute, options in pmb.config.apkbuild_attributes.items():
-            if not lines[i].startswith(attribute + "="):
-                continue
-
-            # Extend the line value until we reach the ending quote sign
-            line_value = lines[i][len(attribute + "="):-1]
-            end_char = None
-            if line_value.startswith("\""):
-                end_char = "\""
-            value = ""
-            first_line = i
-            while i < len(lines) - 1:
-                value += line_value.replace("\"", "").strip()
-                if not end_char:
-                    break
-                elif line_value.endswith(end_char):
-                    # This check is needed to allow line break directly after opening quote
-                    if i != first_line or line_value.count(end_char) > 1:
-                        break
-                value += " "
-                i += 1
-                line_value = lines[i][:-1]
-
-            # Split up arrays, delete empty strings inside the list
-            if options["array"]:
-                if value:
-                    value = list(filter(None, value.split(" ")))
-                else:
-                    value = []
-            ret[attribute] = value
+    for i, line in enumerate(lines):
+        attribute, sep, _ = line.partition("=")
+        if not sep or attribute not in attributes:
+            continue
+        value = parse_value(lines, i)
+
+        # Split up arrays, delete empty strings inside the list
+        if attributes[attribute]["array"]:
+            if value:
+                value = list(filter(None, value.split(" ")))
+            else:
+                value = []
+        ret[attribute] = value
 
     # Add missing keys
     for attribute, options in pmb.config.apkbuild_attributes.items():
@@ -145,14 +205,150 @@ def apkbuild(args, path):
     ret = replace_variables(ret)
     ret = cut_off_function_names(ret)
 
-    # Sanity check: pkgname
-    suffix = "/" + ret["pkgname"] + "/APKBUILD"
+    check_pkgname(path, ret)
+    return ret
+
+
+def check_pkgname(path, apkbuild):
+    """
+    Sanity check: the pkgname must be equal to the APKBUILD's folder name.
+    """
+    suffix = "/" + apkbuild["pkgname"] + "/APKBUILD"
     if not os.path.realpath(path).endswith(suffix):
         logging.info("Folder: '" + os.path.dirname(path) + "'")
-        logging.info("Pkgname: '" + ret["pkgname"] + "'")
+        logging.info("Pkgname: '" + apkbuild["pkgname"] + "'")
         raise RuntimeError("The pkgname must be equal to the name of"
                            " the folder, that contains the APKBUILD!")
 
-    # Fill cache
-    args.cache["apkbuild"][path] = ret
+
+def eval_shell(args):
+    """
+    Get the shell process, that evaluates the APKBUILDs for apkbuild_eval().
+    It runs as "user" in the native chroot (like all other APKBUILD code that
+    pmbootstrap runs), gets started once and then keeps running until
+    apkbuild_eval_stop() gets called.
+
+    :returns: (process, marker), where the marker is printed by the shell at
+              the end of each APKBUILD's output
+    """
+    shell = args.cache["apkbuild_eval_shell"]
+    if shell is None or shell[0].poll() is not None:
+        pmb.chroot.init(args)
+        cmd = shell_command(args, "native", "su user -s /bin/sh")
+        logging.debug("(native) % su user -s /bin/sh (evaluate APKBUILDs)")
+        process = subprocess.Popen(cmd, stdin=subprocess.PIPE,
+                                   stdout=subprocess.PIPE, stderr=args.logfd)
+
+        # Helper functions of abuild, e.g. arch_to_hostspec()
+        functions = "/usr/share/abuild/functions.sh"
+        process.stdin.write(("[ -e " + functions + " ] && . " + functions +
+                             " >/dev/null\ncd /tmp\n").encode())
+        marker = ("pmbootstrap-end-" + os.urandom(8).hex() + "\n").encode()
+        shell = (process, marker)
+        args.cache["apkbuild_eval_shell"] = shell
+    return shell
+
+
+def apkbuild_eval_stop(args):
+    """
+    Stop the shell process of apkbuild_eval(), if it is running.
+    """
+    shell = args.cache["apkbuild_eval_shell"]
+    if shell is None:
+        return
+    args.cache["apkbuild_eval_shell"] = None
+    process = shell[0]
+    process.stdin.close()
+    process.wait()
+    process.stdout.close()
+
+
+def eval_file(args, path):
+    """
+    Source one APKBUILD in a subshell of the eval_shell() process and print
+    the values of all attributes from pmb.config.apkbuild_attributes. The
+    APKBUILD gets passed as here-document, so the aports folder does not
+    need to be inside the chroot.
+
+    :returns: the unprocessed values as strings, like {"pkgname": "...", ...}
+    """
+    (process, marker) = eval_shell(args)
+    attributes = list(pmb.config.apkbuild_attributes.keys())
+    with open(path, encoding="utf-8") as handle:
+        content = handle.read()
+    delimiter = marker.decode().strip()
+    script = ("(startdir=/home/user/build && eval \"$(cat)\" &&"
+              " printf '%s\\0'" +
+              "".join(" \"$" + attribute + "\"" for attribute in attributes) +
+              ") <<'" + delimiter + "'\n" + content + "\n" + delimiter + "\n"
+              "printf '%s\\0%s' \"$?\" " +
+              shlex.quote(marker.decode()) + "\n")
+    process.stdin.write(script.encode())
+    process.stdin.flush()
+
+    # Read until the marker
+    output = b""
+    while not output.endswith(marker):
+        chunk = os.read(process.stdout.fileno(), 65536)
+        if not chunk:
+            raise RuntimeError("The shell for evaluating APKBUILDs exited"
+                               " unexpectedly (see log): " + path)
+        output += chunk
+    values = output[:-len(marker)].split(b"\0")[:-1]
+    if values[-1] != b"0" or len(values) != len(attributes) + 1:
+        raise RuntimeError("Failed to evaluate APKBUILD (see log): " + path)
+    return {attribute: value.decode("utf-8") for attribute, value in
+            zip(attributes, values)}
+
+
+def apkbuild_eval(args, paths):
+    """
+    Parse APKBUILDs by sourcing them with a shell, instead of the Python
+    parser from apkbuild(). All variables get expanded like abuild does it,
+    so the result is exact, but the APKBUILD code gets executed (without
+    building anything). All APKBUILDs run through the same shell process,
+    and the results get stored in $WORK/cache_apkbuild_eval.pickle with the
+    sha1 of each APKBUILD as key.
+
+    :param paths: list of full paths to APKBUILDs
+    :returns: dictionary with the paths as keys and dictionaries like
+              apkbuild() returns them as values
+    """
+    # Load the persistent cache
+    cache_path = args.work + "/cache_apkbuild_eval.pickle"
+    attributes = pmb.config.apkbuild_attributes
+    cache = args.cache["apkbuild_eval"]
+    if cache is None:
+        cache = {}
+        try:
+            with open(cache_path, "rb") as handle:
+                loaded = pickle.load(handle)
+            if loaded.get("attributes") == list(attributes.keys()):
+                cache = loaded["results"]
+        except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+            pass
+        args.cache["apkbuild_eval"] = cache
+
+    ret = {}
+    changed = False
+    for path in paths:
+        with open(path, "rb") as handle:
+            checksum = hashlib.sha1(handle.read()).hexdigest()
+        if checksum not in cache:
+            values = eval_file(args, path)
+            for attribute, options in attributes.items():
+                if options["array"]:
+                    values[attribute] = values[attribute].split()
+            cache[checksum] = cut_off_function_names(values)
+            changed = True
+        check_pkgname(path, cache[checksum])
+        ret[path] = cache[checksum]
+
+    # Save the persistent cache
+    if changed:
+        os.makedirs(args.work, exist_ok=True)
+        with open(cache_path + "_", "wb") as handle:
+            pickle.dump({"attributes": list(attributes.keys()),
+                         "results": cache}, handle, pickle.HIGHEST_PROTOCOL)
+        os.replace(cache_path + "_", cache_path)
     return ret
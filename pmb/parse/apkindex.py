@@ -16,24 +16,138 @@ GNU General Public License for more details.
 You should have received a copy of the GNU General Public License
 along with pmbootstrap.  If not, see <http://www.gnu.org/licenses/>.
 """
+import collections.abc
+import hashlib
 import logging
+import mmap
 import os
+import pickle
+import re
+import shutil
+import sys
 import tarfile
+import pmb.build.other
 import pmb.chroot.apk
 import pmb.helpers.repo
 import pmb.parse.version
 
 
-def parse_next_block(args, path, lines, start):
+# Keys of an APKINDEX block, that get parsed. The first byte of each line
+# (e.g. b"P" from b"P:postmarketos-mkinitfs\n") is used to look up the key.
+mapping = {
+    ord("P"): "pkgname",
+    ord("V"): "version",
+    ord("D"): "depends",
+    ord("p"): "provides",
+    ord("t"): "timestamp",
+    ord("C"): "checksum",
+    ord("S"): "size",
+    ord("I"): "installed_size",
+}
+
+# Increase this, whenever the format of the parsed APKINDEX changes, so old
+# files from the persistent cache (see cache_load()) get ignored.
+cache_version = 3
+
+
+class record(collections.abc.Mapping):
+    """
+    Compact representation of one parsed APKINDEX block. It stores the values
+    in slots instead of a per-block dictionary, while still behaving like the
+    dictionary that parse_next_block() used to return (including item
+    assignment, which the testsuite uses to fake APKINDEX contents):
+
+    { "pkgname": "postmarketos-mkinitfs",
+      "version": "0.0.4-r10",
+      "depends": ["busybox-extras", "lddtree", ... ],
+      "provides": ["mkinitfs"],
+      "timestamp": "1500000000",
+      "checksum": "Q1Wsl+bEJYu0AqV4eaq+Gsf8nzBhg=",
+      "size": "6712",
+      "installed_size": "24576" }
+
+    The checksum (apk's "Q1" + base64 encoded sha1 of the package's control
+    segment) and the sizes in bytes are None, if the block does not have
+    them.
+    """
+    __slots__ = ["pkgname", "version", "depends", "provides", "timestamp",
+                 "checksum", "size", "installed_size"]
+
+    def __init__(self, pkgname, version, depends, provides, timestamp,
+                 checksum=None, size=None, installed_size=None):
+        self.pkgname = pkgname
+        self.version = version
+        self.depends = depends
+        self.provides = provides
+        self.timestamp = timestamp
+        self.checksum = checksum
+        self.size = size
+        self.installed_size = installed_size
+
+    def __getitem__(self, key):
+        if key not in self.__slots__:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __setitem__(self, key, value):
+        if key not in self.__slots__:
+            raise KeyError(key)
+        setattr(self, key, value)
+
+    def __iter__(self):
+        return iter(self.__slots__)
+
+    def __len__(self):
+        return len(self.__slots__)
+
+    def __repr__(self):
+        return repr(dict(self))
+
+    def __reduce__(self):
+        # Pickle as constructor arguments (smaller and faster to load than
+        # the default state dictionary), for the persistent cache
+        return (record, tuple(getattr(self, key) for key in self.__slots__))
+
+
+def parse_list(value):
+    """
+    Split a "depends" or "provides" value into a list of pkgnames.
+
+    :param value: string from the APKINDEX, e.g. "so:libc.musl-x86_64.so.1
+                  busybox>=1.26 !conflicting-package"
+    :returns: list of pkgnames without operators and versions, conflicts
+              (starting with "!") are left out. Example:
+              ["so:libc.musl-x86_64.so.1", "busybox"]
+              The pkgnames are interned, so all blocks referencing the same
+              pkgname share one string object.
+    """
+    ret = []
+    if value == "":
+        return ret
+
+    # Ignore all operators for now
+    for value in value.split(" "):
+        if value.startswith("!"):
+            continue
+        for operator in [">", "=", "<"]:
+            if operator in value:
+                value = value.split(operator)[0]
+                break
+        ret.append(sys.intern(value))
+    return ret
+
+
+def parse_next_block(args, path, lines):
     """
     Parse the next block in an APKINDEX.
 
     :param path: to the APKINDEX.tar.gz
-    :param start: current index in lines, gets increased in this
-                  function. Wrapped into a list, so it can be modified
-                  "by reference". Example: [5]
-    :param lines: all lines from the "APKINDEX" file inside the archive
-    :returns: a dictionary with the following structure:
+    :param lines: iterator over the lines (as bytes) of the "APKINDEX" file
+                  inside the archive. It gets advanced until the end of the
+                  current block, so the next call continues with the next
+                  block.
+    :returns: a record (see above), which can be used like a dictionary
+              with the following structure:
               { "pkgname": "postmarketos-mkinitfs",
                 "version": "0.0.4-r10",
                 "depends": ["busybox-extras", "lddtree", ... ],
@@ -42,34 +156,24 @@ def parse_next_block(args, path, lines, start):
     :returns: None, when there are no more blocks
     """
 
-    # Parse until we hit an empty line or end of file
+    # Parse until we hit an empty line or end of file. Only the values of
+    # lines, that we are interested in, get decoded.
     ret = {}
-    mapping = {
-        "P": "pkgname",
-        "V": "version",
-        "D": "depends",
-        "p": "provides",
-        "t": "timestamp"
-    }
     end_of_block_found = False
-    for i in range(start[0], len(lines)):
-        # Check for empty line
-        start[0] = i + 1
-        line = lines[i]
-        if not isinstance(line, str):
-            line = line.decode()
-        if line == "\n":
+    for line in lines:
+        if line == b"\n":
             end_of_block_found = True
             break
-
-        # Parse keys from the mapping
-        for letter, key in mapping.items():
-            if line.startswith(letter + ":"):
-                if key in ret:
-                    raise RuntimeError(
-                        "Key " + key + " (" + letter + ":) specified twice"
-                        " in block: " + str(ret) + ", file: " + path)
-                ret[key] = line[2:-1]
+        if line[1:2] != b":":
+            continue
+        key = mapping.get(line[0])
+        if not key:
+            continue
+        if key in ret:
+            raise RuntimeError(
+                "Key " + key + " (" + chr(line[0]) + ":) specified twice"
+                " in block: " + str(ret) + ", file: " + path)
+        ret[key] = line[2:-1].decode()
 
     # Format and return the block
     if end_of_block_found:
@@ -80,22 +184,14 @@ def parse_next_block(args, path, lines, start):
                                    "' in block " + str(ret) + ", file: " + path)
 
         # Format optional lists
-        for key in ["provides", "depends"]:
-            if key in ret and ret[key] != "":
-                # Ignore all operators for now
-                values = ret[key].split(" ")
-                ret[key] = []
-                for value in values:
-                    if value.startswith("!"):
-                        continue
-                    for operator in [">", "=", "<"]:
-                        if operator in value:
-                            value = value.split(operator)[0]
-                            break
-                    ret[key].append(value)
-            else:
-                ret[key] = []
-        return ret
+        return record(sys.intern(ret["pkgname"]),
+                      sys.intern(ret["version"]),
+                      parse_list(ret.get("depends", "")),
+                      parse_list(ret.get("provides", "")),
+                      ret["timestamp"],
+                      ret.get("checksum"),
+                      ret.get("size"),
+                      ret.get("installed_size"))
 
     # No more blocks
     elif ret != {}:
@@ -125,7 +221,7 @@ def parse_add_block(path, strict, ret, block, pkgname=None):
 
     # Defaults
     if not pkgname:
-        pkgname = block["pkgname"]
+        pkgname = block.pkgname
 
     # Handle duplicate entries
     if pkgname in ret:
@@ -134,8 +230,8 @@ def parse_add_block(path, strict, ret, block, pkgname=None):
                                " in " + path)
         # Ignore the block, if the block we already have has a higher
         # version
-        version_old = ret[pkgname]["version"]
-        version_new = block["version"]
+        version_old = ret[pkgname].version
+        version_new = block.version
         if pmb.parse.version.compare(version_old, version_new) == 1:
             return
 
@@ -143,6 +239,40 @@ def parse_add_block(path, strict, ret, block, pkgname=None):
     ret[pkgname] = block
 
 
+def parse_blocks(args, path, strict, ret, lines):
+    """
+    Parse all blocks of an APKINDEX and add them to the return dictionary of
+    parse().
+
+    :param lines: iterator over the lines (as bytes) of the "APKINDEX" file,
+                  usually the file handle itself
+    :param strict: see parse()
+    :param ret: see parse_add_block()
+    """
+    while True:
+        block = parse_next_block(args, path, lines)
+        if not block:
+            break
+
+        # Add the next package and all aliases
+        parse_add_block(path, strict, ret, block)
+        for alias in block.provides:
+            parse_add_block(path, strict, ret, block, alias)
+
+
+def flush_pending_index(args, path):
+    """
+    Index a repository of locally built packages now, if indexing it has been
+    postponed (see pmb.build.other.index_repo_later()).
+
+    :param path: APKINDEX.tar.gz, that is about to be read
+    """
+    for arch in args.cache["index_pending"]:
+        if path == args.work + "/packages/" + arch + "/APKINDEX.tar.gz":
+            pmb.build.other.index_repo(args, arch)
+            return
+
+
 def parse(args, path, strict=False):
     """
     Parse an APKINDEX.tar.gz file, and return its content as dictionary.
@@ -151,7 +281,8 @@ def parse(args, path, strict=False):
                    In case there are two, raise an exception.
                    When set to False, and there are multiple entries
                    for one pkgname, it uses the latest one.
-    :returns: a dictionary with the following structure:
+    :returns: a dictionary with the following structure (the values are
+              records, see above):
               { "postmarketos-mkinitfs":
                 {
                   "pkgname": "postmarketos-mkinitfs"
@@ -163,34 +294,31 @@ def parse(args, path, strict=False):
     """
 
     # Try to get a cached result first
-    lastmod = os.path.getmtime(path)
+    flush_pending_index(args, path)
+    stat = os.stat(path)
+    lastmod = stat.st_mtime
     if path in args.cache["apkindex"]:
         cache = args.cache["apkindex"][path]
         if cache["lastmod"] == lastmod:
             return cache["ret"]
 
-    # Read all lines
-    if tarfile.is_tarfile(path):
-        with tarfile.open(path, "r:gz") as tar:
-            with tar.extractfile(tar.getmember("APKINDEX")) as handle:
-                lines = handle.readlines()
-    else:
-        with open(path, "r", encoding="utf-8") as handle:
-            lines = handle.readlines()
-
-    # Parse the whole APKINDEX file
-    ret = {}
-    start = [0]
-    while True:
-        block = parse_next_block(args, path, lines, start)
-        if not block:
-            break
-
-        # Add the next package and all aliases
-        parse_add_block(path, strict, ret, block)
-        if "provides" in block:
-            for alias in block["provides"]:
-                parse_add_block(path, strict, ret, block, alias)
+    # Try the persistent cache (not in strict mode, because the cached result
+    # may have been parsed without the strict check)
+    ret = None
+    if not strict:
+        ret = cache_load(args, path, lastmod, stat.st_size)
+
+    # Parse the whole APKINDEX file, while streaming it from the archive
+    if ret is None:
+        ret = {}
+        if tarfile.is_tarfile(path):
+            with tarfile.open(path, "r:gz") as tar:
+                with tar.extractfile(tar.getmember("APKINDEX")) as handle:
+                    parse_blocks(args, path, strict, ret, handle)
+        else:
+            with open(path, "rb") as handle:
+                parse_blocks(args, path, strict, ret, handle)
+        cache_save(args, path, lastmod, stat.st_size, ret)
 
     # Update the cache
     args.cache["apkindex"][path] = {"lastmod": lastmod, "ret": ret}
@@ -198,8 +326,80 @@ def parse(args, path, strict=False):
     return ret
 
 
+def cache_path(args, path, extension=".pickle"):
+    """
+    Get the location of the persistent parse cache for one APKINDEX.
+
+    :param path: to the APKINDEX.tar.gz
+    :param extension: ".pickle" for the parsed APKINDEX (see cache_load()),
+                      ".txt" for the decompressed APKINDEX (see lazy_text())
+    :returns: $WORK/cache_apkindex/$HASH.pickle, where $HASH is calculated
+              from the path
+    """
+    name = hashlib.sha1(path.encode("utf-8")).hexdigest()
+    return args.work + "/cache_apkindex/" + name + extension
+
+
+def cache_load(args, path, lastmod, size):
+    """
+    Load a parsed APKINDEX from the persistent cache in $WORK, so it does not
+    need to be decompressed and parsed again in each pmbootstrap invocation.
+
+    :param path: to the APKINDEX.tar.gz
+    :param lastmod: last modified timestamp of the APKINDEX file
+    :param size: size in bytes of the APKINDEX file
+    :returns: the same format as parse(), or None when the cache does not
+              exist or is outdated
+    """
+    try:
+        with open(cache_path(args, path), "rb") as handle:
+            cache = pickle.load(handle)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        logging.verbose("Ignoring broken APKINDEX cache for " + path + ": " +
+                        str(e))
+        return None
+
+    if (cache.get("version") != cache_version or cache.get("path") != path or
+            cache.get("lastmod") != lastmod or cache.get("size") != size):
+        return None
+    return cache["ret"]
+
+
+def cache_save(args, path, lastmod, size, ret):
+    """
+    Store a parsed APKINDEX in the persistent cache, see cache_load().
+
+    :param ret: return value of parse()
+    """
+    cache = cache_path(args, path)
+    os.makedirs(os.path.dirname(cache), exist_ok=True)
+    with open(cache + "_", "wb") as handle:
+        pickle.dump({"version": cache_version,
+                     "path": path,
+                     "lastmod": lastmod,
+                     "size": size,
+                     "ret": ret}, handle, pickle.HIGHEST_PROTOCOL)
+    os.replace(cache + "_", cache)
+
+
 def clear_cache(args, path):
+    """
+    Clear the parsing cache of an APKINDEX for the current pmbootstrap
+    session, and remove it from the persistent cache in $WORK. Merged indexes
+    (see merged_index()), that contain the APKINDEX, get updated on the next
+    access.
+    """
     logging.verbose("Clear APKINDEX cache for: " + path)
+    for extension in [".pickle", ".txt", ".offsets"]:
+        if os.path.exists(cache_path(args, path, extension)):
+            os.remove(cache_path(args, path, extension))
+    if path in args.cache["apkindex_lazy"]:
+        del args.cache["apkindex_lazy"][path]
+    for merged in args.cache["apkindex_merged"].values():
+        if path in merged["lastmods"]:
+            del merged["lastmods"][path]
     if path in args.cache["apkindex"]:
         del args.cache["apkindex"][path]
     else:
@@ -207,9 +407,147 @@ def clear_cache(args, path):
                         str(args.cache["apkindex"].keys()))
 
 
+def lazy_text(args, path, stat):
+    """
+    Decompress the APKINDEX file from an APKINDEX.tar.gz to the persistent
+    cache in $WORK, unless it is there already. Plain APKINDEX files get
+    copied, so all files have the same header.
+
+    :param path: to the APKINDEX.tar.gz (or a plain APKINDEX file)
+    :param stat: os.stat() result of the APKINDEX.tar.gz
+    :returns: (text, header) text is the path to the decompressed file,
+              header is the first line in that file, which identifies the
+              APKINDEX.tar.gz it was decompressed from
+    """
+    text = cache_path(args, path, ".txt")
+    header = ("# " + str(cache_version) + " " + path + " " +
+              str(stat.st_mtime) + " " + str(stat.st_size) +
+              "\n").encode("utf-8")
+
+    # Check the existing file
+    if os.path.exists(text):
+        with open(text, "rb") as handle:
+            if handle.readline() == header:
+                return (text, header)
+
+    # Decompress
+    logging.verbose("Decompress " + path + " to " + text)
+    os.makedirs(os.path.dirname(text), exist_ok=True)
+    with open(text + "_", "wb") as handle_text:
+        handle_text.write(header)
+        if tarfile.is_tarfile(path):
+            with tarfile.open(path, "r:gz") as tar:
+                with tar.extractfile(tar.getmember("APKINDEX")) as handle:
+                    shutil.copyfileobj(handle, handle_text)
+        else:
+            with open(path, "rb") as handle:
+                shutil.copyfileobj(handle, handle_text)
+    os.replace(text + "_", text)
+    return (text, header)
+
+
+def lazy_table(args, path, data, header):
+    """
+    Get the table of offsets for lazy_index() from the persistent cache in
+    $WORK, or build it by searching all "P:" and "p:" lines.
+
+    :param path: to the APKINDEX.tar.gz
+    :param data: mmap object of the decompressed APKINDEX
+    :param header: first line of data, see lazy_text()
+    :returns: {"postmarketos-mkinitfs": [1234, ...], ...}
+    """
+    offsets = cache_path(args, path, ".offsets")
+    try:
+        with open(offsets, "rb") as handle:
+            cache = pickle.load(handle)
+        if cache["header"] == header:
+            return cache["table"]
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        logging.verbose("Ignoring broken APKINDEX offsets cache for " + path +
+                        ": " + str(e))
+
+    # All lines are preceded by a newline, because of the header
+    ret = {}
+    for match in re.finditer(rb"\n([Pp]):([^\n]*)", data):
+        offset = match.start(1)
+        value = match.group(2).decode()
+        pkgnames = [value] if match.group(1) == b"P" else parse_list(value)
+        for pkgname in pkgnames:
+            if pkgname not in ret:
+                ret[pkgname] = []
+            ret[pkgname].append(offset)
+
+    # Save to the persistent cache
+    with open(offsets + "_", "wb") as handle:
+        pickle.dump({"header": header, "table": ret}, handle,
+                    pickle.HIGHEST_PROTOCOL)
+    os.replace(offsets + "_", offsets)
+    return ret
+
+
+def lazy_index(args, path):
+    """
+    Prepare an APKINDEX for looking up single packages with read_lazy(). The
+    APKINDEX gets decompressed once (see lazy_text()) and memory-mapped.
+    Instead of parsing all blocks, only the "P:" and "p:" lines get searched
+    once to build a table of the offsets, where each pkgname (and alias)
+    appears (see lazy_table()).
+
+    :param path: to the APKINDEX.tar.gz (or a plain APKINDEX file)
+    :returns: { "lastmod": last modified timestamp of the APKINDEX,
+                "data": mmap object with the decompressed APKINDEX,
+                "header": offset of the first block in data,
+                "table": {"postmarketos-mkinitfs": [1234, ...], ...} }
+    """
+    # Try to get a cached result first
+    stat = os.stat(path)
+    cache = args.cache["apkindex_lazy"].get(path)
+    if cache and cache["lastmod"] == stat.st_mtime:
+        return cache
+
+    # Memory-map the plain text, get the offsets
+    text, header = lazy_text(args, path, stat)
+    with open(text, "rb") as handle:
+        data = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+    ret = {"lastmod": stat.st_mtime,
+           "data": data,
+           "header": len(header),
+           "table": lazy_table(args, path, data, header)}
+    args.cache["apkindex_lazy"][path] = ret
+    return ret
+
+
+def read_lazy(args, package, path):
+    """
+    Get information about a single package from an APKINDEX, only parsing
+    the blocks that mention the package (see lazy_index()).
+
+    :returns: the same as parse(args, path).get(package)
+    """
+    index = lazy_index(args, path)
+    data = index["data"]
+    ret = None
+    for offset in index["table"].get(package, []):
+        # Parse the block, that the "P:" or "p:" line belongs to
+        start = data.rfind(b"\n\n", 0, offset)
+        start = index["header"] if start == -1 else start + 2
+        data.seek(start)
+        block = parse_next_block(args, path, iter(data.readline, b""))
+
+        # Same order as in parse_add_block()
+        if ret is None or pmb.parse.version.compare(ret.version,
+                                                    block.version) != 1:
+            ret = block
+    return ret
+
+
 def read(args, package, path, must_exist=True):
     """
     Get information about a single package from an APKINDEX.tar.gz file.
+    Unless the APKINDEX has been parsed already, only the blocks that
+    mention the package get parsed (see read_lazy()).
 
     :param path: Path to APKINDEX.tar.gz, defaults to $WORK/APKINDEX.tar.gz
     :param package: The package of which you want to read the properties.
@@ -220,39 +558,104 @@ def read(args, package, path, must_exist=True):
         function returns the attributes of the latest version.
     """
     # Verify APKINDEX path
+    flush_pending_index(args, path)
     if not os.path.exists(path):
         if not must_exist:
             return None
         raise RuntimeError("File not found: " + path)
 
-    # Parse the APKINDEX
-    apkindex = parse(args, path)
-    if package not in apkindex:
+    # Use the parsed APKINDEX from the cache, or parse the package's blocks
+    cache = args.cache["apkindex"].get(path)
+    if cache and cache["lastmod"] == os.path.getmtime(path):
+        ret = cache["ret"].get(package)
+    else:
+        ret = read_lazy(args, package, path)
+    if not ret:
         if must_exist:
             raise RuntimeError("Package '" + package +
                                "' not found in " + path)
         else:
             return None
-    return apkindex[package]
+    return ret
 
 
-def read_any_index(args, package, arch=None):
+def merged_index_update(args, merged, path, lastmod):
     """
-    Get information about a single package from any APKINDEX.tar.gz.
+    Parse one APKINDEX again and update all entries of a merged index, that
+    it provides (or provided before).
+
+    :param merged: one arch of args.cache["apkindex_merged"], see
+                   merged_index()
+    :param path: to the APKINDEX.tar.gz, that has changed
+    :param lastmod: last modified timestamp of that APKINDEX, or None if it
+                    does not exist
+    """
+    logging.verbose("Update merged APKINDEX with: " + path)
+    old = merged["indexes"][path]
+    new = parse(args, path) if lastmod is not None else {}
+    merged["indexes"][path] = new
+    merged["lastmods"][path] = lastmod
+
+    # Find the new first match for all affected pkgnames
+    ret = merged["ret"]
+    indexes = [merged["indexes"][index] for index in merged["paths"]]
+    for pkgname in set(old) | set(new):
+        for index in indexes:
+            if pkgname in index:
+                ret[pkgname] = index[pkgname]
+                break
+        else:
+            del ret[pkgname]
+
+
+def merged_index(args, arch):
+    """
+    Get all packages of all APKINDEX.tar.gz files of one arch in one
+    dictionary. It gets created once per session and arch, afterwards only
+    the entries of APKINDEX files, that have changed in the meantime (or that
+    got passed to clear_cache()), get updated.
 
     :param arch: defaults to native architecture
-    :returns: the same format as read()
+    :returns: the same format as parse(). When a package appears in multiple
+              APKINDEX files, the one from the first file in the order of
+              pmb.helpers.repo.apkindex_files() is used (local repository,
+              then postmarketOS mirror, then Alpine).
     """
     if not arch:
         arch = args.arch_native
 
-    # Return first match
-    for index in pmb.helpers.repo.apkindex_files(args, arch):
-        index_data = read(args, package, index, False)
-        logging.verbose("Search for " + package + " in " + index +
-                        " - result: " + str(index_data))
-        if index_data:
-            return index_data
+    # Initialize the merged index
+    if arch not in args.cache["apkindex_merged"]:
+        paths = pmb.helpers.repo.apkindex_files(args, arch)
+        args.cache["apkindex_merged"][arch] = {"paths": paths,
+                                               "lastmods": {},
+                                               "indexes": {},
+                                               "ret": {}}
+        for path in paths:
+            args.cache["apkindex_merged"][arch]["indexes"][path] = {}
+    merged = args.cache["apkindex_merged"][arch]
+
+    # Update changed APKINDEX files
+    for path in merged["paths"]:
+        flush_pending_index(args, path)
+        try:
+            lastmod = os.stat(path).st_mtime
+        except FileNotFoundError:
+            lastmod = None
+        if merged["lastmods"].get(path, -1) != lastmod:
+            merged_index_update(args, merged, path, lastmod)
+    return merged["ret"]
 
-    logging.verbose("No match found in any APKINDEX.tar.gz!")
-    return None
+
+def read_any_index(args, package, arch=None):
+    """
+    Get information about a single package from any APKINDEX.tar.gz.
+
+    :param arch: defaults to native architecture
+    :returns: the same format as read()
+    """
+    ret = merged_index(args, arch).get(package)
+    if not ret:
+        logging.verbose("No match found in any APKINDEX.tar.gz for: " +
+                        package)
+    return ret
@@ -109,6 +109,20 @@ def arguments():
     parser.add_argument("-s", "--skip-initfs", dest="skip_initfs",
                         help="do not re-generate the initramfs",
                         action="store_true")
+    parser.add_argument("--eval-apkbuilds", dest="eval_apkbuilds",
+                        action="store_true", help="get the exact values from"
+                        " the APKBUILDs for commands that read all of them,"
+                        " by sourcing them in the native chroot (instead of"
+                        " the faster, but approximating parser)")
+    parser.add_argument("--overlay-chroot", dest="overlay_chroot",
+                        action="store_true", help="create the native and"
+                        " buildroot chroots as overlay on top of a shared,"
+                        " read-only base layer per architecture (made from"
+                        " the chroot snapshot)")
+    parser.add_argument("--resident-chroot", dest="resident_chroot",
+                        action="store_true", help="run the commands in each"
+                        " chroot through one long-running root shell, instead"
+                        " of starting sudo and chroot for every command")
     parser.add_argument("-w", "--work", help="folder where all data"
                         " gets stored (chroots, caches, built packages)")
     parser.add_argument("-y", "--assume-yes", help="Assume 'yes' to all"
@@ -155,7 +169,11 @@ def arguments():
     zap.add_argument("-p", "--packages", action="store_true", help="also delete"
                      " the precious, self-compiled packages")
     zap.add_argument("-hc", "--http", action="store_true", help="also delete http"
-                     "cache")
+                     " cache and the APKINDEX parse cache")
+    zap.add_argument("-b", "--build-cache", action="store_true",
+                     dest="build_cache", help="also delete the packages of"
+                     " earlier builds, that get restored instead of building"
+                     " them again")
     zap.add_argument("-m", "--mismatch-bins", action="store_true", help="also delete"
                      " binary packages that are newer than the corresponding"
                      " package in aports")
@@ -163,6 +181,19 @@ def arguments():
     # Action: stats
     stats = sub.add_parser("stats", help="show ccache stats")
     stats.add_argument("--arch")
+    stats.add_argument("--builds", action="store_true",
+                       help="show the slowest packages, the time spent in"
+                            " each build phase and the builds per day instead")
+    stats.add_argument("--limit", type=int, default=10,
+                       help="amount of packages and days to show with"
+                            " --builds (default: 10)")
+
+    # Action: status
+    status = sub.add_parser("status", help="list all aports, that need to be"
+                            " built, in build order")
+    status.add_argument("--arch", action="append", dest="arches",
+                        help="only check this architecture (can be specified"
+                             " multiple times)")
 
     # Action: build_init / chroot
     build_init = sub.add_parser("build_init", help="initialize build"
@@ -284,11 +315,21 @@ def arguments():
 
     # Add a caching dict (caches parsing of files etc. for the current session)
     setattr(args, "cache", {"apkindex": {},
+                            "apkindex_lazy": {},
+                            "apkindex_merged": {},
                             "apkbuild": {},
+                            "apkbuild_eval": None,
+                            "apkbuild_eval_shell": None,
                             "apk_min_version_checked": [],
                             "apk_repository_list_updated": [],
                             "aports_files_out_of_sync_with_git": None,
-                            "find_aport": {}})
+                            "aports_index": None,
+                            "aport_hash": {},
+                            "aport_hashes": None,
+                            "depends_recurse": {},
+                            "find_aport": {},
+                            "index_pending": set(),
+                            "resident": {}})
 
     # Add and verify the deviceinfo (only after initialization)
     if args.action != "init":
@@ -16,31 +16,24 @@ GNU General Public License for more details.
 You should have received a copy of the GNU General Public License
 along with pmbootstrap.  If not, see <http://www.gnu.org/licenses/>.
 """
+import collections
 import logging
 import pmb.chroot
 import pmb.chroot.apk
 import pmb.parse.apkindex
 
 
-def recurse_error_message(pkgname, in_aports, in_apkindexes):
-    ret = "Could not find package '" + pkgname + "'"
-    if in_aports:
-        ret += " aport"
-        if in_apkindexes:
-            ret += " and could not find it"
-    if in_apkindexes:
-        ret += " in any APKINDEX"
-    return ret
-
-
-def recurse(args, pkgnames, arch=None, in_apkindexes=True, in_aports=True,
-            strict=False):
+def recurse(args, pkgnames, arch=None, in_apkindexes=True, in_aports=True):
     """
-    Find all dependencies of the given pkgnames.
+    Find all dependencies of the given pkgnames. The result gets cached per
+    arch for the current session, until one of the APKINDEX files changes
+    (aports are assumed to stay the same in one pmbootstrap call, just like
+    in pmb.parse.apkbuild()). Dependencies, that can not be found, get
+    skipped.
 
     :param in_apkindexes: look through all APKINDEX files (with the specified arch)
     :param in_aports: look through the aports folder
-    :param strict: raise RuntimeError, when a dependency can not be found.
+    :returns: list of pkgnames, including the given ones
     """
     logging.debug("Calculate depends of packages " + str(pkgnames) +
                   ", arch: " + arch)
@@ -52,18 +45,37 @@ def recurse(args, pkgnames, arch=None, in_apkindexes=True, in_aports=True,
         raise RuntimeError("Set at least one of in_apkindexes or in_aports to"
                            " True.")
 
+    # Cached result (reset the cache when an APKINDEX has changed)
+    lastmods = None
+    if in_apkindexes:
+        pmb.parse.apkindex.merged_index(args, arch)
+        lastmods = dict(args.cache["apkindex_merged"][arch]["lastmods"])
+    key = (arch, in_apkindexes, in_aports)
+    cache = args.cache["depends_recurse"].get(key)
+    if cache is None or cache["lastmods"] != lastmods:
+        cache = {"lastmods": lastmods, "closures": {}}
+        args.cache["depends_recurse"][key] = cache
+    closure = tuple(pkgnames)
+    if closure in cache["closures"]:
+        logging.verbose("-> Cached result")
+        return list(cache["closures"][closure])
+
     # Iterate over todo-list until is is empty
-    todo = list(pkgnames)
+    todo = collections.deque(pkgnames)
+    passed = set()
     ret = []
-    while len(todo):
+    found = set()
+    while todo:
         # Skip already passed entries
-        pkgname_depend = todo.pop(0)
-        if pkgname_depend in ret:
+        pkgname_depend = todo.popleft()
+        if pkgname_depend in passed or pkgname_depend in found:
             continue
+        passed.add(pkgname_depend)
 
         # Get depends and pkgname from aports
         logging.verbose("Get dependencies of: " + pkgname_depend)
         depends = None
+        pkgname = None
         if in_aports:
             aport = pmb.build.find_aport(args, pkgname_depend, False)
             if aport:
@@ -85,23 +97,22 @@ def recurse(args, pkgnames, arch=None, in_apkindexes=True, in_aports=True,
                 pkgname = index_data["pkgname"]
 
         # Nothing found
-        if pkgname is None and strict:
-            raise RuntimeError(
-                recurse_error_message(
-                    pkgname,
-                    in_aports,
-                    in_apkindexes))
+        if pkgname is None:
+            logging.verbose("-> '" + pkgname_depend + "' not found")
+            continue
 
         # Append to todo/ret (unless it is a duplicate)
         if pkgname != pkgname_depend:
             logging.verbose("-> '" + pkgname_depend + "' is provided by '" +
                             pkgname + "'")
-        if pkgname in ret:
+        if pkgname in found:
             logging.verbose("-> '" + pkgname + "' already found")
         else:
             logging.verbose("-> '" + pkgname + "' depends on: " + str(depends))
             if depends:
-                todo += depends
+                todo.extend(depends)
             ret.append(pkgname)
+            found.add(pkgname)
 
-    return ret
+    cache["closures"][closure] = ret
+    return list(ret)
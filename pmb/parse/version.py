@@ -23,6 +23,22 @@ is heavily based on:
 
 https://git.alpinelinux.org/cgit/apk-tools/tree/src/version.c
 """
+import functools
+
+# Values associated to the tokens (C equivalent: enum PARTS)
+token_order = {
+    "invalid": -1,
+    "digit_or_zero": 0,
+    "digit": 1,
+    "letter": 2,
+    "suffix": 3,
+    "suffix_no": 4,
+    "revision_no": 5,
+    "end": 6
+}
+
+# Placeholder for post-release suffixes in the keys from key()
+key_post_suffix = -3.5
 
 
 def token_value(string):
@@ -37,17 +53,7 @@ def token_value(string):
 
     C equivalent: enum PARTS
     """
-    order = {
-        "invalid": -1,
-        "digit_or_zero": 0,
-        "digit": 1,
-        "letter": 2,
-        "suffix": 3,
-        "suffix_no": 4,
-        "revision_no": 5,
-        "end": 6
-    }
-    return order[string]
+    return token_order[string]
 
 
 def next_token(previous, rest):
@@ -161,19 +167,20 @@ def get_token(previous, rest):
 
     # Cut off leading zero digits
     if previous == "digit_or_zero" and rest.startswith("0"):
-        while rest.startswith("0"):
-            rest = rest[1:]
-            value -= 1
+        stripped = rest.lstrip("0")
+        value = len(stripped) - len(rest)
+        rest = stripped
         next = "digit"
 
-    # Add up numeric values
+    # Add up numeric values (cut off all leading digits at once)
     elif previous in ["digit_or_zero", "digit", "suffix_no",
                       "revision_no"]:
-        for i in range(len(rest)):
-            while len(rest) and rest[0].isdigit():
-                value *= 10
-                value += int(rest[i])
-                rest = rest[1:]
+        end = 0
+        while end < len(rest) and rest[end].isdigit():
+            end += 1
+        if end:
+            value = int(rest[:end])
+            rest = rest[end:]
 
     # Append chars or parse suffix
     elif previous == "letter":
@@ -213,10 +220,64 @@ def validate(version):
     return True
 
 
+@functools.lru_cache(maxsize=65536)
+def tokens(version):
+    """
+    Split a version string into all tokens (for key()).
+
+    :param version: full version string
+    :returns: tuple of (next, value) pairs, as returned by get_token(),
+              starting with the first token. The last pair has "end" or
+              "invalid" as next token. Example for "1.2-r3":
+              (("digit_or_zero", 1), ("revision_no", 2), ("end", 3))
+    """
+    ret = []
+    current = "digit"
+    rest = version
+    while current not in ["end", "invalid"]:
+        (current, value, rest) = get_token(current, rest)
+        ret.append((current, value))
+    return tuple(ret)
+
+
+@functools.lru_cache(maxsize=65536)
+def key(version):
+    """
+    Convert a version string into a key, that can be compared with the keys
+    of other versions. Sorting a list of versions is as simple as:
+    sorted(versions, key=pmb.parse.version.key)
+
+    The key consists of the value of each token, followed by the type of
+    the next token (a higher token type results in a lower key, a
+    pre-release suffix in the lowest). For all versions without
+    post-release suffixes (_cvs, _svn, _git, _hg, _p), comparing the keys
+    gives exactly the same result as compare(). With post-release suffixes,
+    apk's comparison is not always transitive (e.g. "1_p-r1" is equal to
+    "1-r1" and to "1-r2", but "1-r1" is lower than "1-r2"), so the keys can
+    only approximate it. compare() handles these cases without the key.
+
+    :param version: full version string
+    :returns: tuple of values and token types
+    """
+    ret = []
+    split = tokens(version)
+    for i, (next, value) in enumerate(split):
+        ret.append(value)
+        if next == "suffix":
+            if split[i + 1][1] < 0:
+                ret.append(-100)
+            else:
+                ret.append(key_post_suffix)
+        else:
+            ret.append(-token_order[next])
+    return tuple(ret)
+
+
 def compare(a_version, b_version, fuzzy=False):
     """
     Compare two versions A and B to find out which one is higher, or if
-    both are equal.
+    both are equal. The versions get parsed only until the first token,
+    that differs (use key() for sorting many versions instead).
 
     :param a_version: full version string A
     :param b_version: full version string B
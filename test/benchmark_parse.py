@@ -0,0 +1,310 @@
+#!/usr/bin/env python3
+"""
+Copyright 2017 Oliver Smith
+
+This file is part of pmbootstrap.
+
+pmbootstrap is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+pmbootstrap is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with pmbootstrap.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+"""
+Benchmark the parsers in pmb.parse (APKINDEX, APKBUILD, version, depends).
+Everything runs offline: the APKINDEX and the version pairs get generated
+(with a fixed random seed), the APKBUILDs are the ones from the aports
+folder of this repository.
+
+Usage:
+    test/benchmark_parse.py           run and show the difference to the
+                                      baseline
+    test/benchmark_parse.py --check   same, but fail when a benchmark is
+                                      slower or needs more memory than the
+                                      baseline by more than the tolerance
+    test/benchmark_parse.py --save    run and store the results as baseline
+
+The baseline is stored in test/benchmark_parse.json. The absolute numbers
+depend on the machine and on its load, so --check is only meaningful right
+after recording the baseline on the same, otherwise idle machine. It is not
+part of the test suite. Record the baseline again in each commit that makes
+one of the parsers faster.
+"""
+import argparse
+import copy
+import glob
+import io
+import json
+import os
+import random
+import shutil
+import sys
+import tarfile
+import tempfile
+import time
+import tracemalloc
+
+# Import from parent directory
+pmb_src = os.path.realpath(os.path.join(os.path.dirname(__file__) + "/.."))
+sys.path.append(pmb_src)
+import pmb.helpers.logging
+import pmb.parse
+import pmb.parse.apkindex
+import pmb.parse.depends
+import pmb.parse.version
+
+baseline_path = pmb_src + "/test/benchmark_parse.json"
+
+
+def generate_apkindex(path, count):
+    """
+    Write an APKINDEX.tar.gz with a similar structure as Alpine's, where all
+    dependencies can be resolved.
+
+    :param count: amount of blocks
+    """
+    rand = random.Random(1)
+    pkgnames = ["pkg" + str(i) for i in range(count)]
+    blocks = []
+    for i, pkgname in enumerate(pkgnames):
+        depends = ["so:lib" + name + ".so.1" for name in
+                   rand.sample(pkgnames[:i], min(i, rand.randint(0, 4)))]
+        depends += ["!" + pkgname + "-conflict"]
+        blocks.append("C:Q1" + "%026x" % rand.getrandbits(104) + "=\n"
+                      "P:" + pkgname + "\n"
+                      "V:" + str(rand.randint(0, 9)) + "." +
+                      str(rand.randint(0, 30)) + "-r" +
+                      str(rand.randint(0, 5)) + "\n"
+                      "A:x86_64\n"
+                      "S:" + str(rand.randint(1000, 10000000)) + "\n"
+                      "I:" + str(rand.randint(1000, 30000000)) + "\n"
+                      "T:Synthetic package " + pkgname + "\n"
+                      "U:https://postmarketos.org\n"
+                      "L:GPL-3.0\n"
+                      "o:" + pkgname + "\n"
+                      "m:pmbootstrap <pmbootstrap@example.org>\n"
+                      "t:" + str(1500000000 + i) + "\n"
+                      "c:" + "%040x" % rand.getrandbits(160) + "\n"
+                      "D:" + " ".join(depends) + "\n"
+                      "p:so:lib" + pkgname + ".so.1=1 cmd:" + pkgname + "\n"
+                      "\n")
+
+    data = "".join(blocks).encode("utf-8")
+    with tarfile.open(path, "w:gz") as tar:
+        info = tarfile.TarInfo("APKINDEX")
+        info.size = len(data)
+        tar.addfile(info, io.BytesIO(data))
+
+
+def generate_version_pairs(count):
+    """
+    :returns: list of (a, b) version strings, with digits, letters, suffixes
+              and revisions
+    """
+    rand = random.Random(1)
+    suffixes = ["", "", "", "_alpha", "_beta", "_pre", "_rc", "_p", "_git",
+                "_svn"]
+
+    def version():
+        ret = ".".join(str(rand.randint(0, 20)) for i in
+                       range(rand.randint(1, 4)))
+        if rand.random() < 0.1:
+            ret += rand.choice("abc")
+        suffix = rand.choice(suffixes)
+        if suffix:
+            ret += suffix + str(rand.randint(0, 20160101))
+        return ret + "-r" + str(rand.randint(0, 10))
+    return [(version(), version()) for i in range(count)]
+
+
+def bench_apkindex_parse(args, fixtures):
+    path = fixtures["apkindex"]
+    pmb.parse.apkindex.clear_cache(args, path)
+    pmb.parse.apkindex.parse(args, path)
+    return fixtures["apkindex_count"]
+
+
+def bench_apkindex_read(args, fixtures):
+    args.cache["apkindex"] = {}
+    args.cache["apkindex_lazy"] = {}
+    for i in range(100):
+        pmb.parse.apkindex.read(args, "pkg" + str(i * 7), fixtures["apkindex"])
+    return 100
+
+
+def bench_apkbuild(args, fixtures):
+    args.cache["apkbuild"] = {}
+    for path in fixtures["apkbuilds"]:
+        pmb.parse.apkbuild(args, path)
+    return len(fixtures["apkbuilds"])
+
+
+def bench_version_compare(args, fixtures):
+    pmb.parse.version.key.cache_clear()
+    pmb.parse.version.tokens.cache_clear()
+    for a, b in fixtures["version_pairs"]:
+        pmb.parse.version.compare(a, b)
+    return len(fixtures["version_pairs"])
+
+
+def bench_depends_recurse(args, fixtures):
+    args.cache["depends_recurse"] = {}
+    pkgnames = ["pkg" + str(i) for i in range(fixtures["apkindex_count"] - 50,
+                                              fixtures["apkindex_count"])]
+    ret = pmb.parse.depends.recurse(args, pkgnames, "x86_64",
+                                    in_aports=False)
+    return len(ret)
+
+
+benchmarks = [
+    ("apkindex_parse", "blocks", bench_apkindex_parse),
+    ("apkindex_read", "lookups", bench_apkindex_read),
+    ("apkbuild", "APKBUILDs", bench_apkbuild),
+    ("version_compare", "comparisons", bench_version_compare),
+    ("depends_recurse", "packages", bench_depends_recurse),
+]
+
+
+def reset(args, fixtures, cache):
+    """
+    Start each benchmark with the same state, no matter which benchmarks ran
+    before it (or else the APKINDEX gets parsed in the warm-up of whichever
+    benchmark uses it first).
+
+    :param cache: args.cache right after parsing the arguments
+    """
+    pmb.parse.apkindex.clear_cache(args, fixtures["apkindex"])
+    args.cache = copy.deepcopy(cache)
+    pmb.parse.version.key.cache_clear()
+    pmb.parse.version.tokens.cache_clear()
+
+
+def run(args, fixtures, function, min_time=1.0):
+    """
+    Run one benchmark until it took at least min_time seconds.
+
+    :returns: (ops_per_sec, peak_memory_kib) with the fastest run, and the
+              peak memory of one run
+    """
+    # Warm up and measure memory (tracing slows down the run)
+    tracemalloc.start()
+    function(args, fixtures)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    best = None
+    total = 0
+    while total < min_time:
+        start = time.perf_counter()
+        ops = function(args, fixtures)
+        duration = time.perf_counter() - start
+        total += duration
+        if best is None or ops / duration > best:
+            best = ops / duration
+    return (best, peak // 1024)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="benchmark pmb.parse")
+    parser.add_argument("--save", action="store_true",
+                        help="store the results as new baseline")
+    parser.add_argument("--check", action="store_true",
+                        help="fail when a result is worse than the baseline"
+                             " by more than the tolerance")
+    parser.add_argument("--tolerance", type=float, default=0.3,
+                        help="allowed slowdown compared to the baseline"
+                             " (default: 0.3, which is 30%%)")
+    parser.add_argument("--memory-tolerance", type=float, default=0.3,
+                        help="allowed increase of the peak memory compared"
+                             " to the baseline (default: 0.3, which is 30%%,"
+                             " plus 1024 KiB)")
+    parser.add_argument("--count", type=int, default=20000,
+                        help="amount of blocks in the generated APKINDEX")
+    parser.add_argument("--only", help="run only the benchmark with this"
+                        " name")
+    bench_args = parser.parse_args()
+
+    # Use a temporary work folder
+    work = tempfile.mkdtemp(prefix="pmbootstrap_benchmark_")
+    sys.argv = ["pmbootstrap.py", "chroot"]
+    args = pmb.parse.arguments()
+    args.work = work
+    args.log = work + "/log.txt"
+    pmb.helpers.logging.init(args)
+    cache = copy.deepcopy(args.cache)
+
+    try:
+        # Prepare fixtures (generated APKINDEX is the local repository)
+        os.makedirs(work + "/packages/x86_64")
+        fixtures = {"apkindex": work + "/packages/x86_64/APKINDEX.tar.gz",
+                    "apkindex_count": bench_args.count,
+                    "apkbuilds": sorted(glob.glob(args.aports +
+                                                  "/*/*/APKBUILD")),
+                    "version_pairs": generate_version_pairs(20000)}
+        generate_apkindex(fixtures["apkindex"], bench_args.count)
+
+        # Run all benchmarks
+        results = {}
+        for name, unit, function in benchmarks:
+            if bench_args.only and bench_args.only != name:
+                continue
+            reset(args, fixtures, cache)
+            ops, peak = run(args, fixtures, function)
+            results[name] = {"ops_per_sec": round(ops, 1),
+                             "peak_memory_kib": peak}
+            print("{:<18} {:>12.1f} {}/s {:>10} KiB peak".format(
+                name, ops, unit, peak))
+    finally:
+        args.logfd.close()
+        shutil.rmtree(work)
+
+    # Save the baseline
+    if bench_args.save:
+        with open(baseline_path, "w") as handle:
+            json.dump(results, handle, indent=4, sort_keys=True)
+            handle.write("\n")
+        print("Baseline saved to: " + baseline_path)
+        return 0
+
+    # Compare with the baseline
+    if not os.path.exists(baseline_path):
+        print("No baseline found, run with --save to create one.")
+        return 0
+    with open(baseline_path) as handle:
+        baseline = json.load(handle)
+    slower = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        expected = baseline[name]["ops_per_sec"]
+        print("{:<18} {:>+12.0%} compared to the baseline".format(
+            name, result["ops_per_sec"] / expected - 1))
+        if result["ops_per_sec"] < expected * (1 - bench_args.tolerance):
+            slower.append("{}: {:.1f} ops/s (baseline: {:.1f} ops/s)".format(
+                name, result["ops_per_sec"], expected))
+
+        # Peak memory (with some slack for small values)
+        expected = baseline[name]["peak_memory_kib"]
+        if (result["peak_memory_kib"] > expected *
+                (1 + bench_args.memory_tolerance) + 1024):
+            slower.append("{}: {} KiB peak (baseline: {} KiB)".format(
+                name, result["peak_memory_kib"], expected))
+    if slower:
+        print("Slower or more memory than the baseline:")
+        for line in slower:
+            print("* " + line)
+        return 1 if bench_args.check else 0
+    print("All benchmarks are within the tolerances of the baseline.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
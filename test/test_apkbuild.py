@@ -0,0 +1,128 @@
+"""
+Copyright 2017 Oliver Smith
+
+This file is part of pmbootstrap.
+
+pmbootstrap is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+pmbootstrap is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with pmbootstrap.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import os
+import sys
+import pytest
+
+# Import from parent directory
+sys.path.append(os.path.realpath(
+    os.path.join(os.path.dirname(__file__) + "/..")))
+import pmb.build.other
+import pmb.chroot
+import pmb.helpers.logging
+import pmb.parse
+from pmb.parse.apkbuild import parse_file
+
+
+@pytest.fixture
+def args(request, tmpdir):
+    sys.argv = ["pmbootstrap.py", "chroot"]
+    args = pmb.parse.arguments()
+    args.log = args.work + "/log_testsuite.txt"
+    pmb.helpers.logging.init(args)
+    request.addfinalizer(args.logfd.close)
+    args.work = str(tmpdir) + "/work"
+    return args
+
+
+def test_apkbuild(tmpdir):
+    os.mkdir(str(tmpdir) + "/hello-world")
+    path = str(tmpdir) + "/hello-world/APKBUILD"
+    with open(path, "w", encoding="utf-8") as handle:
+        handle.write("pkgname=hello-world\n"
+                     "pkgver=\"1.0\"\n"
+                     "pkgrel=2\n"
+                     "depends=\"a b\n"
+                     "\tc\"\n"
+                     "makedepends=\"\n"
+                     "\td\n"
+                     "\te\n"
+                     "\t\"\n"
+                     "subpackages=\"$pkgname-doc $pkgname-dev:dev\"\n"
+                     "source=\"\n"
+                     "pkgrel=9\n"
+                     "\t\"\n"
+                     "arch=\"all\"\n")
+    ret = parse_file(path)
+    assert ret["pkgname"] == "hello-world"
+    assert ret["pkgver"] == "1.0"
+    assert ret["depends"] == ["a", "b", "c"]
+    assert ret["makedepends"] == ["d", "e"]
+    assert ret["subpackages"] == ["hello-world-doc", "hello-world-dev"]
+    assert ret["options"] == []
+    assert ret["_flavor"] == ""
+
+    # Known limitations: assignments are found at the beginning of any line
+    # (even inside other values) and the last line gets ignored
+    assert ret["pkgrel"] == "9"
+    assert ret["arch"] == []
+
+
+def test_apkbuild_eval(args, tmpdir, monkeypatch):
+    # Run the shell on the host instead of the native chroot
+    commands = []
+
+    def shell_command(args, suffix, command):
+        commands.append((suffix, command))
+        return ["sh"]
+    module = sys.modules["pmb.parse.apkbuild"]
+    monkeypatch.setattr(module, "shell_command", shell_command)
+    monkeypatch.setattr(pmb.chroot, "init", lambda args: None)
+
+    os.mkdir(str(tmpdir) + "/linux-test")
+    path = str(tmpdir) + "/linux-test/APKBUILD"
+    with open(path, "w", encoding="utf-8") as handle:
+        handle.write("pkgname=linux-test\n"
+                     "pkgver=3.4.5\n"
+                     "pkgrel=0\n"
+                     "_kernver=${pkgver%.*}\n"
+                     "depends=\"a\n"
+                     "\tb\"\n"
+                     "subpackages=\"$pkgname-dev:dev\"\n"
+                     "build() {\n"
+                     "\texit 1\n"
+                     "}\n")
+    ret = pmb.parse.apkbuild_eval(args, [path])[path]
+    assert commands == [("native", "su user -s /bin/sh")]
+    assert ret["pkgname"] == "linux-test"
+    assert ret["_kernver"] == "3.4"
+    assert ret["depends"] == ["a", "b"]
+    assert ret["subpackages"] == ["linux-test-dev"]
+    assert ret["options"] == []
+
+    # Cached by the APKBUILD's checksum
+    args.cache["apkbuild_eval"] = None
+    pmb.parse.apkbuild_eval_stop(args)
+    assert pmb.parse.apkbuild_eval(args, [path])[path] == ret
+    assert args.cache["apkbuild_eval_shell"] is None
+
+    # Only used by apkbuild_many() with --eval-apkbuilds
+    assert pmb.parse.apkbuild_many(args, [path])[path]["_kernver"] == "${pkgver%.*}"
+    args.cache["apkbuild"] = {}
+    args.eval_apkbuilds = True
+    assert pmb.parse.apkbuild_many(args, [path])[path] == ret
+    assert pmb.parse.apkbuild(args, path) == ret
+
+    # Syntax error
+    with open(path, "a", encoding="utf-8") as handle:
+        handle.write("build() {\n")
+    with pytest.raises(RuntimeError) as e:
+        pmb.parse.apkbuild_eval(args, [path])
+    assert str(e.value).startswith("Failed to evaluate APKBUILD")
+    pmb.parse.apkbuild_eval_stop(args)
@@ -0,0 +1,211 @@
+"""
+Copyright 2017 Oliver Smith
+
+This file is part of pmbootstrap.
+
+pmbootstrap is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+pmbootstrap is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with pmbootstrap.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import io
+import os
+import pickle
+import sys
+import tarfile
+import pytest
+
+# Import from parent directory
+sys.path.append(os.path.realpath(
+    os.path.join(os.path.dirname(__file__) + "/..")))
+import pmb.helpers.logging
+import pmb.helpers.repo
+import pmb.parse.apkindex
+
+
+@pytest.fixture
+def args(request, tmpdir):
+    import pmb.parse
+    sys.argv = ["pmbootstrap.py", "chroot"]
+    args = pmb.parse.arguments()
+    args.log = args.work + "/log_testsuite.txt"
+    pmb.helpers.logging.init(args)
+    request.addfinalizer(args.logfd.close)
+
+    # Keep the persistent APKINDEX cache out of the real work folder
+    args.work = str(tmpdir) + "/work"
+    return args
+
+
+def create_apkindex(tmpdir, content):
+    """
+    Write an APKINDEX.tar.gz with the given content for the APKINDEX file.
+
+    :returns: path to the APKINDEX.tar.gz
+    """
+    path = str(tmpdir) + "/APKINDEX.tar.gz"
+    data = content.encode("utf-8")
+    with tarfile.open(path, "w:gz") as tar:
+        info = tarfile.TarInfo("APKINDEX")
+        info.size = len(data)
+        tar.addfile(info, io.BytesIO(data))
+    return path
+
+
+def test_parse(args, tmpdir):
+    path = create_apkindex(tmpdir, "C:Q1abc=\n"
+                                   "P:hello-world\n"
+                                   "V:1-r2\n"
+                                   "A:x86_64\n"
+                                   "S:6712\n"
+                                   "I:24576\n"
+                                   "t:1500000000\n"
+                                   "D:so:libc.musl-x86_64.so.1 busybox>=1.26"
+                                   " !conflict\n"
+                                   "p:cmd:hello-world=1-r2\n"
+                                   "\n"
+                                   "P:hello-world\n"
+                                   "V:1-r1\n"
+                                   "t:1400000000\n"
+                                   "\n")
+    block = {"pkgname": "hello-world",
+             "version": "1-r2",
+             "timestamp": "1500000000",
+             "depends": ["so:libc.musl-x86_64.so.1", "busybox"],
+             "provides": ["cmd:hello-world"],
+             "checksum": "Q1abc=",
+             "size": "6712",
+             "installed_size": "24576"}
+    assert pmb.parse.apkindex.parse(args, path) == {
+        "hello-world": block,
+        "cmd:hello-world": block}
+
+
+def test_parse_plain_text(args, tmpdir):
+    path = str(tmpdir) + "/installed"
+    with open(path, "w", encoding="utf-8") as handle:
+        handle.write("P:musl\nV:1.1.18-r5\nt:1500000000\n\n")
+    assert pmb.parse.apkindex.parse(args, path) == {
+        "musl": {"pkgname": "musl", "version": "1.1.18-r5",
+                 "timestamp": "1500000000", "depends": [], "provides": [],
+                 "checksum": None, "size": None, "installed_size": None}}
+
+
+def test_parse_strict(args, tmpdir):
+    path = create_apkindex(tmpdir, "P:a\nV:1-r0\nt:1\n\n"
+                                   "P:a\nV:1-r1\nt:1\n\n")
+    with pytest.raises(RuntimeError) as e:
+        pmb.parse.apkindex.parse(args, path, True)
+    assert str(e.value).startswith("Multiple blocks for a")
+
+
+def test_parse_key_twice(args, tmpdir):
+    path = create_apkindex(tmpdir, "P:a\nP:b\nV:1-r0\nt:1\n\n")
+    with pytest.raises(RuntimeError) as e:
+        pmb.parse.apkindex.parse(args, path)
+    assert str(e.value).startswith("Key pkgname (P:) specified twice")
+
+
+def test_parse_missing_newline(args, tmpdir):
+    path = create_apkindex(tmpdir, "P:a\nV:1-r0\nt:1\n")
+    with pytest.raises(RuntimeError) as e:
+        pmb.parse.apkindex.parse(args, path)
+    assert "does not end with a new line" in str(e.value)
+
+
+def test_parse_persistent_cache(args, tmpdir):
+    path = create_apkindex(tmpdir, "P:a\nV:1-r0\nt:1\n\n")
+    ret = pmb.parse.apkindex.parse(args, path)
+    assert os.path.exists(pmb.parse.apkindex.cache_path(args, path))
+
+    # New session: result gets loaded from the persistent cache
+    args.cache["apkindex"] = {}
+    stat = os.stat(path)
+    assert pmb.parse.apkindex.cache_load(args, path, stat.st_mtime,
+                                         stat.st_size) == ret
+    assert pmb.parse.apkindex.parse(args, path) == ret
+
+    # Changed size: the cache is outdated
+    assert pmb.parse.apkindex.cache_load(args, path, stat.st_mtime,
+                                         stat.st_size + 1) is None
+
+    # Clearing the cache removes the file
+    pmb.parse.apkindex.clear_cache(args, path)
+    assert not os.path.exists(pmb.parse.apkindex.cache_path(args, path))
+    assert path not in args.cache["apkindex"]
+
+
+def test_read_any_index(args, tmpdir, monkeypatch):
+    # Local repository and one upstream repository
+    paths = []
+    for name, content in [("user", "P:a\nV:2-r0\nt:1\n\n"),
+                          ("upstream", "P:a\nV:1-r0\nt:1\n\n"
+                                       "P:b\nV:1-r0\nt:1\np:c\n\n")]:
+        os.mkdir(str(tmpdir) + "/" + name)
+        paths.append(create_apkindex(str(tmpdir) + "/" + name, content))
+    monkeypatch.setattr(pmb.helpers.repo, "apkindex_files",
+                        lambda args, arch: paths)
+
+    # The first APKINDEX has priority
+    func = pmb.parse.apkindex.read_any_index
+    assert func(args, "a", "x86_64")["version"] == "2-r0"
+    assert func(args, "c", "x86_64")["pkgname"] == "b"
+    assert func(args, "d", "x86_64") is None
+
+    # Update the local repository
+    create_apkindex(str(tmpdir) + "/user", "P:d\nV:1-r0\nt:1\n\n")
+    pmb.parse.apkindex.clear_cache(args, paths[0])
+    assert func(args, "a", "x86_64")["version"] == "1-r0"
+    assert func(args, "d", "x86_64")["version"] == "1-r0"
+
+
+def test_record():
+    record = pmb.parse.apkindex.record("a", "1-r0", ["b"], ["c"], "1")
+    assert record["pkgname"] == "a"
+    assert "depends" in record
+    assert record.get("invalid") is None
+    assert dict(record) == {"pkgname": "a", "version": "1-r0",
+                            "depends": ["b"], "provides": ["c"],
+                            "timestamp": "1", "checksum": None,
+                            "size": None, "installed_size": None}
+
+    # Modify like a dictionary
+    record["version"] = "2-r0"
+    assert record.version == "2-r0"
+    with pytest.raises(KeyError):
+        record["invalid"] = "value"
+
+    # Pickle for the persistent cache
+    assert pickle.loads(pickle.dumps(record)) == record
+
+
+def test_read_lazy(args, tmpdir):
+    path = create_apkindex(tmpdir, "C:Q1abc=\n"
+                                   "P:a\nV:1-r0\nt:1\np:c\n\n"
+                                   "P:b\nV:1-r0\nt:1\np:c=2 d\n\n"
+                                   "P:a\nV:2-r0\nt:1\n\n"
+                                   "P:a\nV:1-r5\nt:1\n\n")
+
+    # Same results as from parsing the whole APKINDEX
+    expected = pmb.parse.apkindex.parse(args, path)
+    args.cache["apkindex"] = {}
+    for package in ["a", "b", "c", "d"]:
+        ret = pmb.parse.apkindex.read(args, package, path)
+        assert ret == expected[package]
+    assert pmb.parse.apkindex.read(args, "e", path, False) is None
+    assert path not in args.cache["apkindex"]
+
+    # Decompressed only once
+    text = pmb.parse.apkindex.cache_path(args, path, ".txt")
+    lastmod = os.path.getmtime(text)
+    args.cache["apkindex_lazy"] = {}
+    assert pmb.parse.apkindex.read(args, "a", path)["version"] == "2-r0"
+    assert os.path.getmtime(text) == lastmod
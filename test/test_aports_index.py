@@ -0,0 +1,98 @@
+"""
+Copyright 2017 Oliver Smith
+
+This file is part of pmbootstrap.
+
+pmbootstrap is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+pmbootstrap is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with pmbootstrap.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import os
+import sys
+import pytest
+
+# Import from parent directory
+sys.path.append(os.path.realpath(
+    os.path.join(os.path.dirname(__file__) + "/..")))
+import pmb.build.other
+import pmb.helpers.logging
+
+
+@pytest.fixture
+def args(request, tmpdir):
+    import pmb.parse
+    sys.argv = ["pmbootstrap.py", "chroot"]
+    args = pmb.parse.arguments()
+    args.log = args.work + "/log_testsuite.txt"
+    pmb.helpers.logging.init(args)
+    request.addfinalizer(args.logfd.close)
+
+    # Use a temporary aports and work folder
+    args.aports = str(tmpdir) + "/aports"
+    args.work = str(tmpdir) + "/work"
+    return args
+
+
+def create_apkbuild(args, folder, pkgname, subpackages):
+    os.makedirs(args.aports + "/" + folder + "/" + pkgname)
+    path = args.aports + "/" + folder + "/" + pkgname + "/APKBUILD"
+    with open(path, "w", encoding="utf-8") as handle:
+        handle.write("pkgname=" + pkgname + "\npkgver=1\npkgrel=0\n"
+                     "subpackages=\"" + subpackages + "\"\nsource=\"\"\n")
+    return path
+
+
+def new_session(args):
+    args.cache["aports_index"] = None
+    args.cache["apkbuild"] = {}
+    args.cache["find_aport"] = {}
+
+
+def test_aports_index(args):
+    create_apkbuild(args, "main", "hello-world", "$pkgname-doc")
+    create_apkbuild(args, "device", "device-a", "device-a-x11:x11")
+    func = pmb.build.other.find_aport
+    assert func(args, "hello-world-doc") == args.aports + "/main/hello-world"
+    assert func(args, "device-a-x11") == args.aports + "/device/device-a"
+    assert func(args, "musl", False) is None
+    with pytest.raises(RuntimeError) as e:
+        func(args, "musl")
+    assert str(e.value) == "Could not find aport for package: musl"
+
+    # New session: unchanged APKBUILDs do not get parsed again
+    new_session(args)
+    assert func(args, "hello-world-doc") == args.aports + "/main/hello-world"
+    assert args.cache["apkbuild"] == {}
+
+    # Modified and removed APKBUILDs
+    path = create_apkbuild(args, "main", "hello-world2", "$pkgname-doc")
+    os.remove(args.aports + "/device/device-a/APKBUILD")
+    new_session(args)
+    assert func(args, "hello-world2-doc") == path[:-len("/APKBUILD")]
+    assert func(args, "device-a-x11", False) is None
+    assert list(args.cache["apkbuild"].keys()) == [path]
+
+
+def test_apkbuild_many(args, monkeypatch):
+    # Parse the aports folder of this repository with four processes
+    import glob
+    import pmb.config
+    monkeypatch.setattr(os, "cpu_count", lambda: 4)
+    paths = glob.glob(pmb.config.pmb_src + "/aports/*/*/APKBUILD")
+    ret = pmb.parse.apkbuild_many(args, paths)
+    assert list(ret.keys()) == paths
+    assert sorted(args.cache["apkbuild"].keys()) == sorted(paths)
+
+    # Same results as parsing one after another
+    args.cache["apkbuild"] = {}
+    for path in paths:
+        assert pmb.parse.apkbuild(args, path) == ret[path]
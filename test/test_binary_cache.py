@@ -0,0 +1,137 @@
+"""
+Copyright 2017 Oliver Smith
+
+This file is part of pmbootstrap.
+
+pmbootstrap is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+pmbootstrap is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with pmbootstrap.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import io
+import os
+import sys
+import tarfile
+import pytest
+
+# Import from parent directory
+sys.path.append(os.path.realpath(
+    os.path.join(os.path.dirname(__file__) + "/..")))
+import pmb.build
+import pmb.build.binary_cache
+import pmb.build.buildinfo
+import pmb.helpers.logging
+import pmb.helpers.repo
+
+
+@pytest.fixture
+def args(request, tmpdir):
+    import pmb.parse
+    sys.argv = ["pmbootstrap.py", "chroot"]
+    args = pmb.parse.arguments()
+    args.log = args.work + "/log_testsuite.txt"
+    pmb.helpers.logging.init(args)
+    request.addfinalizer(args.logfd.close)
+    args.work = str(tmpdir) + "/work"
+    return args
+
+
+def create_apkindex(path, content):
+    data = content.encode("utf-8")
+    with tarfile.open(path, "w:gz") as tar:
+        info = tarfile.TarInfo("APKINDEX")
+        info.size = len(data)
+        tar.addfile(info, io.BytesIO(data))
+
+
+def write_installed(args, content, lastmod):
+    folder = args.work + "/chroot_native/lib/apk/db"
+    os.makedirs(folder, exist_ok=True)
+    with open(folder + "/installed", "w") as handle:
+        handle.write(content)
+    os.utime(folder + "/installed", (lastmod, lastmod))
+
+
+def test_binary_cache(args, tmpdir, monkeypatch):
+    aport = str(tmpdir) + "/hello-world"
+    os.mkdir(aport)
+    with open(aport + "/APKBUILD", "w") as handle:
+        handle.write("pkgname=hello-world\n")
+    apkbuild = {"pkgname": "hello-world", "pkgver": "1", "pkgrel": "0",
+                "makedepends": ["musl-dev"],
+                "subpackages": ["hello-world-doc"]}
+
+    # The package has never been built, so it is not in the APKINDEX
+    index = str(tmpdir) + "/APKINDEX.tar.gz"
+    index_content = ("P:musl-dev\nV:1.1.18-r0\nt:1\n\n"
+                     "P:abuild\nV:3.0-r0\nt:1\n\n"
+                     "P:build-base\nV:0.5-r0\nt:1\n\n"
+                     "P:busybox\nV:1.27.2-r0\nt:1\n\n"
+                     "P:gcc-armhf\nV:6.4.0-r5\nt:1\nD:binutils-armhf\n\n"
+                     "P:binutils-armhf\nV:2.28-r0\nt:1\n\n")
+    create_apkindex(index, index_content)
+    monkeypatch.setattr(pmb.helpers.repo, "apkindex_files",
+                        lambda args, arch: [index])
+    installed = ("P:musl-dev\nV:1.1.18-r0\nt:1\n\n"
+                 "P:abuild\nV:3.0-r0\nt:1\n\n"
+                 "P:build-base\nV:0.5-r0\nt:1\n\n"
+                 "P:busybox\nV:1.27.2-r0\nt:1\n\n"
+                 "P:gcc-armhf\nV:6.4.0-r5\nt:1\n\n"
+                 "P:binutils-armhf\nV:2.28-r0\nt:1\n\n")
+    write_installed(args, installed, 1)
+    buildinfo = pmb.build.buildinfo.generate(args, None, "x86_64", "native",
+                                             apkbuild)
+    assert buildinfo["versions"] == {"musl-dev": "1.1.18-r0",
+                                     "abuild": "3.0-r0",
+                                     "build-base": "0.5-r0"}
+
+    # The key depends on the aport, arch and makedepends versions
+    func = pmb.build.binary_cache.key
+    key = func(args, aport, "x86_64", "native", apkbuild)
+    assert func(args, aport, "x86_64", "native", apkbuild) == key
+    assert func(args, aport, "armhf", "native", apkbuild) != key
+    write_installed(args, installed.replace("1.1.18-r0", "1.1.18-r1"), 2)
+    assert func(args, aport, "x86_64", "native", apkbuild) != key
+    write_installed(args, installed, 3)
+    assert func(args, aport, "x86_64", "native", apkbuild) == key
+    with open(aport + "/APKBUILD", "a") as handle:
+        handle.write("pkgrel=0\n")
+    args.cache["aport_hash"] = {}
+    key_aport = func(args, aport, "x86_64", "native", apkbuild)
+    assert key_aport != key
+
+    # Same key after the package has been built and added to the APKINDEX
+    create_apkindex(index, index_content + "P:hello-world\nV:1-r0\nt:1\n"
+                                           "D:busybox\n\n")
+    os.utime(index, (0, 0))
+    assert func(args, aport, "x86_64", "native", apkbuild) == key_aport
+
+    # Cross compiling: the key depends on the method and on the versions of
+    # the cross compilers in the native chroot
+    key_cross = func(args, aport, "armhf", "native", apkbuild, "native")
+    assert func(args, aport, "armhf", "native", apkbuild) != key_cross
+    assert (func(args, aport, "armhf", "buildroot_armhf", apkbuild,
+                 "distcc") != key_cross)
+    write_installed(args, installed.replace("2.28-r0", "2.28-r1"), 4)
+    assert (func(args, aport, "armhf", "native", apkbuild, "native") !=
+            key_cross)
+    assert func(args, aport, "x86_64", "native", apkbuild) == key_aport
+
+    # Save all apks of the build
+    assert pmb.build.binary_cache.apks(apkbuild) == [
+        "hello-world-1-r0.apk", "hello-world-doc-1-r0.apk"]
+    os.makedirs(args.work + "/packages/x86_64")
+    for apk in pmb.build.binary_cache.apks(apkbuild):
+        with open(args.work + "/packages/x86_64/" + apk, "w") as handle:
+            handle.write(apk)
+    pmb.build.binary_cache.save(args, key, "x86_64", apkbuild)
+    assert sorted(os.listdir(args.work + "/cache_builds/" + key)) == [
+        "hello-world-1-r0.apk", "hello-world-doc-1-r0.apk"]
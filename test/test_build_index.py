@@ -0,0 +1,141 @@
+"""
+Copyright 2017 Oliver Smith
+
+This file is part of pmbootstrap.
+
+pmbootstrap is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+pmbootstrap is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with pmbootstrap.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import base64
+import gzip
+import hashlib
+import io
+import os
+import sys
+import tarfile
+import time
+import pytest
+
+# Import from parent directory
+sys.path.append(os.path.realpath(
+    os.path.join(os.path.dirname(__file__) + "/..")))
+import pmb.build
+import pmb.build.index
+import pmb.helpers.logging
+import pmb.parse.apkindex
+
+
+@pytest.fixture
+def args(request, tmpdir):
+    import pmb.parse
+    sys.argv = ["pmbootstrap.py", "chroot"]
+    args = pmb.parse.arguments()
+    args.log = args.work + "/log_testsuite.txt"
+    pmb.helpers.logging.init(args)
+    request.addfinalizer(args.logfd.close)
+    args.work = str(tmpdir) + "/work"
+    return args
+
+
+def tar_gz(files, end_of_archive=False):
+    """
+    Create a gzip compressed tar archive in memory, like abuild does for the
+    segments of an apk (without the end of archive blocks).
+    """
+    tar_data = io.BytesIO()
+    tar = tarfile.open(fileobj=tar_data, mode="w",
+                       format=tarfile.USTAR_FORMAT)
+    for name, content in files.items():
+        tarinfo = tarfile.TarInfo(name)
+        tarinfo.size = len(content)
+        tar.addfile(tarinfo, io.BytesIO(content))
+    offset = tar.offset
+    tar.close()
+    if not end_of_archive:
+        return gzip.compress(tar_data.getvalue()[:offset])
+    return gzip.compress(tar_data.getvalue())
+
+
+def write_apk(path, pkgname, pkgver, depends=[], signed=True):
+    pkginfo = ("# Generated by abuild\n"
+               "pkgname = " + pkgname + "\n"
+               "pkgver = " + pkgver + "\n"
+               "pkgdesc = Test package\n"
+               "url = https://postmarketos.org\n"
+               "builddate = 1500000000\n"
+               "size = 4096\n"
+               "arch = x86_64\n"
+               "origin = " + pkgname + "\n"
+               "license = GPL3\n")
+    for depend in depends:
+        pkginfo += "depend = " + depend + "\n"
+    control = tar_gz({".PKGINFO": pkginfo.encode()})
+    data = tar_gz({"usr/bin/" + pkgname: b"#!/bin/sh\n"}, True)
+    with open(path, "wb") as handle:
+        if signed:
+            handle.write(tar_gz({".SIGN.RSA.test.rsa.pub": b"signature"}))
+        handle.write(control + data)
+    return "Q1" + base64.b64encode(hashlib.sha1(control).digest()).decode()
+
+
+def test_pkginfo(args, tmpdir):
+    path = str(tmpdir) + "/hello-world-1-r2.apk"
+    for signed in [True, False]:
+        checksum = write_apk(path, "hello-world", "1-r2", ["busybox", "musl"],
+                             signed)
+        info = pmb.build.index.pkginfo(path)
+        assert info["checksum"] == checksum
+        assert info["pkgname"] == "hello-world"
+        assert info["depend"] == ["busybox", "musl"]
+        assert info["provides"] == []
+        assert info["file_size"] == str(os.path.getsize(path))
+
+    # Apk without .PKGINFO
+    with open(path, "wb") as handle:
+        handle.write(tar_gz({"usr/bin/hello-world": b""}))
+    with pytest.raises(RuntimeError) as e:
+        pmb.build.index.pkginfo(path)
+    assert "Could not find .PKGINFO" in str(e.value)
+
+
+def test_write(args, tmpdir):
+    folder = str(tmpdir) + "/packages/armhf"
+    os.makedirs(folder)
+    checksum = write_apk(folder + "/hello-world-1-r2.apk", "hello-world",
+                         "1-r2", ["busybox"])
+    write_apk(folder + "/hello-world-doc-1-r2.apk", "hello-world-doc",
+              "1-r2")
+
+    # Initial index: all apks get read
+    func = pmb.build.index.write
+    output = str(tmpdir) + "/APKINDEX.tar.gz"
+    assert func(args, folder, "armhf", output) == 2
+    index = pmb.parse.apkindex.parse(args, output)
+    assert sorted(index.keys()) == ["hello-world", "hello-world-doc"]
+    assert index["hello-world"]["version"] == "1-r2"
+    assert index["hello-world"]["depends"] == ["busybox"]
+    assert index["hello-world"]["checksum"] == checksum
+    blocks = pmb.build.index.blocks_existing(output)
+    assert blocks["hello-world-1-r2.apk"][0].split("\n")[3] == "A:armhf"
+
+    # Only new apks get read, removed apks get dropped
+    os.rename(output, folder + "/APKINDEX.tar.gz")
+    future = time.time() + 100
+    os.utime(folder + "/APKINDEX.tar.gz", (future, future))
+    os.remove(folder + "/hello-world-1-r2.apk")
+    write_apk(folder + "/hello-world-1-r3.apk", "hello-world", "1-r3")
+    assert func(args, folder, "armhf", output) == 1
+    args.cache["apkindex"] = {}
+    index = pmb.parse.apkindex.parse(args, output)
+    assert sorted(index.keys()) == ["hello-world", "hello-world-doc"]
+    assert index["hello-world"]["version"] == "1-r3"
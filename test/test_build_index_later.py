@@ -0,0 +1,71 @@
+"""
+Copyright 2017 Oliver Smith
+
+This file is part of pmbootstrap.
+
+pmbootstrap is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+pmbootstrap is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with pmbootstrap.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import os
+import sys
+import pytest
+
+# Import from parent directory
+sys.path.append(os.path.realpath(
+    os.path.join(os.path.dirname(__file__) + "/..")))
+import pmb.build
+import pmb.build.other
+import pmb.helpers.logging
+import pmb.parse.apkindex
+
+
+@pytest.fixture
+def args(request, tmpdir):
+    import pmb.parse
+    sys.argv = ["pmbootstrap.py", "chroot"]
+    args = pmb.parse.arguments()
+    args.log = args.work + "/log_testsuite.txt"
+    pmb.helpers.logging.init(args)
+    request.addfinalizer(args.logfd.close)
+    args.work = str(tmpdir) + "/work"
+    return args
+
+
+def test_index_repo_later(args, monkeypatch):
+    indexed = []
+
+    def index_repo(args, arch=None):
+        indexed.append(arch)
+        args.cache["index_pending"].discard(arch)
+    monkeypatch.setattr(pmb.build.other, "index_repo", index_repo)
+
+    # Marking the same repo multiple times indexes it only once
+    for arch in ["x86_64", "armhf", "x86_64"]:
+        pmb.build.other.index_repo_later(args, arch)
+    assert args.cache["index_pending"] == set(["armhf", "x86_64"])
+    pmb.build.other.index_flush(args, "x86_64")
+    assert indexed == ["x86_64"]
+    pmb.build.other.index_flush(args)
+    assert indexed == ["x86_64", "armhf"]
+    assert args.cache["index_pending"] == set()
+
+    # Reading a pending repo indexes it first, other repos are unaffected
+    indexed.clear()
+    pmb.build.other.index_repo_later(args, "armhf")
+    func = pmb.parse.apkindex.flush_pending_index
+    func(args, args.work + "/packages/x86_64/APKINDEX.tar.gz")
+    func(args, "/some/other/armhf/APKINDEX.tar.gz")
+    assert indexed == []
+    func(args, args.work + "/packages/armhf/APKINDEX.tar.gz")
+    func(args, args.work + "/packages/armhf/APKINDEX.tar.gz")
+    assert indexed == ["armhf"]
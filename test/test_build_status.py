@@ -0,0 +1,136 @@
+"""
+Copyright 2017 Oliver Smith
+
+This file is part of pmbootstrap.
+
+pmbootstrap is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+pmbootstrap is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with pmbootstrap.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import io
+import os
+import sys
+import tarfile
+import pytest
+
+# Import from parent directory
+sys.path.append(os.path.realpath(
+    os.path.join(os.path.dirname(__file__) + "/..")))
+import pmb.build
+import pmb.build.other
+import pmb.helpers.logging
+import pmb.helpers.repo
+
+
+@pytest.fixture
+def args(request, tmpdir):
+    import pmb.parse
+    sys.argv = ["pmbootstrap.py", "chroot"]
+    args = pmb.parse.arguments()
+    args.log = args.work + "/log_testsuite.txt"
+    pmb.helpers.logging.init(args)
+    request.addfinalizer(args.logfd.close)
+
+    # Use a temporary aports and work folder
+    args.aports = str(tmpdir) + "/aports"
+    args.work = str(tmpdir) + "/work"
+    return args
+
+
+def create_aport(args, pkgname, pkgver, arch, makedepends=""):
+    os.makedirs(args.aports + "/main/" + pkgname)
+    with open(args.aports + "/main/" + pkgname + "/APKBUILD", "w") as handle:
+        handle.write("pkgname=" + pkgname + "\npkgver=" + pkgver + "\n"
+                     "pkgrel=0\narch=\"" + arch + "\"\n"
+                     "makedepends=\"" + makedepends + "\"\nsource=\"\"\n")
+
+
+def test_status(args, tmpdir, monkeypatch):
+    create_aport(args, "a", "1", "all", "b")
+    create_aport(args, "b", "2", "all", "c")
+    create_aport(args, "c", "1", "noarch")
+    create_aport(args, "d", "1", "armhf")
+    create_aport(args, "e", "1", "all !armhf")
+
+    # Binary packages: "a" is up to date, "b" is outdated
+    path = str(tmpdir) + "/APKINDEX.tar.gz"
+    data = ("P:a\nV:1-r0\nt:1000\n\nP:b\nV:1-r0\nt:1000\n\n").encode()
+    with tarfile.open(path, "w:gz") as tar:
+        info = tarfile.TarInfo("APKINDEX")
+        info.size = len(data)
+        tar.addfile(info, io.BytesIO(data))
+    monkeypatch.setattr(pmb.helpers.repo, "apkindex_files",
+                        lambda args, arch: [path])
+    args.arch_native = "x86_64"
+    args.timestamp_based_rebuild = False
+
+    outdated = "Binary package out of date (binary: 1-r0, aport: 2-r0)"
+    missing = "No binary package available"
+    assert pmb.build.status(args, ["x86_64", "armhf"]) == [
+        ("x86_64", "c", missing),
+        ("x86_64", "e", missing),
+        ("x86_64", "b", outdated),
+        ("armhf", "b", outdated),
+        ("armhf", "d", missing)]
+
+    # Timestamp based rebuild: sources of "a" are out of sync with git
+    args.timestamp_based_rebuild = True
+    args.cache["aports_files_out_of_sync_with_git"] = [
+        os.path.realpath(args.aports + "/main/a/APKBUILD")]
+    ret = pmb.build.status(args, ["armhf"])
+    assert [pkgname for arch, pkgname, reason in ret] == ["b", "d", "a"]
+
+
+def test_status_aport_hash(args, tmpdir, monkeypatch):
+    create_aport(args, "a", "1", "all")
+    aport = os.path.realpath(args.aports + "/main/a")
+    apkbuild = pmb.parse.apkbuild(args, aport + "/APKBUILD")
+
+    # Package has been built locally (newer than the sources)
+    os.makedirs(args.work + "/packages/x86_64")
+    open(args.work + "/packages/x86_64/a-1-r0.apk", "w").close()
+    pmb.build.other.aport_hash_save(args, ["x86_64"], apkbuild, aport)
+    path = str(tmpdir) + "/APKINDEX.tar.gz"
+    data = ("P:a\nV:1-r0\nt:32503680000\n\n").encode()
+    with tarfile.open(path, "w:gz") as tar:
+        info = tarfile.TarInfo("APKINDEX")
+        info.size = len(data)
+        tar.addfile(info, io.BytesIO(data))
+    monkeypatch.setattr(pmb.helpers.repo, "apkindex_files",
+                        lambda args, arch: [path])
+
+    # Git is not needed
+    def git(args):
+        raise RuntimeError("git should not be called")
+    monkeypatch.setattr(pmb.build.other, "aports_files_out_of_sync_with_git",
+                        git)
+
+    # Unchanged (but touched) sources
+    os.utime(aport + "/APKBUILD")
+    assert pmb.build.other.aport_hash_changed(args, "x86_64", apkbuild,
+                                              aport) is False
+    assert pmb.build.status(args, ["x86_64"]) == []
+
+    # Changed sources (even though they are older than the package), the
+    # checksum is cached for the session
+    with open(aport + "/patch", "w") as handle:
+        handle.write("new file")
+    args.cache["aport_hashes"] = None
+    assert pmb.build.status(args, ["x86_64"]) == []
+    args.cache["aport_hash"] = {}
+    assert [pkgname for arch, pkgname, reason in
+            pmb.build.status(args, ["x86_64"])] == ["a"]
+
+    # Removed binary package: no checksum available
+    os.remove(args.work + "/packages/x86_64/a-1-r0.apk")
+    assert pmb.build.other.aport_hash_changed(args, "x86_64", apkbuild,
+                                              aport) is None
@@ -0,0 +1,90 @@
+"""
+Copyright 2017 Oliver Smith
+
+This file is part of pmbootstrap.
+
+pmbootstrap is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+pmbootstrap is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with pmbootstrap.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import os
+import sys
+import time
+import pytest
+
+# Import from parent directory
+sys.path.append(os.path.realpath(
+    os.path.join(os.path.dirname(__file__) + "/..")))
+import pmb.build
+import pmb.build.timing
+import pmb.helpers.logging
+
+
+@pytest.fixture
+def args(request, tmpdir):
+    import pmb.parse
+    sys.argv = ["pmbootstrap.py", "chroot"]
+    args = pmb.parse.arguments()
+    args.log = args.work + "/log_testsuite.txt"
+    pmb.helpers.logging.init(args)
+    request.addfinalizer(args.logfd.close)
+    args.work = str(tmpdir) + "/work"
+    return args
+
+
+def test_build_timing(args, monkeypatch):
+    os.makedirs(args.work)
+    now = [1500000000.0]
+    monkeypatch.setattr(time, "time", lambda: now[0])
+    apkbuild = {"pkgname": "hello-world", "pkgver": "1", "pkgrel": "0"}
+
+    def build(seconds_abuild, arch="x86_64", pkgname="hello-world"):
+        timer = pmb.build.timing.start()
+        now[0] += 2
+        pmb.build.timing.phase(timer, "init")
+        now[0] += seconds_abuild
+        pmb.build.timing.phase(timer, "abuild")
+        pmb.build.timing.phase(None, "ignored")
+        apkbuild["pkgname"] = pkgname
+        pmb.build.timing.save(args, timer, arch, apkbuild, "built")
+
+    build(100)
+    build(300)
+    build(10, pkgname="small")
+    build(50, arch="armhf")
+    builds = pmb.build.timing.load(args)
+    assert len(builds) == 4
+    assert builds[0]["total"] == 102
+    assert builds[0]["phases"] == {"init": 2, "abuild": 100}
+    assert builds[0]["version"] == "1-r0"
+
+    # Invalid lines get skipped
+    with open(args.work + "/build_times.jsonl", "a") as handle:
+        handle.write("{broken\n")
+    assert len(pmb.build.timing.load(args)) == 4
+
+    # Report: slowest first, trend against the previous builds
+    lines = pmb.build.timing.report(args, 10, "x86_64")
+    assert lines[0].startswith("Slowest packages")
+    assert lines[1].split() == ["x86_64/hello-world", "5:02", "2x", "+196%"]
+    assert lines[2].split() == ["x86_64/small", "12.0s", "1x", "-"]
+    assert lines[3] == "Time per phase (3 builds):"
+    assert lines[4].split() == ["abuild", "6:50", "98.6%"]
+    assert lines[-1].split()[1:] == ["3x", "6:56"]
+    assert len(pmb.build.timing.report(args, 1)) == 7
+
+
+def test_format_seconds():
+    func = pmb.build.timing.format_seconds
+    assert func(2.54) == "2.5s"
+    assert func(62) == "1:02"
+    assert func(3723) == "1:02:03"
@@ -0,0 +1,103 @@
+"""
+Copyright 2017 Oliver Smith
+
+This file is part of pmbootstrap.
+
+pmbootstrap is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+pmbootstrap is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with pmbootstrap.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import os
+import sys
+import pytest
+
+# Import from parent directory
+sys.path.append(os.path.realpath(
+    os.path.join(os.path.dirname(__file__) + "/..")))
+import pmb.chroot
+import pmb.helpers.logging
+import pmb.helpers.run
+
+root_module = sys.modules["pmb.chroot.root"]
+
+
+@pytest.fixture
+def args(request, tmpdir):
+    import pmb.parse
+    sys.argv = ["pmbootstrap.py", "chroot"]
+    args = pmb.parse.arguments()
+    args.log = args.work + "/log_testsuite.txt"
+    pmb.helpers.logging.init(args)
+    request.addfinalizer(args.logfd.close)
+    args.work = str(tmpdir) + "/work"
+    return args
+
+
+@pytest.fixture
+def shell_calls(args, monkeypatch):
+    """
+    Run the scripts on the host instead of in the chroot.
+    """
+    calls = []
+
+    def shell(args, script, log_message, suffix="native", log=True,
+              auto_init=True, return_stdout=False, check=True):
+        calls.append((script, log_message))
+        return pmb.helpers.run.core(args, ["sh", "-c", script], log_message,
+                                    log, return_stdout, check)
+    monkeypatch.setattr(root_module, "shell", shell)
+    return calls
+
+
+def test_root_batch(args, tmpdir, shell_calls):
+    os.makedirs(args.work)
+    folder = str(tmpdir) + "/with space"
+    cmds = [["mkdir", "-p", folder],
+            ["touch", folder + "/it's"],
+            ["ls", folder]]
+    pmb.chroot.root_batch(args, cmds)
+    assert os.path.exists(folder + "/it's")
+    assert len(shell_calls) == 1
+    assert shell_calls[0][1] == ("(native) % mkdir -p '" + folder +
+                                 "' && touch '" + folder + "/it'\"'\"'s' &&"
+                                 " ls '" + folder + "'")
+
+    # Stop at the first failure and name the failed command
+    cmds = [["true"], ["false"], ["touch", folder + "/not-created"]]
+    with pytest.raises(RuntimeError) as e:
+        pmb.chroot.root_batch(args, cmds, working_dir=folder)
+    assert str(e.value) == "Command failed: (native) % false (step 2/3)"
+    assert not os.path.exists(folder + "/not-created")
+    pmb.chroot.root_batch(args, cmds, working_dir=folder, check=False)
+    assert not os.path.exists(folder + "/not-created")
+
+    # Working directory
+    pmb.chroot.root_batch(args, [["touch", "relative"]], working_dir=folder)
+    assert os.path.exists(folder + "/relative")
+    with pytest.raises(RuntimeError) as e:
+        pmb.chroot.root_batch(args, [["true"]], working_dir=folder + "/no")
+    assert "(step" not in str(e.value)
+
+    # Every command gets printed to the log before running it
+    args.logfd.flush()
+    with open(args.log) as handle:
+        assert "% [2/3] false\n" in handle.read()
+
+
+def test_user_batch(args, shell_calls, monkeypatch):
+    monkeypatch.setattr(pmb.helpers.run, "core", lambda *args: None)
+    pmb.chroot.user_batch(args, [["echo", "a b"], ["true"]], "buildroot_armhf",
+                          "/home/user")
+    script, log_message = shell_calls[0]
+    assert script.startswith("su user -c 'cd /home/user || exit 255")
+    assert log_message == ("(buildroot_armhf) % su user -c 'cd /home/user &&"
+                           " echo '\"'\"'a b'\"'\"' && true'")
@@ -0,0 +1,162 @@
+"""
+Copyright 2017 Oliver Smith
+
+This file is part of pmbootstrap.
+
+pmbootstrap is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+pmbootstrap is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with pmbootstrap.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import os
+import sys
+import pytest
+
+# Import from parent directory
+sys.path.append(os.path.realpath(
+    os.path.join(os.path.dirname(__file__) + "/..")))
+import pmb.chroot.overlay
+import pmb.chroot.snapshot
+import pmb.helpers.logging
+import pmb.helpers.mount
+import pmb.helpers.run
+
+
+@pytest.fixture
+def args(request, tmpdir):
+    import pmb.parse
+    sys.argv = ["pmbootstrap.py", "chroot"]
+    args = pmb.parse.arguments()
+    args.log = args.work + "/log_testsuite.txt"
+    pmb.helpers.logging.init(args)
+    request.addfinalizer(args.logfd.close)
+    args.work = str(tmpdir) + "/work"
+    return args
+
+
+@pytest.fixture
+def root_calls(args, monkeypatch):
+    """
+    Record the commands, that would run as root, and run harmless ones
+    without root.
+    """
+    calls = []
+    mounted = []
+
+    def root(args, cmd):
+        calls.append(cmd)
+        if cmd[0] in ["mkdir", "mv", "rm"]:
+            pmb.helpers.run.user(args, cmd)
+        elif cmd[0] == "mount":
+            mounted.append(cmd[-1])
+    monkeypatch.setattr(pmb.helpers.run, "root", root)
+    monkeypatch.setattr(pmb.helpers.mount, "ismount",
+                        lambda folder: folder in mounted)
+    return calls
+
+
+def test_chroot_overlay(args, monkeypatch, root_calls):
+    os.makedirs(args.work + "/cache_chroot_snapshot")
+    snapshot = args.work + "/cache_chroot_snapshot/armhf_key1.tar.gz"
+    monkeypatch.setattr(pmb.chroot.snapshot, "path",
+                        lambda args, suffix: snapshot)
+    chroot = args.work + "/chroot_buildroot_armhf"
+    upper = args.work + "/chroot_upper_buildroot_armhf"
+    lower = args.work + "/chroot_base_armhf_key1"
+
+    # Only in overlay mode, and only for build chroots
+    args.overlay_chroot = True
+    assert pmb.chroot.overlay.enabled(args, "buildroot_armhf")
+    assert not pmb.chroot.overlay.enabled(args, "rootfs_qemu-amd64")
+
+    # No snapshot yet: regular chroot
+    assert not pmb.chroot.overlay.mount(args, "buildroot_armhf")
+    assert root_calls == []
+
+    # Extract lower layer, create upper layer, mount
+    open(snapshot, "w").close()
+    assert pmb.chroot.overlay.mount(args, "buildroot_armhf")
+    assert ["tar", "-xzpf", snapshot, "--numeric-owner", "-C",
+            lower + "_"] in root_calls
+    assert os.path.exists(lower)
+    assert root_calls[-1] == ["mount", "-t", "overlay", "-o",
+                              "lowerdir=" + lower + ",upperdir=" + upper +
+                              "/upper,workdir=" + upper + "/work", "overlay",
+                              chroot]
+    assert os.path.exists(upper + "/upper")
+
+    # Already mounted
+    root_calls.clear()
+    assert pmb.chroot.overlay.mount(args, "buildroot_armhf")
+    assert root_calls == []
+
+    # New snapshot: new lower layer, the old one and the upper layer get
+    # removed (the chroot is not mounted anymore after shutdown)
+    monkeypatch.setattr(pmb.helpers.mount, "ismount", lambda folder: False)
+    with open(upper + "/upper/file", "w") as handle:
+        handle.write("changed in the chroot")
+    snapshot = args.work + "/cache_chroot_snapshot/armhf_key2.tar.gz"
+    open(snapshot, "w").close()
+    with pytest.raises(RuntimeError) as e:
+        pmb.chroot.overlay.mount(args, "buildroot_armhf")
+    assert "overlayfs" in str(e.value)
+    assert not os.path.exists(lower)
+    assert os.path.exists(args.work + "/chroot_base_armhf_key2")
+    assert not os.path.exists(upper + "/upper/file")
+    with open(upper + "/base") as handle:
+        assert handle.read() == args.work + "/chroot_base_armhf_key2"
+
+
+def test_chroot_overlay_existing_chroot(args, root_calls):
+    # Chroots created without overlay stay as they are
+    os.makedirs(args.work + "/chroot_native/bin")
+    assert not pmb.chroot.overlay.mount(args, "native")
+    assert root_calls == []
+
+
+def test_chroot_overlay_interrupted(args, monkeypatch, root_calls):
+    os.makedirs(args.work + "/cache_chroot_snapshot")
+    snapshot = args.work + "/cache_chroot_snapshot/armhf_key1.tar.gz"
+    open(snapshot, "w").close()
+    monkeypatch.setattr(pmb.chroot.snapshot, "path",
+                        lambda args, suffix: snapshot)
+    upper = args.work + "/chroot_upper_buildroot_armhf"
+    lower = args.work + "/chroot_base_armhf_key1"
+
+    # Upper layer without marker: discarded and created again
+    os.makedirs(upper + "/upper")
+    monkeypatch.setattr(pmb.helpers.mount, "ismount", lambda folder: False)
+    with pytest.raises(RuntimeError) as e:
+        pmb.chroot.overlay.mount(args, "buildroot_armhf")
+    assert "overlayfs" in str(e.value)
+    assert ["rm", "-rf", upper] in root_calls
+    with open(upper + "/base") as handle:
+        assert handle.read() == lower
+
+
+def test_chroot_overlay_base_in_use(args, monkeypatch, root_calls):
+    os.makedirs(args.work + "/cache_chroot_snapshot")
+    snapshot = args.work + "/cache_chroot_snapshot/armhf_key2.tar.gz"
+    open(snapshot, "w").close()
+    monkeypatch.setattr(pmb.chroot.snapshot, "path",
+                        lambda args, suffix: snapshot)
+
+    # Lower layers of mounted chroots do not get removed
+    in_use = args.work + "/chroot_base_armhf_key1"
+    unused = args.work + "/chroot_base_armhf_key0"
+    os.makedirs(in_use)
+    os.makedirs(unused)
+    monkeypatch.setattr(pmb.helpers.mount, "mount_table",
+                        lambda: {"lowerdirs": set([in_use])})
+    assert (pmb.chroot.overlay.base(args, "buildroot_armhf") ==
+            args.work + "/chroot_base_armhf_key2")
+    assert os.path.exists(in_use)
+    assert not os.path.exists(unused)
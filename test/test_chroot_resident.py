@@ -0,0 +1,84 @@
+"""
+Copyright 2017 Oliver Smith
+
+This file is part of pmbootstrap.
+
+pmbootstrap is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+pmbootstrap is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with pmbootstrap.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import os
+import sys
+import pytest
+
+# Import from parent directory
+sys.path.append(os.path.realpath(
+    os.path.join(os.path.dirname(__file__) + "/..")))
+import pmb.chroot.resident
+import pmb.helpers.logging
+
+
+@pytest.fixture
+def args(request, tmpdir):
+    import pmb.parse
+    sys.argv = ["pmbootstrap.py", "chroot"]
+    args = pmb.parse.arguments()
+    args.log = args.work + "/log_testsuite.txt"
+    pmb.helpers.logging.init(args)
+    request.addfinalizer(args.logfd.close)
+    args.work = str(tmpdir) + "/work"
+    return args
+
+
+def test_resident_run(args, tmpdir):
+    os.makedirs(args.work)
+    func = pmb.chroot.resident.run
+    cmd_full = ["sh"]
+
+    # Output goes to the log, the shell gets started once
+    func(args, "native", cmd_full, "cd /; echo to-log; echo err >&2", "msg")
+    process = args.cache["resident"]["native"]["process"]
+    assert func(args, "native", cmd_full, "printf 'a\\nb'", "msg", True) == \
+        "a\nb"
+    assert args.cache["resident"]["native"]["process"] == process
+
+    # Subshells: directory changes and variables do not leak
+    func(args, "native", cmd_full, "cd " + str(tmpdir) + "; X=1", "msg")
+    assert func(args, "native", cmd_full, "pwd; echo $X", "msg",
+                True) == os.getcwd() + "\n\n"
+
+    # Stdin is not available to commands
+    assert func(args, "native", cmd_full, "cat", "msg", True) == ""
+
+    # Failing commands
+    with pytest.raises(RuntimeError) as e:
+        func(args, "native", cmd_full, "exit 3", "failing command")
+    assert str(e.value) == "Command failed: failing command"
+    assert func(args, "native", cmd_full, "false", "msg", True, False) is None
+
+    # Large output, in multiple chunks
+    output = func(args, "native", cmd_full, "seq 1 100000", "msg", True)
+    assert output.split("\n")[-2] == "100000"
+
+    # Stop the shell, it gets started again when needed
+    pmb.chroot.resident.stop(args)
+    assert args.cache["resident"] == {}
+    assert process.returncode == 0
+    func(args, "native", cmd_full, "true", "msg")
+    assert args.cache["resident"]["native"]["process"] != process
+    pmb.chroot.resident.stop(args, "native")
+
+    args.logfd.flush()
+    with open(args.log) as handle:
+        log = handle.read()
+    assert "to-log\nerr\n" in log
+    assert "pmbootstrap-resident-" not in log
@@ -0,0 +1,120 @@
+"""
+Copyright 2017 Oliver Smith
+
+This file is part of pmbootstrap.
+
+pmbootstrap is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+pmbootstrap is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with pmbootstrap.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import os
+import sys
+import pytest
+
+# Import from parent directory
+sys.path.append(os.path.realpath(
+    os.path.join(os.path.dirname(__file__) + "/..")))
+import pmb.chroot.apk_static
+import pmb.chroot.snapshot
+import pmb.config
+import pmb.helpers.logging
+import pmb.helpers.mount
+import pmb.helpers.run
+import pmb.parse.arch
+
+
+@pytest.fixture
+def args(request, tmpdir):
+    import pmb.parse
+    sys.argv = ["pmbootstrap.py", "chroot"]
+    args = pmb.parse.arguments()
+    args.log = args.work + "/log_testsuite.txt"
+    pmb.helpers.logging.init(args)
+    request.addfinalizer(args.logfd.close)
+    args.work = str(tmpdir) + "/work"
+    return args
+
+
+def test_chroot_snapshot_path(args, monkeypatch):
+    monkeypatch.setattr(pmb.chroot.apk_static, "latest_version",
+                        lambda args: "2.7.5-r0")
+    func = pmb.chroot.snapshot.path
+    path = func(args, "buildroot_armhf")
+    assert path.startswith(args.work + "/cache_chroot_snapshot/armhf_")
+    assert func(args, "buildroot_armhf") == path
+    assert func(args, "buildroot_aarch64") != path
+
+    # Invalidated by changes of the apk-tools version, the build packages and
+    # the mirror
+    monkeypatch.setattr(pmb.chroot.apk_static, "latest_version",
+                        lambda args: "2.8.0-r0")
+    assert func(args, "buildroot_armhf") != path
+    monkeypatch.setattr(pmb.chroot.apk_static, "latest_version",
+                        lambda args: "2.7.5-r0")
+    monkeypatch.setattr(pmb.config, "build_packages",
+                        pmb.config.build_packages + ["git"])
+    assert func(args, "buildroot_armhf") != path
+    monkeypatch.undo()
+    monkeypatch.setattr(pmb.chroot.apk_static, "latest_version",
+                        lambda args: "2.7.5-r0")
+    args.mirror_alpine = "http://example.org/alpine/"
+    assert func(args, "buildroot_armhf") != path
+
+
+def test_chroot_snapshot_save_restore(args, tmpdir, monkeypatch):
+    # Work folder behind a symlink (the mountpoints are resolved)
+    os.makedirs(str(tmpdir) + "/work_target/cache_chroot_snapshot")
+    os.symlink(str(tmpdir) + "/work_target", args.work)
+    chroot = args.work + "/chroot_buildroot_armhf"
+    chroot_realpath = str(tmpdir) + "/work_target/chroot_buildroot_armhf"
+    target = args.work + "/cache_chroot_snapshot/armhf_new.tar.gz"
+    old = args.work + "/cache_chroot_snapshot/armhf_old.tar.gz"
+    open(old, "w").close()
+    monkeypatch.setattr(pmb.chroot.snapshot, "path",
+                        lambda args, suffix: target)
+    monkeypatch.setattr(pmb.helpers.mount, "umount_all_list",
+                        lambda prefix: [chroot_realpath + "/proc",
+                                        chroot_realpath + "/var/cache/apk"])
+    cmds = []
+
+    def root(args, cmd):
+        cmds.append(cmd)
+        if cmd[0] == "mv":
+            os.rename(cmd[1], cmd[2])
+        elif cmd[0] == "rm":
+            os.remove(cmd[1])
+        elif cmd[0] == "tar" and cmd[1] == "-czf":
+            open(cmd[2], "w").close()
+    monkeypatch.setattr(pmb.helpers.run, "root", root)
+
+    # Rootfs chroots are not supported
+    pmb.chroot.snapshot.save(args, "rootfs_qemu-amd64")
+    assert not pmb.chroot.snapshot.restore(args, "rootfs_qemu-amd64")
+    assert cmds == []
+
+    # Save without mounted folders, replace the old snapshot
+    pmb.chroot.snapshot.save(args, "buildroot_armhf")
+    assert cmds[0] == ["tar", "-czf", target + "_", "--numeric-owner", "-C",
+                       chroot, "--exclude", "./proc", "--exclude",
+                       "./var/cache/apk", "."]
+    assert os.path.exists(target)
+    assert not os.path.exists(old)
+
+    # Restore (without emulation, qemu-user-static is not needed)
+    cmds.clear()
+    monkeypatch.setattr(pmb.parse.arch, "cpu_emulation_required",
+                        lambda args, arch: False)
+    assert pmb.chroot.snapshot.restore(args, "buildroot_armhf")
+    assert cmds == [["tar", "-xzpf", target, "--numeric-owner", "-C",
+                     chroot]]
+    os.remove(target)
+    assert not pmb.chroot.snapshot.restore(args, "buildroot_armhf")
@@ -0,0 +1,105 @@
+"""
+Copyright 2017 Oliver Smith
+
+This file is part of pmbootstrap.
+
+pmbootstrap is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+pmbootstrap is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with pmbootstrap.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import os
+import subprocess
+import sys
+import pytest
+
+# Import from parent directory
+sys.path.append(os.path.realpath(
+    os.path.join(os.path.dirname(__file__) + "/..")))
+import pmb.build.other
+import pmb.helpers.logging
+import pmb.helpers.run
+
+
+@pytest.fixture
+def args(request, tmpdir):
+    import pmb.parse
+    sys.argv = ["pmbootstrap.py", "chroot"]
+    args = pmb.parse.arguments()
+    args.log = args.work + "/log_testsuite.txt"
+    pmb.helpers.logging.init(args)
+    request.addfinalizer(args.logfd.close)
+
+    # Use a temporary aports and work folder
+    args.aports = str(tmpdir) + "/aports"
+    args.work = str(tmpdir) + "/work"
+    return args
+
+
+def write(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as handle:
+        handle.write(content)
+
+
+def read(path):
+    with open(path) as handle:
+        return handle.read()
+
+
+def test_copy_to_buildpath(args, monkeypatch):
+    # Record the scripts, use sudo only when not running as root already
+    scripts = []
+
+    def root(args, cmd):
+        assert cmd[:2] == ["sh", "-c"]
+        scripts.append(cmd[2])
+        subprocess.check_call((["sudo"] if os.geteuid() else []) + cmd)
+    monkeypatch.setattr(pmb.helpers.run, "root", root)
+
+    aport = args.aports + "/main/hello-world"
+    build = args.work + "/chroot_native/home/user/build"
+    write(aport + "/APKBUILD", "pkgname=hello-world\n")
+    write(aport + "/patches/fix.patch", "patch")
+    func = pmb.build.other.copy_to_buildpath
+
+    # Initial copy
+    func(args, "hello-world")
+    assert read(build + "/APKBUILD") == "pkgname=hello-world\n"
+    assert read(build + "/patches/fix.patch") == "patch"
+    assert len(scripts) == 1
+
+    # Nothing changed
+    func(args, "hello-world")
+    assert len(scripts) == 1
+
+    # Changed file, removed file, build output and a file replaced by a
+    # folder
+    write(aport + "/APKBUILD", "pkgname=hello-world\npkgver=1\n")
+    os.remove(aport + "/patches/fix.patch")
+    write(build + "/src/hello-world-1/main.c", "int main")
+    write(aport + "/extra/file", "file")
+    write(build + "/extra", "folder in the aport")
+    func(args, "hello-world")
+    assert len(scripts) == 2
+    assert "APKBUILD" in scripts[1]
+    assert sorted(os.listdir(build)) == ["APKBUILD", "extra", "patches"]
+    assert read(build + "/APKBUILD") == "pkgname=hello-world\npkgver=1\n"
+    assert read(build + "/extra/file") == "file"
+    assert os.listdir(build + "/patches") == []
+
+    # Only the output of the last build needs to be removed
+    write(build + "/src/hello-world-1/main.c", "int main")
+    write(build + "/pkg/hello-world/usr/bin/hello-world", "binary")
+    func(args, "hello-world")
+    assert len(scripts) == 3
+    assert "chown" not in scripts[2]
+    assert sorted(os.listdir(build)) == ["APKBUILD", "extra", "patches"]
@@ -0,0 +1,71 @@
+"""
+Copyright 2017 Oliver Smith
+
+This file is part of pmbootstrap.
+
+pmbootstrap is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+pmbootstrap is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with pmbootstrap.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import io
+import os
+import sys
+import tarfile
+import pytest
+
+# Import from parent directory
+sys.path.append(os.path.realpath(
+    os.path.join(os.path.dirname(__file__) + "/..")))
+import pmb.helpers.logging
+import pmb.helpers.repo
+import pmb.parse.depends
+
+
+@pytest.fixture
+def args(request, tmpdir):
+    import pmb.parse
+    sys.argv = ["pmbootstrap.py", "chroot"]
+    args = pmb.parse.arguments()
+    args.log = args.work + "/log_testsuite.txt"
+    pmb.helpers.logging.init(args)
+    request.addfinalizer(args.logfd.close)
+    args.work = str(tmpdir) + "/work"
+    return args
+
+
+def create_apkindex(path, content):
+    data = content.encode("utf-8")
+    with tarfile.open(path, "w:gz") as tar:
+        info = tarfile.TarInfo("APKINDEX")
+        info.size = len(data)
+        tar.addfile(info, io.BytesIO(data))
+
+
+def test_recurse(args, tmpdir, monkeypatch):
+    path = str(tmpdir) + "/APKINDEX.tar.gz"
+    create_apkindex(path, "P:a\nV:1-r0\nt:1\nD:b so:libc.so\n\n"
+                          "P:b\nV:1-r0\nt:1\nD:a\n\n"
+                          "P:musl\nV:1-r0\nt:1\np:so:libc.so\n\n")
+    monkeypatch.setattr(pmb.helpers.repo, "apkindex_files",
+                        lambda args, arch: [path])
+    func = pmb.parse.depends.recurse
+    assert func(args, ["a"], "x86_64", in_aports=False) == ["a", "b", "musl"]
+
+    # Cached result
+    args.cache["apkindex_merged"]["x86_64"]["ret"]["a"]["depends"] = []
+    assert func(args, ["a"], "x86_64", in_aports=False) == ["a", "b", "musl"]
+
+    # APKINDEX has changed
+    create_apkindex(path, "P:a\nV:1-r0\nt:1\nD:c\n\n")
+    os.utime(path, (0, 0))
+    assert func(args, ["a"], "x86_64", in_aports=False) == ["a"]
+    assert func(args, ["c"], "x86_64", in_aports=False) == []
@@ -18,6 +18,7 @@ along with pmbootstrap.  If not, see <http://www.gnu.org/licenses/>.
 """
 import os
 import sys
+import pytest
 
 # Import from parent directory
 sys.path.append(os.path.realpath(
@@ -43,3 +44,32 @@ def test_umount_all_list(tmpdir):
     ret = pmb.helpers.mount.umount_all_list("/test", fake_mounts)
     assert ret == ["/test/var/cache", "/test/proc", "/test/home/user/packages",
                    "/test"]
+
+
+def test_parse_mounts():
+    lines = ["proc /proc proc rw 0 0\n", "/dev/sda1 /mnt ext4 rw 0 0\n",
+             "overlay /chroot overlay rw,lowerdir=/a:/b,upperdir=/c,"
+             "workdir=/d 0 0\n"]
+    ret = pmb.helpers.mount.parse_mounts(lines, "test")
+    assert ret["mountpoints"] == ["/proc", "/mnt", "/chroot"]
+    assert ret["lookup"] == set(["proc", "/proc", "/dev/sda1", "/mnt",
+                                 "overlay", "/chroot"])
+    assert ret["lowerdirs"] == set(["/a", "/b"])
+
+    with pytest.raises(RuntimeError) as e:
+        pmb.helpers.mount.parse_mounts(["broken\n"], "test")
+    assert str(e.value) == "Failed to parse line in test: broken\n"
+
+
+def test_mount_table(tmpdir):
+    func = pmb.helpers.mount.ismount
+    assert func("/proc")
+    assert not func(str(tmpdir))
+
+    # The table gets cached, and read again after changed()
+    table = pmb.helpers.mount.mount_table()
+    assert table["stale"] is False
+    table["lookup"].add(str(tmpdir))
+    assert func(str(tmpdir))
+    pmb.helpers.mount.changed()
+    assert not func(str(tmpdir))
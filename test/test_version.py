@@ -76,3 +76,29 @@ def test_version(args):
     for error in errors:
         print(error)
     assert errors == []
+
+
+def test_version_key():
+    func = pmb.parse.version.compare
+    key = pmb.parse.version.key
+
+    # Sort versions without post-release suffixes by their keys
+    versions = ["1-r1", "1_rc1", "1", "0.9b", "1.1", "0.9", "1a",
+                "1_alpha2", "1_alpha10", "0.10", "1-r0"]
+    assert sorted(versions, key=key) == ["0.9", "0.9b", "0.10", "1_alpha2",
+                                         "1_alpha10", "1_rc1", "1", "1-r0",
+                                         "1-r1", "1a", "1.1"]
+    for a in versions:
+        for b in versions:
+            assert func(a, b) == (key(a) > key(b)) - (key(a) < key(b))
+
+    # Post-release suffixes: apk's comparison is not transitive
+    assert func("1-r1", "1_p-r1") == 0
+    assert func("1_p-r1", "1-r2") == 0
+    assert func("1-r1", "1-r2") == -1
+    assert func("1_p1", "1") == 1
+    assert func("1_git20170101", "1_git20170102") == -1
+
+    # Fuzzy comparison
+    assert func("1.0", "1.0-r1", True) == 0
+    assert func("1.0", "1.1", True) == -1